@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""Cold storage for the bodies of old reports.
+
+Reports older than ARCHIVE_AFTER_DAYS have their raw_transcription and
+processed_text moved out of the reports table into a compressed,
+content-addressed store. The report row keeps its id, title, dates and
+template, plus archive_digest (the SHA-256 of the stored body). The row
+and its indexes stay small, and listings never read the bodies.
+
+Stores (ARCHIVE_STORE):
+
+  table   the report_archive table in the main database (default); the
+          move happens in one transaction
+  files   ARCHIVE_DIR/<digest[:2]>/<digest>, for keeping bodies out of the
+          database and its backups entirely
+
+Bodies are compressed with zstd when the zstandard package is installed,
+otherwise with gzip. The codec is recognised from the data when reading,
+so the two can be mixed. Identical bodies are stored once.
+
+rehydrate() fills archived bodies back into loaded Report instances
+without writing anything, so readers such as GET /reports/{id} see no
+difference. Editing a report makes it hot again. Blobs no longer
+referenced by any report are removed by collect_garbage(), unless they
+were written or reused within GC_GRACE_SECONDS: an archival batch that
+reuses a blob commits its reference later, possibly in another worker.
+
+On SQLite the FTS5 index would otherwise keep a full copy of every
+archived body, so archiving drops the bodies from it and archived reports
+are found by title only. The PostgreSQL index stores lexemes rather than
+text and keeps matching archived bodies.
+
+Usage:
+    python archive.py [--older-than-days 90] [--batch-size 500] [--dry-run] [--gc]
+"""
+import os
+import gzip
+import fcntl
+import json
+import asyncio
+import hashlib
+import logging
+import argparse
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+
+import search
+from database import SessionLocal, Report, ArchivedReportBody
+from executor import run_db
+
+try:
+    # Optional: better ratio and faster reads than gzip
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+# "table" or "files"
+ARCHIVE_STORE = os.getenv("ARCHIVE_STORE", "table").lower()
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+# "auto" (zstd if installed), "zstd" or "gzip"
+ARCHIVE_COMPRESSION = os.getenv("ARCHIVE_COMPRESSION", "auto").lower()
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+# Run archival from the app this often; 0 leaves it to the CLI (e.g. a cron job)
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "0"))
+# Blobs written or reused more recently than this are never garbage-collected:
+# the report update that refers to them may not have committed yet
+GC_GRACE_SECONDS = 3600
+
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+_GZIP_MAGIC = b"\x1f\x8b"
+
+
+def compress(data: bytes) -> bytes:
+    use_zstd = ARCHIVE_COMPRESSION == "zstd" or (ARCHIVE_COMPRESSION == "auto" and zstandard is not None)
+    if use_zstd:
+        if zstandard is None:
+            raise RuntimeError("ARCHIVE_COMPRESSION=zstd needs the zstandard package")
+        return zstandard.ZstdCompressor(level=9).compress(data)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def decompress(data: bytes) -> bytes:
+    if data.startswith(_ZSTD_MAGIC):
+        if zstandard is None:
+            raise RuntimeError("Archived report body is zstd-compressed but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if data.startswith(_GZIP_MAGIC):
+        return gzip.decompress(data)
+    raise ValueError("Unrecognised archive encoding")
+
+
+def encode_body(raw_transcription: Optional[str], processed_text: Optional[str]) -> bytes:
+    return json.dumps(
+        {"raw_transcription": raw_transcription, "processed_text": processed_text},
+        ensure_ascii=False, sort_keys=True, separators=(",", ":"),
+    ).encode("utf-8")
+
+
+class TableStore:
+    """Blobs in the report_archive table, written in the caller's transaction"""
+
+    def put(self, db: Session, digest: str, data: bytes):
+        # Touching an existing blob keeps collect_garbage() off it until our reference commits.
+        # A concurrent delete either waits for this transaction (row lock) or leaves no row to touch.
+        touched = db.execute(
+            update(ArchivedReportBody).where(ArchivedReportBody.digest == digest)
+            .values(touched_at=datetime.utcnow())
+        ).rowcount
+        if not touched:
+            db.add(ArchivedReportBody(digest=digest, data=compress(data), size=len(data)))
+            db.flush()
+
+    def get_many(self, db: Session, digests: Iterable[str]) -> Dict[str, bytes]:
+        rows = db.execute(
+            select(ArchivedReportBody.digest, ArchivedReportBody.data)
+            .where(ArchivedReportBody.digest.in_(list(digests)))
+        )
+        return {digest: decompress(data) for digest, data in rows}
+
+    def collect_garbage(self, db: Session) -> int:
+        referenced = select(Report.archive_digest).where(Report.archive_digest.isnot(None))
+        cutoff = datetime.utcnow() - timedelta(seconds=GC_GRACE_SECONDS)
+        deleted = db.execute(
+            delete(ArchivedReportBody).where(
+                ArchivedReportBody.digest.notin_(referenced),
+                # Rows from before touched_at existed fall back to created_at
+                func.coalesce(ArchivedReportBody.touched_at, ArchivedReportBody.created_at) < cutoff,
+            ).execution_options(synchronize_session=False)
+        ).rowcount
+        db.commit()
+        return deleted
+
+
+class FileStore:
+    """Blobs as files under ARCHIVE_DIR, fanned out by the first two hex digits"""
+
+    def __init__(self, root: str = ARCHIVE_DIR):
+        self.root = root
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    @contextmanager
+    def _lock(self, operation: int):
+        """Shared for put(), exclusive for collect_garbage(), across all processes using the directory"""
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, ".lock"), "a") as f:
+            fcntl.flock(f, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def put(self, db: Session, digest: str, data: bytes):
+        path = self.path(digest)
+        with self._lock(fcntl.LOCK_SH):
+            if os.path.exists(path):
+                # Restart the grace period: our reference has not committed yet
+                os.utime(path)
+                return
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(compress(data))
+            os.replace(tmp_path, path)
+
+    def get_many(self, db: Session, digests: Iterable[str]) -> Dict[str, bytes]:
+        bodies = {}
+        for digest in digests:
+            try:
+                with open(self.path(digest), "rb") as f:
+                    bodies[digest] = decompress(f.read())
+            except FileNotFoundError:
+                pass
+        return bodies
+
+    def collect_garbage(self, db: Session) -> int:
+        referenced = set(db.scalars(select(Report.archive_digest).where(Report.archive_digest.isnot(None))))
+        cutoff = datetime.now().timestamp() - GC_GRACE_SECONDS
+        deleted = 0
+        # Exclusive, so no put() can reuse a file between its mtime check and its removal
+        with self._lock(fcntl.LOCK_EX):
+            for directory, _, filenames in os.walk(self.root):
+                for filename in filenames:
+                    path = os.path.join(directory, filename)
+                    if directory == self.root or filename in referenced:
+                        continue
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        deleted += 1
+        return deleted
+
+
+def create_store():
+    if ARCHIVE_STORE == "files":
+        return FileStore()
+    return TableStore()
+
+
+store = create_store()
+
+
+def rehydrate(db: Session, reports: List[Report]) -> List[Report]:
+    """Load archived bodies into the given reports (one store lookup for all of them)"""
+    cold = [report for report in reports if report is not None and report.archive_digest]
+    if not cold:
+        return reports
+    bodies = store.get_many(db, {report.archive_digest for report in cold})
+    for report in cold:
+        data = bodies.get(report.archive_digest)
+        if data is None:
+            raise RuntimeError(f"Archived body {report.archive_digest} of report {report.id} is missing")
+        body = json.loads(data)
+        # Committed values: the session does not see a change and never writes them back
+        set_committed_value(report, "raw_transcription", body["raw_transcription"])
+        set_committed_value(report, "processed_text", body["processed_text"])
+    return reports
+
+
+def archive_batch(db: Session, cutoff: datetime, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Move the bodies of up to batch_size hot reports created before cutoff; returns how many moved"""
+    rows = db.execute(
+        select(Report.id, Report.updated_at, Report.raw_transcription, Report.processed_text)
+        .where(Report.created_at < cutoff, Report.archive_digest.is_(None))
+        .order_by(Report.id)
+        .limit(batch_size)
+    ).all()
+    moved = []
+    for report_id, updated_at, raw_transcription, processed_text in rows:
+        data = encode_body(raw_transcription, processed_text)
+        digest = hashlib.sha256(data).hexdigest()
+        store.put(db, digest, data)
+        # Core update: no ORM events, so the search index is updated below.
+        # The updated_at check skips reports edited since they were read; setting it keeps onupdate off.
+        if db.execute(
+            update(Report.__table__)
+            .where(Report.__table__.c.id == report_id, Report.__table__.c.updated_at == updated_at,
+                   Report.__table__.c.archive_digest.is_(None))
+            .values(raw_transcription=None, processed_text=None, archive_digest=digest, updated_at=updated_at)
+        ).rowcount:
+            moved.append(report_id)
+    search.drop_archived_bodies(db.connection(), moved)
+    db.commit()
+    return len(moved)
+
+
+def archive_old_reports(older_than_days: float = ARCHIVE_AFTER_DAYS, batch_size: int = ARCHIVE_BATCH_SIZE,
+                        limit: Optional[int] = None) -> int:
+    """Archive every eligible report in batches, each in its own transaction"""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    total = 0
+    with SessionLocal() as db:
+        while limit is None or total < limit:
+            size = batch_size if limit is None else min(batch_size, limit - total)
+            moved = archive_batch(db, cutoff, size)
+            total += moved
+            if moved < size:
+                break
+    if total:
+        logger.info(f"Archived {total} reports older than {older_than_days:g} days")
+    return total
+
+
+def count_eligible(older_than_days: float = ARCHIVE_AFTER_DAYS) -> int:
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    with SessionLocal() as db:
+        return db.scalar(
+            select(func.count()).select_from(Report)
+            .where(Report.created_at < cutoff, Report.archive_digest.is_(None))
+        )
+
+
+def collect_garbage() -> int:
+    with SessionLocal() as db:
+        return store.collect_garbage(db)
+
+
+async def archive_periodically():
+    """Archive old reports every ARCHIVE_INTERVAL_SECONDS; runs for the lifetime of the app.
+
+    Every worker process runs this. Concurrent rounds are safe: archive_batch
+    only moves reports that are still hot, and garbage collection leaves
+    recently touched blobs alone.
+    """
+    while True:
+        try:
+            await run_db(archive_old_reports, reject_when_full=False)
+            await run_db(collect_garbage, reject_when_full=False)
+        except Exception as e:
+            logger.warning(f"Report archival failed: {e}")
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--older-than-days", type=float, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument("--limit", type=int, default=None, help="Archive at most this many reports")
+    parser.add_argument("--dry-run", action="store_true", help="Only count the reports that would be archived")
+    parser.add_argument("--gc", action="store_true", help="Also delete stored bodies no report refers to")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    from database import create_tables
+    create_tables()
+    search.ensure_search_index()
+    if args.dry_run:
+        print(f"{count_eligible(args.older_than_days)} reports would be archived")
+        return
+    print(f"Archived {archive_old_reports(args.older_than_days, args.batch_size, args.limit)} reports")
+    if args.gc:
+        print(f"Deleted {collect_garbage()} unreferenced bodies")
+
+
+if __name__ == "__main__":
+    main()
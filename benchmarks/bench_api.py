@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+Load test for the HTTP API against the offline stub LLM.
+
+Each scenario (/process at three dictation sizes, /recent-reports/,
+/reports/{id}, /templates, /prompts/active) is driven by --concurrency
+closed-loop clients for --requests requests. Throughput and p50/p95/p99
+latency are reported for every combination of:
+
+  mode     inprocess (httpx ASGITransport, no network) and/or
+           uvicorn (a real server subprocess over TCP)
+  dataset  a fresh SQLite database seeded with N reports, for each N in
+           --seed-reports (e.g. 0 and 50000)
+
+Every run uses its own process and database file, since the app reads
+its configuration at import time. /process dictations are made unique so
+the response cache never answers them.
+
+Results can be saved as a baseline and compared against later. The
+committed benchmarks/baseline.json was recorded with the default settings;
+absolute numbers depend on the machine, so re-record it on the machine
+that runs the comparison (e.g. the CI runner) before relying on it:
+
+    python benchmarks/bench_api.py --save-baseline benchmarks/baseline.json
+    python benchmarks/bench_api.py --compare benchmarks/baseline.json --tolerance 0.25
+
+--compare exits with status 1 when a scenario's p95 grows, or its
+throughput drops, by more than the tolerance, and with status 2 when no
+scenario could be compared.
+
+With no seeded reports, /reports/{id} reads a report the benchmark
+creates through the API first.
+
+Usage:
+    python benchmarks/bench_api.py [--modes inprocess,uvicorn] [--seed-reports 0,50000]
+                                   [--scenarios all] [--requests 200] [--concurrency 8]
+                                   [--stub-latency-ms 50] [--uvicorn-workers 1]
+                                   [--save-baseline FILE] [--compare FILE] [--tolerance 0.25]
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import random
+import asyncio
+import argparse
+import tempfile
+import platform
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+
+import httpx
+
+from bench_normalizer import make_dictation
+
+PROCESS_SCENARIOS = {
+    # name: (dictation characters, template)
+    "process_short": (300, None),
+    "process_standard": (1_500, "chest_xray"),
+    "process_long": (5_000, "abdominal_ct"),
+}
+READ_SCENARIOS = ("recent_reports", "report_by_id", "templates", "prompts_active")
+SCENARIOS = tuple(PROCESS_SCENARIOS) + READ_SCENARIOS
+
+SEED_BATCH = 5_000
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def bench_env(database_url, stub_latency_ms):
+    """Environment for the app under test: stub LLM, no client-side throttling, quiet logs"""
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": database_url,
+        "LLM_PROVIDER": "stub",
+        "LLM_STUB_LATENCY_MS": str(stub_latency_ms),
+        "LLM_STUB_JITTER_MS": str(stub_latency_ms / 5),
+        "LLM_REQUESTS_PER_MINUTE": "0",
+        "LLM_INPUT_TOKENS_PER_MINUTE": "0",
+        "LLM_OUTPUT_TOKENS_PER_MINUTE": "0",
+        "LOG_LEVEL": "WARNING",
+        "TRACE_SAMPLE_RATE": "0",
+        "PYTHONPATH": REPO_ROOT,
+    })
+    return env
+
+
+def seed_reports(count):
+    """Bulk-insert synthetic reports into the configured database"""
+    import datetime
+    from database import Report, SessionLocal, create_tables
+
+    create_tables()
+    rng = random.Random(0)
+    templates = [None, "chest_xray", "abdominal_ct"]
+    now = datetime.datetime.utcnow()
+    with SessionLocal() as db:
+        for start in range(0, count, SEED_BATCH):
+            rows = []
+            for i in range(start, min(count, start + SEED_BATCH)):
+                text = make_dictation(rng.randint(200, 2_000), seed=i)
+                created = now - datetime.timedelta(minutes=count - i)
+                rows.append({
+                    "title": f"Report {i}",
+                    "raw_transcription": text,
+                    "processed_text": text,
+                    "template_name": templates[i % len(templates)],
+                    "created_at": created,
+                    "updated_at": created,
+                })
+            db.execute(Report.__table__.insert(), rows)
+            db.commit()
+
+
+def make_request(scenario, i, report_ids):
+    """(method, path, json body) for request i of a scenario"""
+    if scenario in PROCESS_SCENARIOS:
+        chars, template = PROCESS_SCENARIOS[scenario]
+        # The trailing counter keeps every dictation out of the response cache
+        text = f"{make_dictation(chars, seed=i)} reference {i} {time.time_ns()}"
+        return "POST", "/process", {"text": text, "template_name": template}
+    if scenario == "recent_reports":
+        return "GET", "/recent-reports/?limit=20", None
+    if scenario == "report_by_id":
+        return "GET", f"/reports/{random.choice(report_ids)}", None
+    if scenario == "templates":
+        return "GET", "/templates", None
+    return "GET", "/prompts/active", None
+
+
+async def run_scenario(client, scenario, requests, concurrency, report_ids):
+    latencies = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def client_loop():
+        nonlocal errors
+        for i in counter:
+            method, path, body = make_request(scenario, i, report_ids)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body)
+                # /process reports some failures as a 200 with an "error" key
+                ok = response.status_code < 400 and '"error":' not in response.text[:200]
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": requests,
+        "errors": errors,
+        "rps": round((requests - errors) / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+async def create_report(client):
+    """A report for /reports/{id} to read when the dataset is empty"""
+    response = await client.post("/reports/", json={
+        "title": "Benchmark report", "raw_transcription": make_dictation(1_000),
+        "processed_text": make_dictation(1_000, seed=1), "template_name": "chest_xray",
+    })
+    if response.status_code != 200:
+        raise RuntimeError(f"Could not create a report for report_by_id: {response.status_code} {response.text[:200]}")
+    return response.json()["id"]
+
+
+async def run_scenarios(client, args, report_ids):
+    results = {}
+    for scenario in args.scenarios:
+        if scenario == "report_by_id" and not report_ids:
+            report_ids = [await create_report(client)]
+        # Warm-up requests are not measured
+        await run_scenario(client, scenario, min(10, args.requests), 1, report_ids)
+        results[scenario] = await run_scenario(client, scenario, args.requests, args.concurrency, report_ids)
+    return results
+
+
+def existing_report_ids():
+    from database import Report, SessionLocal
+    with SessionLocal() as db:
+        return [row[0] for row in db.query(Report.id).limit(10_000)]
+
+
+async def worker_inprocess(args):
+    import main
+    report_ids = existing_report_ids()
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            return await run_scenarios(client, args, report_ids)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_until_healthy(client, server, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("uvicorn exited during startup")
+        try:
+            if (await client.get("/_health")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("uvicorn did not become healthy")
+
+
+async def worker_uvicorn(args):
+    report_ids = existing_report_ids()
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(args.uvicorn_workers), "--log-level", "warning", "--no-access-log"],
+        cwd=REPO_ROOT, env=os.environ.copy(),
+    )
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=120) as client:
+            await wait_until_healthy(client, server)
+            return await run_scenarios(client, args, report_ids)
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def run_worker(args):
+    """Child process: seed the database, run one mode and print JSON results"""
+    seed_reports(args.seed)
+    worker = worker_inprocess if args.worker == "inprocess" else worker_uvicorn
+    print(json.dumps(asyncio.run(worker(args))))
+
+
+def run_combination(args, mode, seed, workdir):
+    database_url = f"sqlite:///{os.path.join(workdir, f'bench_{mode}_{seed}.db')}"
+    command = [
+        sys.executable, os.path.abspath(__file__), "--worker", mode, "--seed", str(seed),
+        "--scenarios", ",".join(args.scenarios), "--requests", str(args.requests),
+        "--concurrency", str(args.concurrency), "--uvicorn-workers", str(args.uvicorn_workers),
+    ]
+    completed = subprocess.run(command, env=bench_env(database_url, args.stub_latency_ms),
+                               capture_output=True, text=True)
+    if completed.returncode != 0:
+        sys.stderr.write(completed.stderr)
+        raise RuntimeError(f"{mode} run with {seed} seeded reports failed")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def compare(results, baseline, tolerance, settings):
+    """Print regressions against a saved baseline; returns (regressions, scenarios compared)"""
+    if baseline.get("settings") != settings:
+        print(f"WARNING baseline settings {baseline.get('settings')} differ from this run's {settings}")
+    regressions = 0
+    compared = 0
+    for key, current in results.items():
+        previous = baseline["results"].get(key)
+        if previous is None:
+            print(f"WARNING {key} is not in the baseline")
+            continue
+        compared += 1
+        slower = current["p95_ms"] > previous["p95_ms"] * (1 + tolerance)
+        fewer = current["rps"] < previous["rps"] * (1 - tolerance)
+        if slower or fewer:
+            regressions += 1
+            print(f"REGRESSION {key}: p95 {previous['p95_ms']} -> {current['p95_ms']} ms, "
+                  f"rps {previous['rps']} -> {current['rps']}")
+    return regressions, compared
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="inprocess,uvicorn")
+    parser.add_argument("--seed-reports", default="0,50000", help="comma-separated report counts to seed")
+    parser.add_argument("--scenarios", default="all", help=f"'all' or a comma-separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--stub-latency-ms", type=float, default=50)
+    parser.add_argument("--uvicorn-workers", type=int, default=1)
+    parser.add_argument("--save-baseline", metavar="FILE")
+    parser.add_argument("--compare", metavar="FILE")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed fractional p95/throughput regression")
+    # Internal: run a single mode/dataset in this process
+    parser.add_argument("--worker", choices=("inprocess", "uvicorn"), help=argparse.SUPPRESS)
+    parser.add_argument("--seed", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.scenarios = list(SCENARIOS) if args.scenarios == "all" else args.scenarios.split(",")
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    results = {}
+    print(f"{'mode':<10} {'reports':>8} {'scenario':<18} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6}")
+    with tempfile.TemporaryDirectory(prefix="bench_api_") as workdir:
+        for mode in args.modes.split(","):
+            for seed in (int(n) for n in args.seed_reports.split(",")):
+                for scenario, stats in run_combination(args, mode, seed, workdir).items():
+                    results[f"{mode}/{seed}/{scenario}"] = stats
+                    print(f"{mode:<10} {seed:>8} {scenario:<18} {stats['rps']:>8.1f} {stats['p50_ms']:>8.1f} "
+                          f"{stats['p95_ms']:>8.1f} {stats['p99_ms']:>8.1f} {stats['errors']:>6}")
+
+    settings = {"requests": args.requests, "concurrency": args.concurrency,
+                "stub_latency_ms": args.stub_latency_ms, "uvicorn_workers": args.uvicorn_workers}
+    if args.save_baseline:
+        baseline = {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "settings": settings,
+            "results": results,
+        }
+        with open(args.save_baseline, "w") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"Saved baseline to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions, compared = compare(results, baseline, args.tolerance, settings)
+        if not compared:
+            print(f"Nothing to compare: no scenario of this run is in {args.compare}")
+            sys.exit(2)
+        if regressions:
+            print(f"{regressions} scenario(s) regressed by more than {args.tolerance:.0%}")
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
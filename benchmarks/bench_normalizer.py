@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the spoken-punctuation normalizer.
+
+Compares the compiled single-pass normalizer against the previous
+lowercase + one str.replace per rule implementation, first on dictations
+of increasing length and then with department vocabularies of increasing
+size. The multi-pass cost grows with every rule added; the compiled pass
+does not.
+
+Usage:
+    python benchmarks/bench_normalizer.py [--repeat 20]
+"""
+
+import os
+import sys
+import random
+import argparse
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import normalizer
+
+LEGACY_PUNCTUATION_MAP = {
+    "full stop": ".",
+    "period": ".",
+    "comma": ",",
+    "exclamation mark": "!",
+    "question mark": "?",
+    "colon": ":",
+    "semicolon": ";",
+    "new line": "\n",
+    "newline": "\n",
+    "new paragraph": "\n\n"
+}
+
+SENTENCES = [
+    "The lungs are clear full stop",
+    "There is a five millimetre nodule in the right upper lobe comma unchanged from prior full stop",
+    "No pleural effusion or pneumothorax full stop new paragraph",
+    "The liver measures one hundred fifty millimetres open bracket normal close bracket full stop",
+    "Impression colon no acute cardiopulmonary abnormality full stop new line",
+    "CT demonstrates a two point five centimetre lesion comma likely a simple cyst full stop",
+]
+
+
+def legacy_normalize(text):
+    """Previous implementation, without the diagnostic prints"""
+    text = " " + text.lower() + " "
+    for spoken, symbol in LEGACY_PUNCTUATION_MAP.items():
+        text = text.replace(f" {spoken} ", f"{symbol} ")
+    return text.strip()
+
+
+def make_dictation(target_chars, seed=0):
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    while length < target_chars:
+        sentence = rng.choice(SENTENCES)
+        parts.append(sentence)
+        length += len(sentence) + 1
+    return " ".join(parts)
+
+
+def legacy_multi_pass(text, rules):
+    """Previous approach extended to extra vocabulary rules"""
+    text = " " + text.lower() + " "
+    for rule in rules:
+        text = text.replace(f" {rule.spoken} ", f" {rule.symbol} ")
+    return legacy_normalize(text)
+
+
+def best_ms(func, repeat):
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs per measurement")
+    args = parser.parse_args()
+
+    compiled = normalizer.get_normalizer()
+    punctuation_only = normalizer.get_normalizer(["punctuation"])
+
+    print("Dictation length (built-in rules)")
+    print(f"{'chars':>8}  {'legacy ms':>10}  {'punct ms':>10}  {'all ms':>10}")
+    for size in (500, 5_000, 50_000, 500_000):
+        text = make_dictation(size)
+        legacy = best_ms(lambda: legacy_normalize(text), args.repeat)
+        punct = best_ms(lambda: punctuation_only(text), args.repeat)
+        full = best_ms(lambda: compiled(text), args.repeat)
+        print(f"{len(text):>8}  {legacy:>10.3f}  {punct:>10.3f}  {full:>10.3f}")
+
+    print()
+    print("Vocabulary size (5,000 char dictation)")
+    print(f"{'rules':>8}  {'multi ms':>10}  {'single ms':>10}  {'speedup':>8}")
+    text = make_dictation(5_000)
+    for count in (0, 50, 200, 1000):
+        vocabulary = [normalizer.Rule(f"term{i} word{i}", f"T{i}", normalizer.REPLACE) for i in range(count)]
+        normalizer.register_rule_set("bench_vocabulary", vocabulary)
+        single = normalizer.get_normalizer(["punctuation", "bench_vocabulary"])
+        multi_ms = best_ms(lambda: legacy_multi_pass(text, vocabulary), args.repeat)
+        single_ms = best_ms(lambda: single(text), args.repeat)
+        print(f"{count + 10:>8}  {multi_ms:>10.3f}  {single_ms:>10.3f}  {multi_ms / single_ms:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
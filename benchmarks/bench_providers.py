@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Side-by-side latency comparison of the configured LLM providers.
+
+Sends the same dictations through each provider via LLMEngine and prints
+call count, errors and p50/p95/p99 latency per provider. Providers without
+credentials are skipped, so the stub always runs and Anthropic or Gemini
+join in when ANTHROPIC_API_KEY / GEMINI_API_KEY are set.
+
+Usage:
+    python benchmarks/bench_providers.py [--providers stub,anthropic,gemini]
+                                         [--requests 20] [--concurrency 4]
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import processing
+from llm import LLMEngine
+from providers import create_provider
+
+DICTATIONS = [
+    "The lungs are clear full stop No pleural effusion or pneumothorax full stop",
+    "There is a five millimetre nodule in the right upper lobe comma unchanged from prior full stop",
+    "The liver measures one hundred fifty millimetres full stop No focal lesion full stop",
+    "CT demonstrates a two point five centimetre lesion comma likely a simple cyst full stop",
+]
+
+
+async def run_provider(name, requests, concurrency):
+    provider = create_provider(name)
+    if not provider.configured:
+        return None
+    engine = LLMEngine(provider, max_concurrency=concurrency, requests_per_minute=0,
+                       input_tokens_per_minute=0, output_tokens_per_minute=0)
+    system = processing.build_system_prompt(processing.default_system_prompt, "")
+
+    async def one(i):
+        text = processing.normalize_text(DICTATIONS[i % len(DICTATIONS)])
+        try:
+            await engine.complete(system, processing.build_user_prompt(f"{text} ({i})"))
+        except Exception as e:
+            print(f"  {name} request {i} failed: {e}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    await engine.aclose()
+    stats = next(iter(engine.latency.snapshot().values()))
+    return engine.model, elapsed, stats
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--providers", default="stub,anthropic,gemini")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    print(f"{'provider':<12} {'model':<32} {'calls':>6} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>7}")
+    for name in args.providers.split(","):
+        result = await run_provider(name.strip(), args.requests, args.concurrency)
+        if result is None:
+            print(f"{name:<12} (not configured, skipped)")
+            continue
+        model, elapsed, stats = result
+        print(f"{name:<12} {model:<32} {stats['calls']:>6} {stats['errors']:>6} "
+              f"{stats['p50_ms'] or 0:>8.1f} {stats['p95_ms'] or 0:>8.1f} {stats['p99_ms'] or 0:>8.1f} "
+              f"{args.requests / elapsed:>7.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark for the API.
+
+Measures, in fresh processes:
+
+  import     time to `import main`
+  lifespan   time for the startup hook (tables, default data, job workers)
+  healthy    time from launching uvicorn until GET /_health answers 200
+
+for a new SQLite database and for one that already exists. The provider
+gets a dummy API key so startup follows the production path without
+network calls.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 5] [--provider anthropic]
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MEASURE_IMPORT = """
+import asyncio, json, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+async def run_lifespan():
+    async with main.app.router.lifespan_context(main.app):
+        return time.perf_counter()
+
+ready = asyncio.run(run_lifespan())
+print(json.dumps({"import": imported - started, "lifespan": ready - imported}))
+"""
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_in_process(env):
+    completed = subprocess.run([sys.executable, "-c", MEASURE_IMPORT], cwd=REPO_ROOT, env=env,
+                               capture_output=True, text=True)
+    if completed.returncode != 0:
+        sys.stderr.write(completed.stderr)
+        raise RuntimeError("import/lifespan measurement failed")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def measure_uvicorn(env, timeout=60):
+    import httpx
+
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/_health", timeout=1).status_code == 200:
+                    return time.perf_counter() - started
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.01)
+        raise RuntimeError("uvicorn did not become healthy")
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def summarize(samples):
+    return f"{statistics.median(samples) * 1000:>9.0f} {min(samples) * 1000:>9.0f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--provider", default="anthropic", choices=("anthropic", "gemini", "stub"))
+    args = parser.parse_args()
+
+    print(f"{'database':<10} {'phase':<10} {'median ms':>9} {'min ms':>9}")
+    with tempfile.TemporaryDirectory(prefix="bench_startup_") as workdir:
+        for database in ("new", "existing"):
+            samples = {"import": [], "lifespan": [], "healthy": []}
+            for run in range(args.runs):
+                # "new" starts every run from an empty file; "existing" reuses one
+                name = f"new_{run}.db" if database == "new" else "existing.db"
+                env = dict(os.environ)
+                env.update({
+                    "DATABASE_URL": f"sqlite:///{os.path.join(workdir, name)}",
+                    "LLM_PROVIDER": args.provider,
+                    "ANTHROPIC_API_KEY": "bench-dummy-key",
+                    "GEMINI_API_KEY": "bench-dummy-key",
+                    "LOG_LEVEL": "WARNING",
+                    "PYTHONPATH": REPO_ROOT,
+                })
+                if database == "existing" and run == 0:
+                    # Create the database before measuring
+                    measure_in_process(env)
+                timings = measure_in_process(env)
+                samples["import"].append(timings["import"])
+                samples["lifespan"].append(timings["lifespan"])
+                if database == "new":
+                    env["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, f'new_{run}_uvicorn.db')}"
+                samples["healthy"].append(measure_uvicorn(env))
+            for phase, values in samples.items():
+                print(f"{database:<10} {phase:<10} {summarize(values)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+
+from sqlalchemy import delete, func, select
+
+from database import SessionLocal, ResponseCacheEntry
+
+logger = logging.getLogger(__name__)
+
+# "memory" (per process), "sql" (shared across workers via the main database) or "none"
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory").lower()
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+
+
+class CachedResponse(NamedTuple):
+    processed_text: str
+    report_id: Optional[int]
+
+
+def make_key(text: str, prompt_content: str, template_content: str, model: str, temperature: float,
+             max_tokens: Optional[int] = None) -> str:
+    """Hash everything that determines the model output for a dictation"""
+    payload = json.dumps(
+        [text.strip(), prompt_content, template_content, model, temperature, max_tokens],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class NullResponseCache:
+    """Cache that never stores anything, used when caching is disabled"""
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        return None
+
+    def set(self, key: str, value: CachedResponse):
+        pass
+
+    def invalidate_report(self, report_id: int):
+        pass
+
+
+class MemoryResponseCache:
+    """In-process LRU cache with per-entry expiry"""
+
+    def __init__(self, ttl_seconds: int = RESPONSE_CACHE_TTL_SECONDS, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple[float, CachedResponse]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: CachedResponse):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_report(self, report_id: int):
+        with self._lock:
+            stale = [key for key, (_, value) in self._entries.items() if value.report_id == report_id]
+            for key in stale:
+                del self._entries[key]
+
+
+class SQLResponseCache:
+    """Cache stored in the response_cache table so every worker shares hits"""
+
+    def __init__(self, ttl_seconds: int = RESPONSE_CACHE_TTL_SECONDS, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        try:
+            with SessionLocal() as db:
+                entry = db.get(ResponseCacheEntry, key)
+                if entry is None:
+                    return None
+                now = datetime.utcnow()
+                if entry.expires_at is not None and entry.expires_at <= now:
+                    db.delete(entry)
+                    db.commit()
+                    return None
+                value = CachedResponse(entry.processed_text, entry.report_id)
+                entry.last_used_at = now
+                db.commit()
+                return value
+        except Exception as e:
+            logger.warning(f"Response cache lookup failed: {e}")
+            return None
+
+    def set(self, key: str, value: CachedResponse):
+        now = datetime.utcnow()
+        try:
+            with SessionLocal() as db:
+                db.merge(ResponseCacheEntry(
+                    key=key,
+                    processed_text=value.processed_text,
+                    report_id=value.report_id,
+                    created_at=now,
+                    last_used_at=now,
+                    expires_at=now + timedelta(seconds=self.ttl_seconds),
+                ))
+                db.commit()
+                self._evict(db, now)
+        except Exception as e:
+            logger.warning(f"Response cache store failed: {e}")
+
+    def _evict(self, db, now: datetime):
+        db.execute(delete(ResponseCacheEntry).where(ResponseCacheEntry.expires_at <= now))
+        count = db.execute(select(func.count()).select_from(ResponseCacheEntry)).scalar()
+        excess = count - self.max_entries
+        if excess > 0:
+            oldest = (
+                select(ResponseCacheEntry.key)
+                .order_by(ResponseCacheEntry.last_used_at.asc())
+                .limit(excess)
+                .scalar_subquery()
+            )
+            db.execute(delete(ResponseCacheEntry).where(ResponseCacheEntry.key.in_(oldest)))
+        db.commit()
+
+    def invalidate_report(self, report_id: int):
+        try:
+            with SessionLocal() as db:
+                db.execute(delete(ResponseCacheEntry).where(ResponseCacheEntry.report_id == report_id))
+                db.commit()
+        except Exception as e:
+            logger.warning(f"Response cache invalidation failed: {e}")
+
+
+def create_response_cache():
+    if RESPONSE_CACHE_BACKEND == "sql":
+        logger.info("Using shared SQL response cache")
+        return SQLResponseCache()
+    if RESPONSE_CACHE_BACKEND in ("none", "off", "disabled"):
+        return NullResponseCache()
+    return MemoryResponseCache()
+
+
+response_cache = create_response_cache()
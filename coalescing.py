@@ -0,0 +1,125 @@
+"""Single-flight coalescing of concurrent identical /process and /process/stream requests.
+
+When the same dictation (same normalized text, prompt, template and model
+route, i.e. the same response cache key) arrives again while the first
+provider call is still running, the repeat waits for that call instead of
+starting another. This complements the response cache, which only helps
+once a result has been stored.
+
+A streamed flight publishes its tokens on a Broadcast. A streaming caller
+that joins it late gets the tokens sent so far and then the rest; one that
+joins a non-streamed flight gets the whole report once it is ready.
+
+The shared work runs as its own task, so a caller that disconnects or is
+cancelled does not abort it for the others. Coalescing is per process;
+requests landing on different workers each make their own call.
+
+COALESCE_REPORT_POLICY decides which report a waiting caller gets:
+
+  shared      the report saved by the first caller (same as a cache hit)
+  per_caller  a report of its own, saved with the shared provider output
+"""
+import os
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "true").lower() in ("1", "true", "yes")
+COALESCE_REPORT_POLICY = os.getenv("COALESCE_REPORT_POLICY", "shared").lower()
+
+SHARED = "shared"
+PER_CALLER = "per_caller"
+
+if COALESCE_REPORT_POLICY not in (SHARED, PER_CALLER):
+    logger.warning(f"Unknown COALESCE_REPORT_POLICY {COALESCE_REPORT_POLICY!r}; using {SHARED!r}")
+    COALESCE_REPORT_POLICY = SHARED
+
+
+class Broadcast:
+    """Chunks streamed by a flight; every subscriber gets all of them from the start"""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.closed = False
+        self._changed = asyncio.Event()
+
+    def publish(self, chunk: str):
+        self.chunks.append(chunk)
+        self._notify()
+
+    def close(self):
+        self.closed = True
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        sent = 0
+        while True:
+            while sent < len(self.chunks):
+                yield self.chunks[sent]
+                sent += 1
+            if self.closed:
+                return
+            await self._changed.wait()
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time; concurrent callers share its result"""
+
+    def __init__(self, name: str, enabled: bool = True):
+        self.name = name
+        self.enabled = enabled
+        self._flights: Dict[str, asyncio.Task] = {}
+        self._streams: Dict[str, Broadcast] = {}
+
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Return (result, shared); shared is True when another caller's call was joined"""
+        if not self.enabled:
+            return await func(), False
+        task, _, shared = self.join(key, func)
+        # Shielded so one caller's cancellation does not cancel the call for everyone
+        return await asyncio.shield(task), shared
+
+    def join(self, key: str, func: Callable[[], Awaitable[Any]],
+             stream: Optional[Broadcast] = None) -> Tuple[asyncio.Task, Optional[Broadcast], bool]:
+        """Start func, or join the call already running for key.
+
+        Returns (task, stream, shared): stream is the Broadcast the running
+        call publishes on, None if it does not stream. Await the task through
+        asyncio.shield so a cancelled caller does not cancel it for everyone.
+        """
+        if not self.enabled:
+            return asyncio.ensure_future(func()), stream, False
+        task = self._flights.get(key)
+        shared = task is not None
+        if shared:
+            metrics.coalesced_requests_total.inc(flight=self.name, role="follower")
+            return task, self._streams.get(key), True
+        metrics.coalesced_requests_total.inc(flight=self.name, role="leader")
+        task = asyncio.ensure_future(func())
+        self._flights[key] = task
+        if stream is not None:
+            self._streams[key] = stream
+        task.add_done_callback(lambda done: self._forget(key, done))
+        return task, stream, False
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+            self._streams.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            # Retrieve the exception so an abandoned flight does not log "never retrieved"
+            logger.debug(f"{self.name} flight failed: {task.exception()!r}")
+
+
+process_flights = SingleFlight("process", enabled=COALESCE_REQUESTS)
@@ -1,11 +1,16 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import create_engine, event, inspect, text, Column, Integer, String, Text, DateTime, ForeignKey, Index, LargeBinary
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.pool import QueuePool
 from datetime import datetime
 import os
+import time
 
 import logging
 
+import metrics
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -43,13 +48,80 @@ if DATABASE_URL:
 else:
     logger.info("Using SQLite database")
 
+# Connection pool sizing. size + overflow should cover EXECUTOR_DB_WORKERS
+# (16 by default) so DB threads do not queue for connections. Each process has
+# its own pool; serve.py divides both settings among its workers.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+# Seconds to wait for a free connection before failing
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# SQLite only: WAL lets readers run while a write is in progress, and
+# busy_timeout makes concurrent writers wait instead of failing
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            metrics.db_pool_checkout_timeouts_total.inc()
+            raise
+        metrics.db_pool_checkout_seconds.observe(time.perf_counter() - started)
+        return connection
+
+
+def engine_options(url: str) -> dict:
+    """Pool and driver settings for create_engine"""
+    is_sqlite = url.startswith("sqlite")
+    if is_sqlite and (":memory:" in url or url.rstrip("/") == "sqlite:"):
+        # In-memory databases live in a single connection; keep SQLAlchemy's default pool
+        return {"connect_args": {"check_same_thread": False}}
+    options = {
+        "poolclass": TimedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    if is_sqlite:
+        # Connections are used from the DB thread pool, not the thread that opened them
+        options["connect_args"] = {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+    return options
+
+
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        # Negative cache_size is in KiB rather than pages
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    finally:
+        cursor.close()
+
+
 # Configure SQLAlchemy engine with connection pooling and retry settings
 engine = create_engine(
     DATABASE_URL,
-    pool_pre_ping=True,  # Enable connection health checks
-    pool_recycle=1800,  # Recycle connections after 30 minutes
-    echo=False  # Disable duplicate SQL logging
+    echo=False,  # Disable duplicate SQL logging
+    **engine_options(DATABASE_URL)
 )
+if engine.dialect.name == "sqlite":
+    event.listen(engine, "connect", configure_sqlite_connection)
 
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -77,6 +149,13 @@ class Report(Base):
     template_name = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Set when the bodies have been moved to cold storage (see archive.py); they are then NULL here
+    archive_digest = Column(String(64), nullable=True, index=True)
+
+    __table_args__ = (
+        # Supports newest-first keyset pagination on (created_at, id)
+        Index("ix_reports_created_at_id", "created_at", "id"),
+    )
 
 class Prompt(Base):
     __tablename__ = "prompts"
@@ -86,13 +165,88 @@ class Prompt(Base):
     content = Column(Text)
     is_default = Column(Integer, default=0)  # 0 = not default, 1 = default
     is_active = Column(Integer, default=0)   # 0 = not active, 1 = active
+    # Routing overrides; NULL leaves the choice to the routing policy
+    model = Column(String, nullable=True)
+    max_tokens = Column(Integer, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+class RegistryVersion(Base):
+    __tablename__ = "registry_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, default=0)  # Bumped whenever templates or prompts change
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ResponseCacheEntry(Base):
+    __tablename__ = "response_cache"
+
+    key = Column(String(64), primary_key=True)  # SHA-256 of the resolved request inputs
+    processed_text = Column(Text)
+    report_id = Column(Integer, nullable=True, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow, index=True)
+    expires_at = Column(DateTime, index=True)
+
+class ProcessingJob(Base):
+    __tablename__ = "processing_jobs"
+
+    id = Column(String(32), primary_key=True)  # uuid4 hex
+    status = Column(String, index=True, default="queued")  # queued, running, succeeded, failed
+    payload = Column(Text)  # JSON-encoded ProcessTextRequest
+    callback_url = Column(String, nullable=True)
+    result = Column(Text, nullable=True)  # JSON-encoded /process response
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String(300), primary_key=True)  # "<scope>:<Idempotency-Key header>"
+    request_hash = Column(String(64))  # sha256 of the request body
+    state = Column(String(16), default="in_progress")  # in_progress, completed
+    status_code = Column(Integer, nullable=True)
+    response = Column(Text, nullable=True)  # JSON-encoded response body
+    locked_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, index=True)
+
+class ArchivedReportBody(Base):
+    __tablename__ = "report_archive"
+
+    digest = Column(String(64), primary_key=True)  # sha256 of the uncompressed body
+    data = Column(LargeBinary)  # zstd or gzip compressed JSON of raw_transcription and processed_text
+    size = Column(Integer)  # uncompressed bytes
+    created_at = Column(DateTime, default=datetime.utcnow)
+    touched_at = Column(DateTime, default=datetime.utcnow)  # last written or reused; garbage collection waits after it
+
+def add_missing_columns():
+    """Add nullable columns introduced since an existing table was created"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                logger.info(f"Added column {table.name}.{column.name}")
+
 # Create tables
 def create_tables():
     try:
         Base.metadata.create_all(bind=engine)
+        add_missing_columns()
+        # create_all only adds indexes when it creates the table, so add any
+        # indexes introduced since an existing table was created
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=engine, checkfirst=True)
         logger.info("Successfully created database tables")
     except Exception as e:
         logger.error(f"Error creating database tables: {e}")
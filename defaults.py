@@ -0,0 +1,79 @@
+"""Default templates and system prompt seeded into a new database.
+
+Kept free of database and app imports so scripts (migrate.py, reset_db.py,
+init_railway_db.py) can use them without starting the API.
+"""
+
+DEFAULT_PROMPT_NAME = "Default Radiologist Prompt"
+
+# Default system prompt for radiology reports
+default_system_prompt = """You are an expert radiologist writing a radiology report. Convert transcribed speech into a professional report.
+Follow these guidelines:
+- Remove speech artifacts (um, uh, pauses, repetitions)
+- Write in clear, natural prose paragraphs
+- Use standard medical terminology
+- Be concise and clear
+- If something is not mentioned, state it as normal
+- Use precise measurements if provided
+- Highlight any critical findings
+- End with a brief impression
+- Start directly with the findings"""
+
+# Templates added on startup if missing
+default_templates = {
+    "chest_xray": """
+    # Chest X-ray Report Template
+    
+    ## Clinical Information
+    [clinical_information]
+    
+    ## Technique
+    [technique]
+    
+    ## Findings
+    [findings]
+    
+    ## Impression
+    [impression]
+    """,
+    "abdominal_ct": """
+    # Abdominal CT Report Template
+    
+    ## Clinical Information
+    [clinical_information]
+    
+    ## Technique
+    [technique]
+    
+    ## Findings
+    ### Liver
+    [liver_findings]
+    
+    ### Gallbladder and Biliary System
+    [gallbladder_findings]
+    
+    ### Pancreas
+    [pancreas_findings]
+    
+    ### Spleen
+    [spleen_findings]
+    
+    ### Adrenal Glands
+    [adrenal_findings]
+    
+    ### Kidneys and Ureters
+    [kidney_findings]
+    
+    ### GI Tract
+    [gi_findings]
+    
+    ### Vascular
+    [vascular_findings]
+    
+    ### Other Findings
+    [other_findings]
+    
+    ## Impression
+    [impression]
+    """
+}
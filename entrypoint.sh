@@ -17,5 +17,6 @@ if [ -z "$PORT" ]; then
 fi
 
 # Start the application with explicit port from environment
+# serve.py runs WEB_CONCURRENCY uvicorn workers under gunicorn; exec so SIGTERM reaches it and drains them
 echo "Starting application on port $PORT..."
-python -m uvicorn main:app --host 0.0.0.0 --port "$PORT" --log-level debug
+exec python serve.py
@@ -0,0 +1,150 @@
+import os
+import time
+import asyncio
+import logging
+import functools
+import threading
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+# Threads per category of blocking work
+EXECUTOR_DB_WORKERS = int(os.getenv("EXECUTOR_DB_WORKERS", "16"))
+EXECUTOR_LLM_WORKERS = int(os.getenv("EXECUTOR_LLM_WORKERS", "8"))
+# Calls allowed to wait for a thread before new requests are refused with 503
+EXECUTOR_DB_MAX_QUEUE = int(os.getenv("EXECUTOR_DB_MAX_QUEUE", "64"))
+EXECUTOR_LLM_MAX_QUEUE = int(os.getenv("EXECUTOR_LLM_MAX_QUEUE", "32"))
+EXECUTOR_RETRY_AFTER_SECONDS = int(os.getenv("EXECUTOR_RETRY_AFTER_SECONDS", "5"))
+
+DB = "db"
+LLM = "llm"
+
+
+class PoolSaturated(Exception):
+    """Raised instead of queueing when a pool's backlog is over its limit"""
+
+    def __init__(self, category: str, retry_after: int = EXECUTOR_RETRY_AFTER_SECONDS):
+        super().__init__(f"The {category} worker pool is saturated")
+        self.category = category
+        self.retry_after = retry_after
+
+
+class BoundedPool:
+    """Thread pool for one category of blocking work, with a bounded backlog"""
+
+    def __init__(self, name: str, workers: int, max_queue: int):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-pool")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds_total = 0.0
+
+    async def run(self, func: Callable, *args, reject_when_full: bool = True):
+        """Run func(*args) on the pool and await its result.
+
+        Request handlers get PoolSaturated once the backlog is full; background
+        work passes reject_when_full=False and simply waits its turn.
+        """
+        with self._lock:
+            if reject_when_full and self.queued >= self.max_queue:
+                self.rejected += 1
+                raise PoolSaturated(self.name)
+            self.queued += 1
+            self.submitted += 1
+        enqueued_at = time.monotonic()
+
+        def call():
+            with self._lock:
+                self.queued -= 1
+                self.active += 1
+                self.wait_seconds_total += time.monotonic() - enqueued_at
+            try:
+                return func(*args)
+            finally:
+                with self._lock:
+                    self.active -= 1
+                    self.completed += 1
+
+        # Carry context variables (e.g. request ids) into the worker thread
+        context = contextvars.copy_context()
+        try:
+            future = self._executor.submit(context.run, call)
+        except RuntimeError:
+            # Shut down
+            self._unqueue()
+            raise
+        future.add_done_callback(self._unqueue_if_cancelled)
+        # Cancelling the awaiting task cancels the pool future too, if it has not started
+        return await asyncio.wrap_future(future)
+
+    def _unqueue(self):
+        with self._lock:
+            self.queued -= 1
+
+    def _unqueue_if_cancelled(self, future: Future):
+        # A pool future can only be cancelled before it starts, so call() never ran to take it off the queue
+        if future.cancelled():
+            self._unqueue()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "active": self.active,
+                "queued": self.queued,
+                "max_queue": self.max_queue,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "wait_seconds_total": round(self.wait_seconds_total, 6),
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+pools: Dict[str, BoundedPool] = {
+    DB: BoundedPool(DB, EXECUTOR_DB_WORKERS, EXECUTOR_DB_MAX_QUEUE),
+    LLM: BoundedPool(LLM, EXECUTOR_LLM_WORKERS, EXECUTOR_LLM_MAX_QUEUE),
+}
+
+
+async def run_db(func: Callable, *args, reject_when_full: bool = True):
+    """Run blocking database work off the event loop"""
+    return await pools[DB].run(func, *args, reject_when_full=reject_when_full)
+
+
+async def run_llm(func: Callable, *args, reject_when_full: bool = True):
+    """Run a blocking provider SDK call off the event loop"""
+    return await pools[LLM].run(func, *args, reject_when_full=reject_when_full)
+
+
+def offload(category: str):
+    """Turn a sync route handler into an async one that runs on the given pool.
+
+    functools.wraps keeps the original signature visible to FastAPI, so
+    dependencies such as Depends(get_db) are resolved as before.
+    """
+    def decorator(func: Callable):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await pools[category].run(functools.partial(func, *args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def stats() -> dict:
+    return {name: pool.stats() for name, pool in pools.items()}
+
+
+def shutdown():
+    for pool in pools.values():
+        pool.shutdown()
@@ -152,6 +152,13 @@ const theme = createTheme({
   },
 });
 
+// crypto.randomUUID is only available in secure contexts (https or localhost)
+const newIdempotencyKey = () => (
+  window.crypto && window.crypto.randomUUID
+    ? window.crypto.randomUUID()
+    : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`
+);
+
 function App() {
   const [isRecording, setIsRecording] = useState(false);
   const [transcription, setTranscription] = useState('');
@@ -265,6 +272,8 @@ function App() {
 
   const [cursorPosition, setCursorPosition] = useState(null);
   const textFieldRef = useRef(null);
+  // Idempotency-Key of the last submission that did not complete, with the body it was sent for
+  const pendingSubmissionRef = useRef(null);
 
   const handleTextFieldClick = (event) => {
     setCursorPosition(event.target.selectionStart);
@@ -340,20 +349,28 @@ function App() {
         requestBody.prompt_id = activePromptId;
       }
       
-      const response = await fetch(getApiEndpoint('process'), {
+      // Resubmitting a dictation whose stream was cut off reuses its key, so the
+      // server replays the report it saved instead of generating a second one
+      const body = JSON.stringify(requestBody);
+      if (!pendingSubmissionRef.current || pendingSubmissionRef.current.body !== body) {
+        pendingSubmissionRef.current = { body, key: newIdempotencyKey() };
+      }
+      
+      const response = await fetch(getApiEndpoint('process/stream'), {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'Idempotency-Key': pendingSubmissionRef.current.key,
         },
-        body: JSON.stringify(requestBody),
+        body,
       });
 
-      if (!response.ok) {
+      if (!response.ok || !response.body) {
         const errorText = await response.text();
         let errorMessage;
         try {
           const errorData = JSON.parse(errorText);
-          errorMessage = errorData.error || 'Failed to process transcription';
+          errorMessage = errorData.error || errorData.detail || 'Failed to process transcription';
         } catch (e) {
           console.error('Error parsing error response:', errorText);
           errorMessage = 'Server error: ' + (errorText.slice(0, 100) || 'Unknown error');
@@ -361,16 +378,50 @@ function App() {
         throw new Error(errorMessage);
       }
       
-      const data = await response.json();
+      // Render tokens as they arrive; events are separated by a blank line
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let streamedText = '';
+      let completed = false;
+      setProcessedText('');
+      
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+          const frame = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+          
+          let eventName = 'message';
+          let data = '';
+          frame.split('\n').forEach((line) => {
+            if (line.startsWith('event: ')) eventName = line.slice(7);
+            else if (line.startsWith('data: ')) data += line.slice(6);
+          });
+          if (!data) continue;
+          const payload = JSON.parse(data);
+          
+          if (eventName === 'token') {
+            streamedText += payload.text;
+            setProcessedText(streamedText);
+          } else if (eventName === 'done') {
+            completed = true;
+            setProcessedText(payload.processed_text);
+          } else if (eventName === 'error') {
+            throw new Error(payload.error);
+          }
+        }
+      }
       
-      if (data.processed_text) {
-        setProcessedText(data.processed_text);
-        showNotification('Transcription processed successfully', 'success');
-      } else if (data.error) {
-        showNotification(data.error, 'error');
-      } else {
-        throw new Error('Invalid response format from server');
+      if (!completed) {
+        throw new Error('Connection closed before the report was completed');
       }
+      pendingSubmissionRef.current = null;
+      showNotification('Transcription processed successfully', 'success');
     } catch (error) {
       console.error('Error processing transcription:', error);
       showNotification(error.message || 'Failed to process transcription', 'error');
@@ -7,6 +7,7 @@ export const API_URL = process.env.REACT_APP_API_URL || 'http://localhost:8001';
 const API_ENDPOINTS = {
     'templates': 'templates',
     'process': 'process',
+    'process/stream': 'process/stream',
     'prompts': 'prompts',
     'prompts/active': 'prompts/active',
     'recent-reports': 'recent-reports',
@@ -0,0 +1,239 @@
+"""Idempotency-Key support for endpoints that create reports.
+
+The first request with a given key claims it by inserting a row into
+idempotency_keys, runs, and stores its response. A repeat with the same
+key and body gets the stored response back (marked with
+Idempotent-Replayed: true). If the first request is still running, the
+repeat waits for it instead of running again. Reusing a key with a
+different body is rejected with 422. Failed requests release their key so
+they can be retried. Keys expire after IDEMPOTENCY_TTL_SECONDS.
+
+While the first request runs it refreshes its lock every third of
+IDEMPOTENCY_LOCK_SECONDS, however long the LLM call with its retries
+takes. Only a key whose owner stopped refreshing it (a crashed worker) is
+taken over.
+
+The table lives on the main database, so keys are shared by every worker
+process.
+"""
+import os
+import json
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+
+from database import SessionLocal, IdempotencyKey
+from executor import run_db
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+# How long a repeat waits for the original request before answering 409
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "150"))
+IDEMPOTENCY_POLL_SECONDS = float(os.getenv("IDEMPOTENCY_POLL_SECONDS", "0.25"))
+# An in-progress key not refreshed for this long was orphaned by a crashed worker and may be taken over
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "300"))
+IDEMPOTENCY_CLEANUP_INTERVAL_SECONDS = float(os.getenv("IDEMPOTENCY_CLEANUP_INTERVAL_SECONDS", "600"))
+MAX_KEY_LENGTH = 255
+
+HEADER = "Idempotency-Key"
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+
+# Outcomes of claim()
+CLAIMED = "claimed"
+MISMATCH = "mismatch"
+PENDING = "pending"
+
+
+class IdempotencyConflict(HTTPException):
+    """The key cannot be used for this request (too long, reused, or still in progress)"""
+
+
+def fingerprint(payload: Any) -> str:
+    """Stable hash of a request body"""
+    encoded = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def claim(key: str, request_hash: str) -> Tuple[str, Optional[int], Optional[str]]:
+    """Try to take ownership of a key; returns (outcome, stored status code, stored body)"""
+    now = datetime.utcnow()
+    with SessionLocal() as db:
+        db.add(IdempotencyKey(
+            key=key,
+            request_hash=request_hash,
+            state=IN_PROGRESS,
+            locked_at=now,
+            expires_at=now + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS),
+        ))
+        try:
+            db.commit()
+            return CLAIMED, None, None
+        except IntegrityError:
+            db.rollback()
+
+        row = db.get(IdempotencyKey, key)
+        if row is None:
+            # Deleted (released or expired) between the insert and the read
+            return claim(key, request_hash)
+        if row.request_hash != request_hash:
+            return MISMATCH, None, None
+        if row.state == COMPLETED:
+            return COMPLETED, row.status_code, row.response
+        if row.locked_at < now - timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS):
+            # Whoever took the lock is gone; the update only succeeds for one taker
+            taken = db.execute(
+                update(IdempotencyKey)
+                .where(IdempotencyKey.key == key, IdempotencyKey.state == IN_PROGRESS,
+                       IdempotencyKey.locked_at == row.locked_at)
+                .values(locked_at=now)
+            ).rowcount
+            db.commit()
+            if taken:
+                logger.warning(f"Took over abandoned idempotency key {key}")
+                return CLAIMED, None, None
+        return PENDING, None, None
+
+
+def refresh_lock(key: str):
+    with SessionLocal() as db:
+        db.execute(
+            update(IdempotencyKey)
+            .where(IdempotencyKey.key == key, IdempotencyKey.state == IN_PROGRESS)
+            .values(locked_at=datetime.utcnow())
+        )
+        db.commit()
+
+
+async def keep_locked(key: str):
+    """Refresh the key's lock until cancelled, so a slow request is never mistaken for a crashed one"""
+    while True:
+        await asyncio.sleep(IDEMPOTENCY_LOCK_SECONDS / 3)
+        try:
+            await run_db(refresh_lock, key, reject_when_full=False)
+        except Exception as e:
+            logger.warning(f"Could not refresh idempotency key {key}: {e}")
+
+
+def complete(key: str, status_code: int, body: Any):
+    with SessionLocal() as db:
+        db.execute(
+            update(IdempotencyKey)
+            .where(IdempotencyKey.key == key)
+            .values(state=COMPLETED, status_code=status_code, response=json.dumps(body))
+        )
+        db.commit()
+
+
+def release(key: str):
+    with SessionLocal() as db:
+        db.execute(delete(IdempotencyKey).where(IdempotencyKey.key == key, IdempotencyKey.state == IN_PROGRESS))
+        db.commit()
+
+
+def cleanup_expired() -> int:
+    with SessionLocal() as db:
+        deleted = db.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at < datetime.utcnow())).rowcount
+        db.commit()
+    return deleted
+
+
+def replay(status_code: int, body: str) -> JSONResponse:
+    return JSONResponse(
+        status_code=status_code,
+        content=json.loads(body),
+        headers={"Idempotent-Replayed": "true"},
+    )
+
+
+def encode_result(result: Any) -> Tuple[int, Any]:
+    """Status code and JSON body of an endpoint's return value"""
+    if isinstance(result, Response):
+        return result.status_code, json.loads(result.body)
+    return 200, jsonable_encoder(result)
+
+
+def scoped_key(scope: str, idempotency_key: str) -> str:
+    if len(idempotency_key) > MAX_KEY_LENGTH:
+        raise IdempotencyConflict(status_code=400, detail=f"{HEADER} must be at most {MAX_KEY_LENGTH} characters")
+    return f"{scope}:{idempotency_key}"
+
+
+async def acquire(key: str, request_hash: str) -> Optional[JSONResponse]:
+    """Claim a scoped key, waiting while another request holds it; returns the stored response if it has one"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        outcome, status_code, body = await run_db(claim, key, request_hash)
+        if outcome == CLAIMED:
+            return None
+        if outcome == COMPLETED:
+            return replay(status_code, body)
+        if outcome == MISMATCH:
+            raise IdempotencyConflict(
+                status_code=422, detail=f"{HEADER} has already been used with a different request"
+            )
+        if loop.time() >= deadline:
+            raise IdempotencyConflict(
+                status_code=409,
+                detail=f"A request with this {HEADER} is still being processed",
+                headers={"Retry-After": str(max(1, int(IDEMPOTENCY_POLL_SECONDS * 4)))},
+            )
+        await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+
+
+async def abandon(key: str):
+    """Release a claimed key without storing a response, so a retry runs again"""
+    await asyncio.shield(run_db(release, key, reject_when_full=False))
+
+
+async def run_claimed(key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+    """Run func under a key claimed with acquire() and store its response"""
+    heartbeat = asyncio.create_task(keep_locked(key))
+    try:
+        result = await func()
+        status_code, body = encode_result(result)
+    except BaseException:
+        # Nothing was stored, so a retry with this key should run again
+        await abandon(key)
+        raise
+    finally:
+        heartbeat.cancel()
+    if status_code >= 400:
+        await run_db(release, key, reject_when_full=False)
+    else:
+        await run_db(complete, key, status_code, body, reject_when_full=False)
+    return result
+
+
+async def run(scope: str, idempotency_key: Optional[str], request_hash: str,
+              func: Callable[[], Awaitable[Any]]) -> Any:
+    """Run func once per (scope, key); repeats get the stored response"""
+    if not idempotency_key:
+        return await func()
+    key = scoped_key(scope, idempotency_key)
+    replayed = await acquire(key, request_hash)
+    if replayed is not None:
+        return replayed
+    return await run_claimed(key, func)
+
+
+async def cleanup_periodically():
+    """Delete expired keys; runs for the lifetime of the app"""
+    while True:
+        try:
+            deleted = await run_db(cleanup_expired, reject_when_full=False)
+            if deleted:
+                logger.info(f"Deleted {deleted} expired idempotency keys")
+        except Exception as e:
+            logger.warning(f"Idempotency key cleanup failed: {e}")
+        await asyncio.sleep(IDEMPOTENCY_CLEANUP_INTERVAL_SECONDS)
@@ -31,86 +31,7 @@ except ImportError as e:
     logger.error(f"Failed to import database modules: {e}")
     sys.exit(1)
 
-# Import default templates and prompts from main
-try:
-    from main import default_templates, default_system_prompt
-except ImportError as e:
-    logger.error(f"Failed to import defaults from main: {e}")
-    default_system_prompt = """You are an expert radiologist with years of experience in dictating and writing radiology reports. Your task is to convert the transcribed dictation into a properly formatted and professional radiology report.
-
-Follow these guidelines:
-1. Maintain medical accuracy and terminology
-2. Organize content into appropriate sections
-3. Correct any speech recognition errors that are obvious
-4. Format the report professionally
-5. If a template is provided, use it to structure the report
-6. Preserve all medical findings and observations from the original dictation
-
-Do not:
-1. Add medical findings not mentioned in the dictation
-2. Remove important medical details from the dictation
-3. Change the meaning of any medical observations
-4. Use overly complex formatting
-
-The output should be a clean, professional radiology report that accurately reflects the dictated content."""
-    
-    default_templates = {
-        "chest_xray": """
-# Chest X-ray Report Template
-
-## Clinical Information
-[clinical_information]
-
-## Technique
-[technique]
-
-## Findings
-[findings]
-
-## Impression
-[impression]
-""",
-        "abdominal_ct": """
-# Abdominal CT Report Template
-
-## Clinical Information
-[clinical_information]
-
-## Technique
-[technique]
-
-## Findings
-### Liver
-[liver_findings]
-
-### Gallbladder and Biliary System
-[biliary_findings]
-
-### Pancreas
-[pancreas_findings]
-
-### Spleen
-[spleen_findings]
-
-### Adrenal Glands
-[adrenal_findings]
-
-### Kidneys and Ureters
-[kidney_findings]
-
-### GI Tract
-[gi_findings]
-
-### Vascular
-[vascular_findings]
-
-### Other Findings
-[other_findings]
-
-## Impression
-[impression]
-"""
-    }
+from defaults import DEFAULT_PROMPT_NAME, default_system_prompt, default_templates
 
 def check_database_connection():
     """Check if we can connect to the database"""
@@ -167,7 +88,7 @@ def initialize_default_data():
             default_prompt = db.query(DBPrompt).filter(DBPrompt.is_default == 1).first()
             if not default_prompt:
                 default_prompt = DBPrompt(
-                    name="Default Radiologist Prompt",
+                    name=DEFAULT_PROMPT_NAME,
                     content=default_system_prompt,
                     is_default=1,
                     is_active=1
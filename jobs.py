@@ -0,0 +1,415 @@
+import os
+import json
+import uuid
+import random
+import socket
+import asyncio
+import logging
+import ipaddress
+from urllib.parse import urlsplit
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+
+import httpx
+from sqlalchemy import delete, update
+
+from database import SessionLocal, ProcessingJob
+from executor import run_db
+
+logger = logging.getLogger(__name__)
+
+# "local" keeps jobs in this process; "database" shares them across workers via processing_jobs
+JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "local").lower()
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "1.0"))
+# Finished jobs are forgotten after this long
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "86400"))
+# Running jobs older than this are assumed orphaned by a dead worker and requeued
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "900"))
+# Backoff after a worker fails to fetch a job or store a result (e.g. a locked or unreachable database)
+JOB_ERROR_BACKOFF_SECONDS = float(os.getenv("JOB_ERROR_BACKOFF_SECONDS", "1"))
+JOB_ERROR_BACKOFF_MAX_SECONDS = float(os.getenv("JOB_ERROR_BACKOFF_MAX_SECONDS", "30"))
+JOB_FINISH_ATTEMPTS = int(os.getenv("JOB_FINISH_ATTEMPTS", "5"))
+JOB_CALLBACK_TIMEOUT_SECONDS = float(os.getenv("JOB_CALLBACK_TIMEOUT_SECONDS", "10"))
+JOB_CALLBACK_ATTEMPTS = int(os.getenv("JOB_CALLBACK_ATTEMPTS", "3"))
+# Comma-separated hosts that may receive job callbacks; ".example.org" also allows its subdomains.
+# Unset disables callbacks: they carry report text to an address chosen by the caller.
+JOB_CALLBACK_ALLOWED_HOSTS = [
+    host.strip().lower() for host in os.getenv("JOB_CALLBACK_ALLOWED_HOSTS", "").split(",") if host.strip()
+]
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+JobHandler = Callable[[dict], Awaitable[dict]]
+
+
+class CallbackNotAllowed(ValueError):
+    """The callback URL is malformed, not on the allowlist or points at a non-public address"""
+
+
+def _check_address(host: str, address: str):
+    ip = ipaddress.ip_address(address)
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    # Private, loopback, link-local (cloud metadata), shared and reserved ranges are all non-global
+    if not ip.is_global or ip.is_multicast:
+        raise CallbackNotAllowed(f"Callback host {host} resolves to non-public address {ip}")
+
+
+def check_callback_url(url: str):
+    """Raise CallbackNotAllowed unless url is an http(s) URL on an allowed host"""
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise CallbackNotAllowed("callback_url must be an http(s) URL")
+    if not JOB_CALLBACK_ALLOWED_HOSTS:
+        raise CallbackNotAllowed("Callbacks are disabled on this server (JOB_CALLBACK_ALLOWED_HOSTS is unset)")
+    host = parts.hostname.lower()
+    if not any(host == allowed or (allowed.startswith(".") and host.endswith(allowed))
+               for allowed in JOB_CALLBACK_ALLOWED_HOSTS):
+        raise CallbackNotAllowed(f"Callback host {host} is not allowed")
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        # A hostname; checked once resolved, before each attempt
+        return
+    _check_address(host, host)
+
+
+async def _check_resolved(url: str):
+    """Refuse hosts whose DNS records point into internal networks"""
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(parts.hostname, port, type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        raise CallbackNotAllowed(f"Callback host {parts.hostname} does not resolve: {e}")
+    for _, _, _, _, sockaddr in infos:
+        _check_address(parts.hostname, sockaddr[0])
+
+
+def job_view(job_id: str, status: str, created_at, started_at=None, finished_at=None,
+             result: Optional[dict] = None, error: Optional[str] = None) -> dict:
+    """Public representation of a job, as returned by GET /jobs/{id}"""
+    view = {
+        "job_id": job_id,
+        "status": status,
+        "created_at": created_at,
+        "started_at": started_at,
+        "finished_at": finished_at,
+    }
+    if result is not None:
+        view["result"] = result
+    if error is not None:
+        view["error"] = error
+    return view
+
+
+def _backoff(failures: int) -> float:
+    return min(JOB_ERROR_BACKOFF_MAX_SECONDS, JOB_ERROR_BACKOFF_SECONDS * 2 ** (failures - 1))
+
+
+class JobQueue:
+    """Runs /process requests on a pool of background workers"""
+
+    def __init__(self, workers: int = JOB_WORKERS):
+        self.workers = workers
+        self._handler: Optional[JobHandler] = None
+        self._tasks = []
+        # Worker tasks currently running a job, as opposed to waiting for one
+        self._busy = set()
+        self._draining = False
+        self._http: Optional[httpx.AsyncClient] = None
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self, handler: JobHandler):
+        self._handler = handler
+        self._http = httpx.AsyncClient(timeout=JOB_CALLBACK_TIMEOUT_SECONDS)
+        await self._prepare()
+        self._tasks = [asyncio.create_task(self._worker(n)) for n in range(self.workers)]
+        logger.info(f"Started {self.workers} job workers ({self.__class__.__name__})")
+
+    async def stop(self, drain_seconds: float = 0):
+        """Stop the workers, first letting running jobs finish for up to drain_seconds"""
+        self._draining = True
+        busy = [task for task in self._tasks if task in self._busy]
+        for task in self._tasks:
+            if task not in self._busy:
+                task.cancel()
+        if busy and drain_seconds > 0:
+            logger.info(f"Waiting up to {drain_seconds:.0f}s for {len(busy)} running jobs")
+            _, unfinished = await asyncio.wait(busy, timeout=drain_seconds)
+            if unfinished:
+                logger.warning(f"Cancelling {len(unfinished)} jobs still running after the drain timeout")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._busy.clear()
+        self._draining = False
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    async def submit(self, payload: dict, callback_url: Optional[str] = None) -> dict:
+        job_id = uuid.uuid4().hex
+        return await self._enqueue(job_id, payload, callback_url)
+
+    async def _worker(self, n: int):
+        """Run jobs until stopped; only cancellation ends the loop, so one failure cannot kill the pool"""
+        task = asyncio.current_task()
+        failures = 0
+        while not self._draining:
+            try:
+                job_id, payload, callback_url = await self._next_job()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                failures += 1
+                delay = _backoff(failures)
+                logger.error(f"Job worker {n} could not fetch a job: {e!r}; retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            failures = 0
+            self._busy.add(task)
+            try:
+                result, error = None, None
+                try:
+                    result = await self._handler(payload)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    error = getattr(e, "detail", None) or str(e)
+                    logger.error(f"Job {job_id} failed: {error}")
+                view = await self._record(job_id, FAILED if error is not None else SUCCEEDED, result, error)
+                if callback_url and view is not None:
+                    await self._send_callback(callback_url, view)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception(f"Job worker {n} failed while finishing job {job_id}")
+            finally:
+                self._busy.discard(task)
+
+    async def _record(self, job_id: str, status: str, result: Optional[dict], error: Optional[str]) -> Optional[dict]:
+        """Store the outcome of a job, retrying transient failures; None if it could not be stored"""
+        for attempt in range(1, JOB_FINISH_ATTEMPTS + 1):
+            try:
+                return await self._finish(job_id, status, result=result, error=error)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempt == JOB_FINISH_ATTEMPTS:
+                    logger.error(f"Could not store the {status} result of job {job_id}: {e!r}; "
+                                 f"it stays running until requeued as stale")
+                    return None
+                delay = _backoff(attempt)
+                logger.warning(f"Storing the result of job {job_id} failed: {e!r}; retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def _send_callback(self, url: str, view: dict):
+        body = json.loads(json.dumps(view, default=str))
+        for attempt in range(1, JOB_CALLBACK_ATTEMPTS + 1):
+            try:
+                # Checked again on every attempt: the allowlist may have changed since submission, and DNS may have
+                check_callback_url(url)
+                await _check_resolved(url)
+                response = await self._http.post(url, json=body)
+                if response.status_code < 500:
+                    return
+                logger.warning(f"Callback for job {view['job_id']} returned {response.status_code}")
+            except CallbackNotAllowed as e:
+                logger.error(f"Not sending callback for job {view['job_id']}: {e}")
+                return
+            except httpx.HTTPError as e:
+                logger.warning(f"Callback for job {view['job_id']} failed: {e}")
+            if attempt < JOB_CALLBACK_ATTEMPTS:
+                await asyncio.sleep(2 ** attempt + random.random())
+        logger.error(f"Giving up on callback for job {view['job_id']}")
+
+    # Backend hooks
+    async def _prepare(self):
+        pass
+
+    async def _enqueue(self, job_id: str, payload: dict, callback_url: Optional[str]) -> dict:
+        raise NotImplementedError
+
+    async def _next_job(self):
+        raise NotImplementedError
+
+    async def _finish(self, job_id: str, status: str, result: Optional[dict] = None,
+                      error: Optional[str] = None) -> dict:
+        raise NotImplementedError
+
+    def get(self, job_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+
+class LocalJobQueue(JobQueue):
+    """In-process queue; jobs are lost if the process restarts"""
+
+    def __init__(self, workers: int = JOB_WORKERS):
+        super().__init__(workers)
+        self._jobs: Dict[str, dict] = {}
+        self._queue: Optional[asyncio.Queue] = None
+
+    async def _prepare(self):
+        self._queue = asyncio.Queue()
+
+    def _prune(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=JOB_RETENTION_SECONDS)
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job["finished_at"] is not None and job["finished_at"] < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    async def _enqueue(self, job_id, payload, callback_url):
+        self._prune()
+        self._jobs[job_id] = job_view(job_id, QUEUED, datetime.utcnow())
+        await self._queue.put((job_id, payload, callback_url))
+        return dict(self._jobs[job_id])
+
+    async def _next_job(self):
+        job_id, payload, callback_url = await self._queue.get()
+        self._jobs[job_id].update(status=RUNNING, started_at=datetime.utcnow())
+        return job_id, payload, callback_url
+
+    async def _finish(self, job_id, status, result=None, error=None):
+        job = self._jobs[job_id]
+        job.update(status=status, finished_at=datetime.utcnow())
+        if result is not None:
+            job["result"] = result
+        if error is not None:
+            job["error"] = error
+        return dict(job)
+
+    def get(self, job_id):
+        job = self._jobs.get(job_id)
+        return dict(job) if job else None
+
+
+class DatabaseJobQueue(JobQueue):
+    """Queue stored in the processing_jobs table, so any worker process can run a job"""
+
+    def __init__(self, workers: int = JOB_WORKERS, poll_interval: float = JOB_POLL_INTERVAL_SECONDS):
+        super().__init__(workers)
+        self.poll_interval = poll_interval
+        self._wakeup: Optional[asyncio.Event] = None
+        self._polls = 0
+
+    async def _prepare(self):
+        self._wakeup = asyncio.Event()
+        requeued = await run_db(self._requeue_stale, reject_when_full=False)
+        if requeued:
+            logger.warning(f"Requeued {requeued} stale jobs")
+
+    def _requeue_stale(self) -> int:
+        """Put jobs left running by a worker that died back in the queue"""
+        cutoff = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+        with SessionLocal() as db:
+            requeued = db.execute(
+                update(ProcessingJob)
+                .where(ProcessingJob.status == RUNNING, ProcessingJob.started_at < cutoff)
+                .values(status=QUEUED, started_at=None)
+            ).rowcount
+            db.commit()
+        return requeued
+
+    def _insert(self, job_id, payload, callback_url) -> dict:
+        with SessionLocal() as db:
+            job = ProcessingJob(id=job_id, status=QUEUED, payload=json.dumps(payload), callback_url=callback_url)
+            db.add(job)
+            db.commit()
+            return self._view(job)
+
+    async def _enqueue(self, job_id, payload, callback_url):
+        view = await run_db(self._insert, job_id, payload, callback_url)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return view
+
+    def _claim(self):
+        """Atomically move the oldest queued job to running; None if there is nothing to do"""
+        with SessionLocal() as db:
+            candidates = (
+                db.query(ProcessingJob.id)
+                .filter(ProcessingJob.status == QUEUED)
+                .order_by(ProcessingJob.created_at)
+                .limit(self.workers)
+                .all()
+            )
+            for (job_id,) in candidates:
+                claimed = db.execute(
+                    update(ProcessingJob)
+                    .where(ProcessingJob.id == job_id, ProcessingJob.status == QUEUED)
+                    .values(status=RUNNING, started_at=datetime.utcnow())
+                ).rowcount
+                db.commit()
+                if claimed:
+                    job = db.get(ProcessingJob, job_id)
+                    return job.id, json.loads(job.payload), job.callback_url
+        return None
+
+    def _cleanup(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=JOB_RETENTION_SECONDS)
+        with SessionLocal() as db:
+            db.execute(delete(ProcessingJob).where(
+                ProcessingJob.status.in_([SUCCEEDED, FAILED]),
+                ProcessingJob.finished_at < cutoff,
+            ))
+            db.commit()
+
+    async def _next_job(self):
+        while True:
+            job = await run_db(self._claim, reject_when_full=False)
+            if job:
+                return job
+            self._polls += 1
+            if self._polls % 600 == 0:
+                await run_db(self._cleanup, reject_when_full=False)
+            # Sleep until a local submit wakes us or the poll interval passes
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _finish(self, job_id, status, result=None, error=None):
+        return await run_db(self._store_result, job_id, status, result, error, reject_when_full=False)
+
+    def _store_result(self, job_id, status, result, error) -> dict:
+        with SessionLocal() as db:
+            job = db.get(ProcessingJob, job_id)
+            job.status = status
+            job.finished_at = datetime.utcnow()
+            job.result = json.dumps(result) if result is not None else None
+            job.error = error
+            db.commit()
+            return self._view(job)
+
+    def get(self, job_id):
+        with SessionLocal() as db:
+            job = db.get(ProcessingJob, job_id)
+            return self._view(job) if job else None
+
+    @staticmethod
+    def _view(job: ProcessingJob) -> dict:
+        return job_view(
+            job.id, job.status, job.created_at, job.started_at, job.finished_at,
+            result=json.loads(job.result) if job.result else None,
+            error=job.error,
+        )
+
+
+def create_job_queue() -> JobQueue:
+    if JOB_QUEUE_BACKEND == "database":
+        return DatabaseJobQueue()
+    return LocalJobQueue()
+
+
+job_queue = create_job_queue()
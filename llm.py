@@ -0,0 +1,250 @@
+import os
+import time
+import bisect
+import logging
+import threading
+from collections import deque
+from typing import AsyncIterator, Dict, Optional
+
+import metrics
+from providers import USAGE_FIELDS, Completion, LLMProvider, empty_usage, estimate_tokens
+from ratelimit import FairScheduler
+from resilience import LLM_HEDGE_MIN_SAMPLES, LLM_HEDGE_QUANTILE, Resilience
+
+logger = logging.getLogger(__name__)
+
+# Model defaults used by the /process pipeline; LLM_MODEL overrides the provider's default model
+LLM_MODEL = os.getenv("LLM_MODEL", "")
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "1024"))
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.1"))
+
+# Concurrency and rate limits for provider calls (per process; 0 disables a limit)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "300"))
+LLM_INPUT_TOKENS_PER_MINUTE = float(os.getenv("LLM_INPUT_TOKENS_PER_MINUTE", "200000"))
+LLM_OUTPUT_TOKENS_PER_MINUTE = float(os.getenv("LLM_OUTPUT_TOKENS_PER_MINUTE", "40000"))
+
+# Latency samples kept per provider/model for percentile reporting
+LLM_LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "1000"))
+# Upper bounds (seconds) of the cumulative latency histogram buckets
+LATENCY_BUCKETS = (0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+
+class UsageStats:
+    """Running totals of token usage, including prompt-cache reads and writes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.cache_hits = 0
+        self.totals = dict.fromkeys(USAGE_FIELDS, 0)
+
+    def record(self, usage: Dict[str, int]):
+        counts = {field: usage.get(field, 0) for field in USAGE_FIELDS}
+        with self._lock:
+            self.calls += 1
+            if counts["cache_read_input_tokens"]:
+                self.cache_hits += 1
+            for field, count in counts.items():
+                self.totals[field] += count
+        logger.debug(f"LLM usage: {counts}")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            totals = dict(self.totals)
+            calls, hits = self.calls, self.cache_hits
+        # Share of prompt tokens served from the cache rather than processed afresh
+        prompt_tokens = sum(totals[field] for field in USAGE_FIELDS if field != "output_tokens")
+        return {
+            "calls": calls,
+            "cache_hits": hits,
+            "cache_misses": calls - hits,
+            **totals,
+            "cache_read_ratio": round(totals["cache_read_input_tokens"] / prompt_tokens, 4) if prompt_tokens else 0.0,
+        }
+
+
+class LatencyStats:
+    """Recent call latencies per provider and model, for side-by-side comparison"""
+
+    def __init__(self, window: int = LLM_LATENCY_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples: Dict[str, deque] = {}
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._buckets: Dict[str, list] = {}
+
+    def record(self, key: str, seconds: float, ok: bool = True):
+        with self._lock:
+            counts = self._counts.setdefault(key, {"calls": 0, "errors": 0})
+            counts["calls"] += 1
+            if not ok:
+                counts["errors"] += 1
+                return
+            self._samples.setdefault(key, deque(maxlen=self.window)).append(seconds)
+            buckets = self._buckets.setdefault(key, [0] * (len(LATENCY_BUCKETS) + 1))
+            buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def quantile(self, key: str, q: float, min_samples: int = 1) -> Optional[float]:
+        """Recent latency quantile in seconds, or None with too few samples"""
+        with self._lock:
+            values = sorted(self._samples.get(key, ()))
+        if len(values) < max(1, min_samples):
+            return None
+        return percentile(values, q)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            samples = {key: sorted(values) for key, values in self._samples.items()}
+            counts = {key: dict(value) for key, value in self._counts.items()}
+            buckets = {key: list(value) for key, value in self._buckets.items()}
+        report = {}
+        for key, count in counts.items():
+            values = samples.get(key, [])
+            report[key] = {**count, **{
+                name: round(percentile(values, q) * 1000, 1) if values else None
+                for name, q in (("p50_ms", 0.5), ("p95_ms", 0.95), ("p99_ms", 0.99))
+            }}
+            # Cumulative counts of successful calls at or under each bound, as in Prometheus
+            running = 0
+            histogram = {}
+            for bound, count_in_bucket in zip(LATENCY_BUCKETS + ("+Inf",), buckets.get(key, [0] * (len(LATENCY_BUCKETS) + 1))):
+                running += count_in_bucket
+                histogram[str(bound)] = running
+            report[key]["histogram_seconds"] = histogram
+        return report
+
+
+def percentile(sorted_values, q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+class LLMEngine:
+    """Provider-agnostic LLM client with fair admission control, resilience and usage stats"""
+
+    def __init__(
+        self,
+        provider: LLMProvider,
+        model: str = LLM_MODEL,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        requests_per_minute: float = LLM_REQUESTS_PER_MINUTE,
+        input_tokens_per_minute: float = LLM_INPUT_TOKENS_PER_MINUTE,
+        output_tokens_per_minute: float = LLM_OUTPUT_TOKENS_PER_MINUTE,
+        resilience: Optional[Resilience] = None,
+    ):
+        self.provider = provider
+        self.model = model or provider.default_model
+        self.scheduler = FairScheduler(provider.name, max_concurrency, requests_per_minute,
+                                       input_tokens_per_minute, output_tokens_per_minute)
+        self.usage = UsageStats()
+        self.latency = LatencyStats()
+        self.resilience = resilience or Resilience()
+
+    @property
+    def configured(self) -> bool:
+        return self.provider.configured
+
+    async def complete(
+        self,
+        system: str,
+        user_prompt: str,
+        model: Optional[str] = None,
+        max_tokens: int = LLM_MAX_TOKENS,
+        temperature: float = LLM_TEMPERATURE,
+    ) -> Completion:
+        """Generate a report for a single-turn prompt"""
+        model = model or self.model
+        key = f"{self.provider.name}:{model}"
+
+        input_estimate = estimate_tokens(system, user_prompt)
+
+        async def attempt() -> Completion:
+            # Every attempt, hedges and retries included, is admitted separately
+            ticket = await self.scheduler.acquire(input_estimate, max_tokens)
+            usage = None
+            started = time.monotonic()
+            try:
+                with metrics.llm_requests_in_flight.track_in_progress(provider=self.provider.name):
+                    completion = await self.provider.complete(system, user_prompt, model, max_tokens, temperature)
+                usage = completion.usage
+            except Exception:
+                self.latency.record(key, time.monotonic() - started, ok=False)
+                raise
+            finally:
+                self.scheduler.release(ticket, usage)
+            self.latency.record(key, time.monotonic() - started)
+            self.record_usage(model, completion.usage)
+            return completion
+
+        hedge_delay = self.latency.quantile(key, LLM_HEDGE_QUANTILE, LLM_HEDGE_MIN_SAMPLES)
+        return await self.resilience.call(attempt, hedge_delay=hedge_delay)
+
+    async def stream(
+        self,
+        system: str,
+        user_prompt: str,
+        model: Optional[str] = None,
+        max_tokens: int = LLM_MAX_TOKENS,
+        temperature: float = LLM_TEMPERATURE,
+        usage_out: Optional[Dict[str, int]] = None,
+    ) -> AsyncIterator[str]:
+        """Yield text deltas as the provider generates them; usage_out receives the token counts"""
+        model = model or self.model
+        key = f"{self.provider.name}:{model}"
+        breaker = self.resilience.breaker
+        input_estimate = estimate_tokens(system, user_prompt)
+        attempt = 0
+        while True:
+            attempt += 1
+            breaker.before_call()
+            usage = empty_usage()
+            streamed = False
+            completed = False
+            ticket = await self.scheduler.acquire(input_estimate, max_tokens)
+            started = time.monotonic()
+            try:
+                with metrics.llm_requests_in_flight.track_in_progress(provider=self.provider.name):
+                    async for text in self.provider.stream(system, user_prompt, model, max_tokens, temperature, usage):
+                        streamed = True
+                        yield text
+                completed = True
+            except Exception as e:
+                self.latency.record(key, time.monotonic() - started, ok=False)
+                if streamed:
+                    # Text already sent to the client cannot be taken back, so no retry
+                    breaker.record_failure()
+                    raise
+                self.scheduler.release(ticket)
+                ticket = None
+                await self.resilience.after_failure(e, attempt)
+                continue
+            except BaseException:
+                breaker.abandon()
+                raise
+            finally:
+                if ticket is not None:
+                    # Partial streams are settled with the tokens reported so far
+                    self.scheduler.release(ticket, usage if completed or streamed else None)
+            breaker.record_success()
+            self.latency.record(key, time.monotonic() - started)
+            self.record_usage(model, usage)
+            if usage_out is not None:
+                usage_out.update(usage)
+            return
+
+    def record_usage(self, model: str, usage: Dict[str, int]):
+        self.usage.record(usage)
+        metrics.record_tokens(self.provider.name, model, usage)
+
+    def stats(self) -> dict:
+        return {
+            "provider": self.provider.name,
+            "model": self.model,
+            "usage": self.usage.snapshot(),
+            "latency": self.latency.snapshot(),
+            "admission": self.scheduler.snapshot(),
+            "resilience": self.resilience.snapshot(),
+        }
+
+    async def aclose(self):
+        await self.provider.aclose()
@@ -1,68 +1,106 @@
 import os
 import json
+import time
+import asyncio
 import logging
 import datetime
-from typing import Optional
-from fastapi import FastAPI, HTTPException, Depends
+from contextlib import asynccontextmanager
+from typing import List, Optional
+from fastapi import FastAPI, HTTPException, Depends, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
-import anthropic
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 from dotenv import load_dotenv
+from sqlalchemy import text
 from sqlalchemy.orm import Session
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+import tracing
+
+# Configure logging (LOG_LEVEL, LOG_FORMAT=text|json); every record carries the request id
+tracing.configure_logging()
 logger = logging.getLogger(__name__)
 
 # Import database and reports modules
-from database import create_tables, get_db, SessionLocal, Template as DBTemplate, Report, Prompt as DBPrompt
+from database import engine, create_tables, get_db, SessionLocal, Template as DBTemplate, Prompt as DBPrompt
 import reports
+import processing
+import search
+import idempotency
+import archive
+import coalescing
+from defaults import DEFAULT_PROMPT_NAME, default_system_prompt, default_templates
+from llm import LLMEngine, LLM_TEMPERATURE
+from providers import LLM_PROVIDER, create_provider
+from routing import create_router
+from cache import CachedResponse, make_key, response_cache
+from registry import registry
+from jobs import job_queue, check_callback_url, CallbackNotAllowed
+import executor
+import metrics
+import ratelimit
+from executor import DB, PoolSaturated, offload, run_db
+from resilience import CircuitOpenError
+from idempotency import IdempotencyConflict
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Claude API (debug mode)
-logger.info("Starting API key configuration...")
-logger.info(f"Current working directory: {os.getcwd()}")
-
-# List environment variable keys for debugging (without showing values for security)
-env_var_keys = list(os.environ.keys())
-logger.info(f"Available environment variable keys: {env_var_keys}")
-
-# Try multiple ways to get the API key
-CLAUDE_API_KEY = ""
-
-# Check for various possible environment variable names
-possible_env_vars = [
-    "ANTHROPIC_API_KEY",  # Primary key name
-    "CLAUDE_API_KEY",     # Alternative key name
-    "GEMINI_API_KEY"      # Fallback to the old key name
-]
-
-# Try each possible environment variable
-for var_name in possible_env_vars:
-    api_key = os.getenv(var_name, "")
-    if api_key:
-        CLAUDE_API_KEY = api_key
-        logger.info(f"Found API key in environment variable: {var_name}")
-        break
-
-logger.info(f"API key status - exists: {bool(CLAUDE_API_KEY)}")
+# The first of these that is set is used as the Claude API key
+CLAUDE_API_KEY = next(
+    (os.getenv(name) for name in ("ANTHROPIC_API_KEY", "CLAUDE_API_KEY", "GEMINI_API_KEY") if os.getenv(name)),
+    ""
+)
+# Don't log any part of the API key for security
+# The discovered key is only used for Claude; other providers read their own settings
+provider_options = {"api_key": CLAUDE_API_KEY} if LLM_PROVIDER == "anthropic" else {}
+llm_engine = LLMEngine(create_provider(LLM_PROVIDER, **provider_options))
+logger.info(f"LLM provider: {llm_engine.provider.name}, model: {llm_engine.model}")
+if not llm_engine.configured:
+    logger.error(f"No API key configured for the {llm_engine.provider.name} provider")
+router = create_router(llm_engine.model, llm_engine.provider.fast_model)
+
+# On shutdown, running background jobs get this long to finish before they are cancelled
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "30"))
+
+# Batch processing limits
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "50"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))
+
+async def warm_up_provider():
+    try:
+        await executor.run_llm(llm_engine.provider.prepare, reject_when_full=False)
+    except Exception as e:
+        logger.warning(f"Provider warm-up failed; it will be retried on the first call: {e}")
 
-# Initialize Claude client
-if CLAUDE_API_KEY:
-    logger.info("Configuring Claude API with provided key")
-    # Don't log any part of the API key for security
-    claude_client = anthropic.Anthropic(api_key=CLAUDE_API_KEY)
-else:
-    logger.error("No API key found in any of the expected environment variables")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Bootstrap the database and job workers on startup; release everything on shutdown.
+    
+    Nothing touches the database or the network at import time, so importing
+    main (or a script importing it) is cheap.
+    """
+    started = time.perf_counter()
+    if not database_bootstrapped:
+        await run_db(bootstrap_database, reject_when_full=False)
+    await job_queue.start(run_process_job)
+    metrics.start_flusher()
+    # The provider SDK loads in the background so health checks pass without waiting for it
+    app.state.provider_warmup = asyncio.create_task(warm_up_provider())
+    idempotency_cleanup = asyncio.create_task(idempotency.cleanup_periodically())
+    # Moving old report bodies to cold storage is left to `python archive.py` unless an interval is set
+    archiver = asyncio.create_task(archive.archive_periodically()) if archive.ARCHIVE_INTERVAL_SECONDS > 0 else None
+    logger.info(f"Startup complete in {time.perf_counter() - started:.2f}s")
+    yield
+    idempotency_cleanup.cancel()
+    if archiver is not None:
+        archiver.cancel()
+    await job_queue.stop(drain_seconds=SHUTDOWN_DRAIN_SECONDS)
+    await llm_engine.aclose()
+    executor.shutdown()
 
 # Initialize FastAPI app
-app = FastAPI(title="Radiology Transcription API")
+app = FastAPI(title="Radiology Transcription API", lifespan=lifespan)
 
 # Add CORS middleware
 origins = [
@@ -82,96 +120,36 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
+# Provider calls queue fairly per client (X-Client-ID or address)
+app.add_middleware(ratelimit.ClientMiddleware)
+# Added last so it is outermost: the request id is bound before any other code runs
+app.add_middleware(tracing.TracingMiddleware)
 
 # Include the reports router
 app.include_router(reports.router, tags=["reports"])
 
-# Initialize database tables
-def init_db():
-    retries = 3
-    for attempt in range(retries):
-        try:
-            create_tables()
-            logger.info("Database tables created successfully")
-            return
-        except Exception as e:
-            if attempt == retries - 1:  # Last attempt
-                logger.error("Failed to initialize database after %d attempts: %s", retries, str(e))
-            else:
-                logger.warning("Database initialization attempt %d failed: %s. Retrying...", attempt + 1, str(e))
+@app.exception_handler(PoolSaturated)
+@app.exception_handler(CircuitOpenError)
+async def service_unavailable_handler(request, exc):
+    """Shed load with 503 instead of queueing without bound or waiting on a failing provider"""
+    logger.warning(f"Rejecting {request.method} {request.url.path}: {exc}")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
 
-# Default templates to initialize
-default_templates = {
-    "chest_xray": """
-    # Chest X-ray Report Template
-    
-    ## Clinical Information
-    [clinical_information]
-    
-    ## Technique
-    [technique]
-    
-    ## Findings
-    [findings]
-    
-    ## Impression
-    [impression]
-    """,
-    "abdominal_ct": """
-    # Abdominal CT Report Template
-    
-    ## Clinical Information
-    [clinical_information]
-    
-    ## Technique
-    [technique]
-    
-    ## Findings
-    ### Liver
-    [liver_findings]
-    
-    ### Gallbladder and Biliary System
-    [gallbladder_findings]
-    
-    ### Pancreas
-    [pancreas_findings]
-    
-    ### Spleen
-    [spleen_findings]
-    
-    ### Adrenal Glands
-    [adrenal_findings]
-    
-    ### Kidneys and Ureters
-    [kidney_findings]
-    
-    ### GI Tract
-    [gi_findings]
-    
-    ### Vascular
-    [vascular_findings]
-    
-    ### Other Findings
-    [other_findings]
-    
-    ## Impression
-    [impression]
-    """
-}
-
-# Initialize templates in database
-def init_templates(db: Session):
-    for name, content in default_templates.items():
-        existing = db.query(DBTemplate).filter(DBTemplate.name == name).first()
-        if not existing:
-            template = DBTemplate(name=name, content=content)
-            db.add(template)
-    db.commit()
 # Define request and response models
 class ProcessTextRequest(BaseModel):
     text: str
     template_name: Optional[str] = None
     prompt_id: Optional[int] = None
+    # Only used with /process?async=true: receives the finished job as JSON
+    callback_url: Optional[str] = None
+
+class ProcessBatchRequest(BaseModel):
+    items: List[ProcessTextRequest]
 
 class Template(BaseModel):
     name: str
@@ -183,6 +161,9 @@ class Template(BaseModel):
 class PromptBase(BaseModel):
     name: str
     content: str
+    # Optional routing overrides for reports generated with this prompt
+    model: Optional[str] = None
+    max_tokens: Optional[int] = Field(None, gt=0)
     
 class PromptCreate(PromptBase):
     pass
@@ -200,119 +181,47 @@ class Prompt(PromptBase):
     class Config:
         from_attributes = True
 
-# Default system prompt for radiology reports
-default_system_prompt = """You are an expert radiologist writing a radiology report. Convert transcribed speech into a professional report.
-Follow these guidelines:
-- Remove speech artifacts (um, uh, pauses, repetitions)
-- Write in clear, natural prose paragraphs
-- Use standard medical terminology
-- Be concise and clear
-- If something is not mentioned, state it as normal
-- Use precise measurements if provided
-- Highlight any critical findings
-- End with a brief impression
-- Start directly with the findings"""
+# True once bootstrap_database() has run in this process, or in the gunicorn master before it forked us
+database_bootstrapped = False
 
-# Default templates to add if none exist
-default_templates = {
-    "chest_xray": """
-    # Chest X-ray Report Template
-    
-    ## Clinical Information
-    [clinical_information]
-    
-    ## Technique
-    [technique]
-    
-    ## Findings
-    [findings]
-    
-    ## Impression
-    [impression]
-    """,
-    "abdominal_ct": """
-    # Abdominal CT Report Template
-    
-    ## Clinical Information
-    [clinical_information]
-    
-    ## Technique
-    [technique]
-    
-    ## Findings
-    ### Liver
-    [liver_findings]
-    
-    ### Gallbladder and Biliary System
-    [gallbladder_findings]
-    
-    ### Pancreas
-    [pancreas_findings]
-    
-    ### Spleen
-    [spleen_findings]
-    
-    ### Adrenal Glands
-    [adrenal_findings]
-    
-    ### Kidneys and Ureters
-    [kidney_findings]
-    
-    ### GI Tract
-    [gi_findings]
-    
-    ### Vascular
-    [vascular_findings]
-    
-    ### Other Findings
-    [other_findings]
-    
-    ## Impression
-    [impression]
-    """
-}
-
-# Try to initialize the database and tables
-create_tables()
-
-# Initialize templates and prompts
-def init_database():
+def bootstrap_database():
+    """Create tables, seed the default templates and prompt, and load the registry"""
+    global database_bootstrapped
+    create_tables()
+    search.ensure_search_index()
     with SessionLocal() as db:
-        # Initialize templates
+        existing = {name for (name,) in db.query(DBTemplate.name)}
         for name, content in default_templates.items():
-            existing = db.query(DBTemplate).filter(DBTemplate.name == name).first()
-            if not existing:
-                template = DBTemplate(name=name, content=content)
-                db.add(template)
+            if name not in existing:
+                db.add(DBTemplate(name=name, content=content))
         
-        # Initialize default prompt
-        default_prompt = db.query(DBPrompt).filter(DBPrompt.is_default == 1).first()
-        if not default_prompt:
-            default_prompt = DBPrompt(
-                name="Default Radiologist Prompt",
+        if not db.query(DBPrompt.id).filter(DBPrompt.is_default == 1).first():
+            db.add(DBPrompt(
+                name=DEFAULT_PROMPT_NAME,
                 content=default_system_prompt,
                 is_default=1,
                 is_active=1
-            )
-            db.add(default_prompt)
+            ))
         
         db.commit()
-
-# Initialize database with templates and prompts
-init_database()
+        registry.invalidate(db)
+    database_bootstrapped = True
 
 # Routes
-@app.get("/health")
-async def health_check():
-    """Health check endpoint for monitoring"""
-    db_status = "ok"
+def check_database() -> str:
     try:
         # Check database connection
-        db = SessionLocal()
-        db.execute("SELECT 1")
-        db.close()
+        with SessionLocal() as db:
+            db.execute(text("SELECT 1"))
+        return "ok"
     except Exception as e:
-        db_status = f"error: {str(e)}"
+        return f"error: {str(e)}"
+
+@app.get("/health")
+async def health_check():
+    """Health check endpoint for monitoring"""
+    # Monitoring must still get an answer while the pool is saturated
+    db_status = await run_db(check_database, reject_when_full=False)
         
     return {
         "status": "ok",
@@ -343,158 +252,423 @@ async def railway_health_check_head():
 async def root():
     return {"message": "Radiology Transcription API is running"}
 
-@app.post("/process")
-async def process_text(request: ProcessTextRequest, db: Session = Depends(get_db)):
-    """Process transcribed text with Claude API and save to database"""
-    try:
-        logger.info(f"Processing text request. API Key present: {bool(CLAUDE_API_KEY)}")
-        if not CLAUDE_API_KEY:
-            logger.error("Claude API key not configured")
-            raise HTTPException(status_code=500, detail="Claude API key not configured")
-        logger.info("API key validation passed, proceeding with request")
-        
-        # Preprocess the transcribed text
-        text = request.text
-        
-        # Convert spoken punctuation to symbols
-        print("Original text:", text)
-        text = " " + text.lower() + " "  # Add spaces to help with word boundaries
-        print("After adding spaces:", text)
-        
-        punctuation_map = {
-            "full stop": ".",
-            "period": ".",
-            "comma": ",",
-            "exclamation mark": "!",
-            "question mark": "?",
-            "colon": ":",
-            "semicolon": ";",
-            "new line": "\n",
-            "newline": "\n",
-            "new paragraph": "\n\n"
-        }
-        
-        # Case-insensitive replacement
-        for spoken, symbol in punctuation_map.items():
-            old_text = text
-            text = text.replace(f" {spoken} ", f"{symbol} ")
-            if old_text != text:
-                print(f"Replaced '{spoken}' with '{symbol}'")
-        
-        text = text.strip()  # Remove the extra spaces we added
-        print("Final text:", text)
-        
-        template_content = ""
-        if request.template_name:
-            # Get template from database
-            db_template = db.query(DBTemplate).filter(DBTemplate.name == request.template_name).first()
-            if db_template:
-                template_content = db_template.content
-        
-        # Get the system prompt to use
-        system_prompt = default_system_prompt
-        
-        # If a prompt_id is provided, use that prompt
-        if request.prompt_id:
-            db_prompt = db.query(DBPrompt).filter(DBPrompt.id == request.prompt_id).first()
-            if db_prompt:
-                system_prompt = db_prompt.content
-        # Otherwise, use the active prompt if one exists
-        else:
-            active_prompt = db.query(DBPrompt).filter(DBPrompt.is_active == 1).first()
-            if active_prompt:
-                system_prompt = active_prompt.content
-        
-        # Add template instruction to system prompt if template exists
-        if template_content:
-            system_prompt = f"{system_prompt}\n\nUse the following template structure for the report:\n{template_content}"
-        
-        # Create user prompt with the transcribed text
-        user_prompt = f"""Here is the transcribed speech to convert into a professional radiology report:
+def require_llm():
+    """Fail fast when the selected provider has no credentials"""
+    if not llm_engine.configured:
+        logger.error(f"{llm_engine.provider.name} API key not configured")
+        raise HTTPException(status_code=500, detail="Claude API key not configured")
 
-{text}
-
-Please write in a natural, flowing style as a radiologist would dictate. Avoid breaking the report into many sections."""
-        
+async def run_process_pipeline(request: ProcessTextRequest, db: Session, shed_load: bool = True) -> dict:
+    """Normalize, call Claude and save the report; raises HTTPException on failure.
+    
+    With shed_load=False (background jobs) a saturated DB pool is waited on
+    instead of raising PoolSaturated.
+    """
+    require_llm()
+    
+    # Preprocess the transcribed text
+    text = processing.normalize_text(request.text)
+    
+    # Resolve the template and prompt, then build the prompts for Claude
+    with tracing.span("lookup", template=request.template_name, prompt_id=request.prompt_id):
+        template_content = await run_db(processing.resolve_template_content, db, request.template_name,
+                                        reject_when_full=shed_load)
+        prompt = await run_db(processing.resolve_prompt, db, request.prompt_id, reject_when_full=shed_load)
+    prompt_content = processing.prompt_content(prompt)
+    system_prompt = processing.build_system_prompt(prompt_content, template_content)
+    user_prompt = processing.build_user_prompt(text)
+    route = router.choose(text, request.template_name, prompt)
+    
+    # Identical re-submissions return the original report without a new Claude call
+    cache_key = make_key(text, prompt_content, template_content, route.model, LLM_TEMPERATURE, route.max_tokens)
+    with tracing.span("cache"):
+        cached = await run_db(response_cache.get, cache_key, reject_when_full=shed_load)
+    if cached:
+        tracing.event("cache_hit", report_id=cached.report_id)
+        return {
+            "processed_text": cached.processed_text,
+            "report_id": cached.report_id
+        }
+    
+    async def generate() -> dict:
+        started = time.monotonic()
         try:
-            # Call Claude API
-            logger.info("Calling Claude API with prompt")
-            
-            # Add a small delay to avoid rate limits
-            import time
-            time.sleep(0.2)  # 200ms delay
-            
-            # Create a message using Claude's Messages API
-            response = claude_client.messages.create(
-                model="claude-sonnet-4-20250514",  # Using Claude Sonnet 4
-                max_tokens=1024,
-                temperature=0.1,
-                system=system_prompt,
-                messages=[
-                    {"role": "user", "content": user_prompt}
-                ]
-            )
-            
-            # Extract the response text
-            if not response or not hasattr(response, 'content') or not response.content:
-                error_msg = f"Unexpected Claude API response: {response}"
-                logger.error(error_msg)
-                raise HTTPException(status_code=500, detail=error_msg)
-            
-            # Extract text from the response content
-            processed_text = ""
-            for content_block in response.content:
-                if hasattr(content_block, 'text'):
-                    processed_text += content_block.text
-            
-            logger.info("Successfully processed text with Claude API")
+            # Concurrency, rate limits and retries are handled by the engine without blocking the event loop
+            with tracing.span("provider", route=route.name, model=route.model):
+                completion = await llm_engine.complete(
+                    system=system_prompt, user_prompt=user_prompt, model=route.model, max_tokens=route.max_tokens
+                )
+            router.stats.record(route, time.monotonic() - started, completion.usage)
+            processed_text = completion.text
         
+        except CircuitOpenError:
+            raise
         except Exception as e:
+            router.stats.record(route, time.monotonic() - started, ok=False)
             error_msg = f"Error calling Claude API: {str(e)}"
             logger.error(error_msg)
             raise HTTPException(status_code=500, detail=error_msg)
         
         # Save the report to the database
-        # Generate a title from the first line of the processed text or use a default
-        title_lines = processed_text.strip().split('\n')
-        title = next((line for line in title_lines if line.strip()), "Radiology Report")
-        if len(title) > 50:  # Limit title length
-            title = title[:47] + "..."
-        
-        # Create a new report directly
-        db_report = Report(
-            title=title,
-            raw_transcription=text,
-            processed_text=processed_text,
-            template_name=request.template_name
-        )
-        
-        # Save to database
-        db.add(db_report)
-        db.commit()
-        db.refresh(db_report)
+        # The Claude call has been paid for, so the save always waits for a thread.
+        # Its own session, because the shared call can outlive the request that started it.
+        def save() -> int:
+            with SessionLocal() as session:
+                return processing.save_report(session, text, processed_text, request.template_name).id
         
+        report_id = await run_db(save, reject_when_full=False)
+        await run_db(response_cache.set, cache_key, CachedResponse(processed_text, report_id),
+                     reject_when_full=False)
         return {
             "processed_text": processed_text,
-            "report_id": db_report.id
+            "report_id": report_id
         }
     
+    # Identical requests arriving while the provider call runs wait for it instead of paying again
+    result, shared = await coalescing.process_flights.do(cache_key, generate)
+    if not shared:
+        return result
+    if coalescing.COALESCE_REPORT_POLICY == coalescing.PER_CALLER:
+        db_report = await run_db(processing.save_report, db, text, result["processed_text"],
+                                 request.template_name, reject_when_full=False)
+        result = {**result, "report_id": db_report.id}
+    tracing.event("coalesced", report_id=result["report_id"], policy=coalescing.COALESCE_REPORT_POLICY)
+    return result
+
+async def run_process_job(payload: dict) -> dict:
+    """Job worker entry point: run the /process pipeline with its own session"""
+    # Continue the trace of the request that queued the job, and queue its provider call as that client
+    tracing.bind(payload.get("request_id"))
+    ratelimit.bind_client(payload.get("client_id"))
+    request = ProcessTextRequest(**payload)
+    with SessionLocal() as db:
+        return await run_process_pipeline(request, db, shed_load=False)
+
+@app.post("/process")
+async def process_text(
+    request: ProcessTextRequest,
+    run_async: bool = Query(False, alias="async"),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    db: Session = Depends(get_db)
+):
+    """Process transcribed text with Claude API and save to database.
+    
+    With ?async=true the request is queued and a job id is returned immediately;
+    poll GET /jobs/{job_id} or pass callback_url to be notified on completion.
+    
+    Retries that send the same Idempotency-Key get the original response (or
+    wait for it) instead of generating and saving a second report.
+    """
+    request_hash = idempotency.fingerprint({"request": request, "async": run_async})
+    if run_async:
+        if request.callback_url:
+            try:
+                check_callback_url(request.callback_url)
+            except CallbackNotAllowed as e:
+                raise HTTPException(status_code=422, detail=str(e))
+        
+        async def enqueue():
+            payload = {**request.dict(), "request_id": tracing.current_request_id(),
+                       "client_id": ratelimit.current_client()}
+            job = await job_queue.submit(payload, request.callback_url)
+            return JSONResponse(
+                status_code=202,
+                content={"job_id": job["job_id"], "status": job["status"], "status_url": f"/jobs/{job['job_id']}"}
+            )
+        
+        return await idempotency.run("process", idempotency_key, request_hash, enqueue)
+    
+    try:
+        return await idempotency.run("process", idempotency_key, request_hash,
+                                     lambda: run_process_pipeline(request, db))
+    except (PoolSaturated, CircuitOpenError, IdempotencyConflict):
+        raise
     except Exception as e:
-        print(f"Text processing error: {str(e)}")
+        logger.error(f"Text processing error: {str(e)}")
         # Return a proper JSON response
         return {"error": f"Error processing text: {str(e)}"}
-    finally:
-        # Clean up any resources if needed
-        pass
+
+@app.post("/process/batch")
+async def process_batch(batch: ProcessBatchRequest, db: Session = Depends(get_db)):
+    """Process many dictations at once and save all reports in one transaction.
+    
+    Results are returned in request order; a failed item carries an "error"
+    instead of failing the whole batch.
+    """
+    require_llm()
+    if not batch.items:
+        return {"results": []}
+    if len(batch.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"A batch may contain at most {BATCH_MAX_ITEMS} items")
+    
+    # Resolve each distinct template and prompt once for the whole batch
+    templates = {name: await run_db(processing.resolve_template_content, db, name)
+                 for name in {item.template_name for item in batch.items}}
+    prompts = {prompt_id: await run_db(processing.resolve_prompt, db, prompt_id)
+               for prompt_id in {item.prompt_id for item in batch.items}}
+    
+    results: List[dict] = [{"index": i} for i in range(len(batch.items))]
+    pending = {}  # cache key -> (system prompt, user prompt, normalized text, template, item indexes, route)
+    for i, item in enumerate(batch.items):
+        text = processing.normalize_text(item.text)
+        template_content = templates[item.template_name]
+        prompt = prompts[item.prompt_id]
+        prompt_content = processing.prompt_content(prompt)
+        route = router.choose(text, item.template_name, prompt)
+        cache_key = make_key(text, prompt_content, template_content, route.model, LLM_TEMPERATURE, route.max_tokens)
+        cached = await run_db(response_cache.get, cache_key)
+        if cached:
+            results[i].update(processed_text=cached.processed_text, report_id=cached.report_id)
+        elif cache_key in pending:
+            # Identical dictations within the batch share one Claude call and report
+            pending[cache_key][4].append(i)
+        else:
+            system_prompt = processing.build_system_prompt(prompt_content, template_content)
+            pending[cache_key] = (system_prompt, processing.build_user_prompt(text), text, item.template_name, [i], route)
+    
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+    
+    async def generate(system_prompt: str, user_prompt: str, route) -> str:
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                completion = await llm_engine.complete(
+                    system=system_prompt, user_prompt=user_prompt, model=route.model, max_tokens=route.max_tokens
+                )
+            except Exception:
+                router.stats.record(route, time.monotonic() - started, ok=False)
+                raise
+            router.stats.record(route, time.monotonic() - started, completion.usage)
+        return completion.text
+    
+    keys = list(pending)
+    outputs = await asyncio.gather(
+        *(generate(pending[key][0], pending[key][1], pending[key][5]) for key in keys),
+        return_exceptions=True
+    )
+    
+    new_reports = []
+    for key, output in zip(keys, outputs):
+        _, _, text, template_name, indexes, _ = pending[key]
+        if isinstance(output, Exception):
+            logger.error(f"Batch item failed: {output}")
+            for i in indexes:
+                results[i]["error"] = f"Error calling Claude API: {str(output)}"
+            continue
+        new_reports.append((key, output, indexes, processing.build_report(text, output, template_name)))
+    
+    # One transaction for every report in the batch
+    def save_reports():
+        with tracing.span("db_insert", reports=len(new_reports)):
+            db.add_all([report for _, _, _, report in new_reports])
+            db.flush()
+        with tracing.span("db_commit"):
+            db.commit()
+        for key, processed_text, _, report in new_reports:
+            response_cache.set(key, CachedResponse(processed_text, report.id))
+    
+    if new_reports:
+        await run_db(save_reports, reject_when_full=False)
+    for key, processed_text, indexes, report in new_reports:
+        for i in indexes:
+            results[i].update(processed_text=processed_text, report_id=report.id)
+    
+    return {"results": results}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status of a queued /process job, including its result once finished"""
+    job = await run_db(job_queue.get, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+def sse_event(event: str, data: dict) -> str:
+    """Format a server-sent event frame"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def sse_response(events) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def replay_stream(result: dict):
+    """A stored or cached report as the events a live stream would have sent"""
+    yield sse_event("token", {"text": result["processed_text"]})
+    yield sse_event("done", {"report_id": result["report_id"], "processed_text": result["processed_text"]})
+
+@app.post("/process/stream")
+async def process_text_stream(
+    request: ProcessTextRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    db: Session = Depends(get_db)
+):
+    """Stream Claude's report as server-sent events and save it once complete.
+    
+    Identical dictations in flight share one provider call with each other and
+    with /process; a caller that joins a stream late gets the tokens sent so far,
+    then the rest. Retries that send the same Idempotency-Key get the original
+    report replayed instead of generating and saving a second one.
+    """
+    key = None
+    if idempotency_key:
+        key = idempotency.scoped_key("process_stream", idempotency_key)
+        replayed = await idempotency.acquire(key, idempotency.fingerprint(request))
+        if replayed is not None:
+            response = sse_response(replay_stream(json.loads(replayed.body)))
+            response.headers["Idempotent-Replayed"] = "true"
+            return response
+    
+    try:
+        require_llm()
+        text = processing.normalize_text(request.text)
+        with tracing.span("lookup", template=request.template_name, prompt_id=request.prompt_id):
+            template_content = await run_db(processing.resolve_template_content, db, request.template_name)
+            prompt = await run_db(processing.resolve_prompt, db, request.prompt_id)
+        prompt_content = processing.prompt_content(prompt)
+        system_prompt = processing.build_system_prompt(prompt_content, template_content)
+        user_prompt = processing.build_user_prompt(text)
+        route = router.choose(text, request.template_name, prompt)
+        cache_key = make_key(text, prompt_content, template_content, route.model, LLM_TEMPERATURE, route.max_tokens)
+    except BaseException:
+        if key:
+            await idempotency.abandon(key)
+        raise
+    
+    broadcast = coalescing.Broadcast()
+    
+    async def generate() -> dict:
+        chunks = []
+        usage = {}
+        started = time.monotonic()
+        try:
+            async for delta in llm_engine.stream(system=system_prompt, user_prompt=user_prompt, model=route.model,
+                                                 max_tokens=route.max_tokens, usage_out=usage):
+                chunks.append(delta)
+                broadcast.publish(delta)
+            router.stats.record(route, time.monotonic() - started, usage)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            router.stats.record(route, time.monotonic() - started, ok=False)
+            error_msg = f"Error calling Claude API: {str(e)}"
+            logger.error(error_msg)
+            raise HTTPException(status_code=500, detail=error_msg)
+        finally:
+            broadcast.close()
+        
+        # Its own session, because the shared call can outlive the request that started it
+        processed_text = "".join(chunks)
+        
+        def save() -> int:
+            with SessionLocal() as session:
+                db_report = processing.save_report(session, text, processed_text, request.template_name)
+                report_id = db_report.id
+            response_cache.set(cache_key, CachedResponse(processed_text, report_id))
+            return report_id
+        
+        try:
+            # The tokens are already sent, so wait for a thread rather than refusing
+            report_id = await run_db(save, reject_when_full=False)
+        except Exception as e:
+            error_msg = f"Error saving report: {str(e)}"
+            logger.error(error_msg)
+            raise HTTPException(status_code=500, detail=error_msg)
+        return {"processed_text": processed_text, "report_id": report_id}
+    
+    # Resolved with the flight's Broadcast once joined, or None if it does not stream
+    joined = asyncio.get_running_loop().create_future()
+    
+    async def produce() -> dict:
+        # Headers are already sent, so a saturated pool must be waited on rather than raised
+        cached = await run_db(response_cache.get, cache_key, reject_when_full=False)
+        if cached:
+            return {"processed_text": cached.processed_text, "report_id": cached.report_id}
+        
+        task, stream, shared = coalescing.process_flights.join(cache_key, generate, stream=broadcast)
+        joined.set_result(stream)
+        result = await asyncio.shield(task)
+        if not shared:
+            return result
+        if coalescing.COALESCE_REPORT_POLICY == coalescing.PER_CALLER:
+            def save() -> int:
+                with SessionLocal() as session:
+                    return processing.save_report(session, text, result["processed_text"], request.template_name).id
+            result = {**result, "report_id": await run_db(save, reject_when_full=False)}
+        tracing.event("coalesced", report_id=result["report_id"], policy=coalescing.COALESCE_REPORT_POLICY)
+        return result
+    
+    async def event_stream():
+        # Runs as its own task so a client that disconnects still gets its report saved and its key completed
+        work = asyncio.ensure_future(idempotency.run_claimed(key, produce) if key else produce())
+        # Retrieve the outcome even if nobody is left to read it
+        work.add_done_callback(lambda done: done.cancelled() or done.exception())
+        await asyncio.wait([joined, work], return_when=asyncio.FIRST_COMPLETED)
+        stream = joined.result() if joined.done() else None
+        if stream is not None:
+            async for delta in stream:
+                yield sse_event("token", {"text": delta})
+        try:
+            result = await asyncio.shield(work)
+        except HTTPException as e:
+            yield sse_event("error", {"error": e.detail})
+            return
+        except Exception as e:
+            yield sse_event("error", {"error": f"Error calling Claude API: {str(e)}"})
+            return
+        if stream is None:
+            yield sse_event("token", {"text": result["processed_text"]})
+        yield sse_event("done", {"report_id": result["report_id"], "processed_text": result["processed_text"]})
+    
+    return sse_response(event_stream())
+
+@app.get("/ops/llm")
+async def llm_stats():
+    """Provider, token usage, prompt-cache hit rate, call latency and admission queue state"""
+    return {**llm_engine.stats(), "routes": router.stats.snapshot()}
+
+@app.get("/ops/executor")
+async def executor_stats():
+    """Queue depth and throughput of the blocking-work thread pools"""
+    return executor.stats()
+
+@metrics.registry.collector
+def collect_pool_metrics():
+    """Sample the DB connection pool, thread pools and circuit breaker at scrape time"""
+    pool = engine.pool
+    # The in-memory SQLite pool does not implement every counter
+    for state in ("size", "checkedin", "checkedout", "overflow"):
+        counter = getattr(pool, state, None)
+        if callable(counter):
+            value = counter()
+            if state == "overflow":
+                # QueuePool reports overflow as checked-out minus pool size, i.e. negative while under size
+                value = max(value, 0)
+            metrics.db_pool_connections.set(value, state=state)
+    for name, stats in executor.stats().items():
+        metrics.executor_threads.set(stats["active"], pool=name, state="active")
+        metrics.executor_threads.set(stats["queued"], pool=name, state="queued")
+    breaker_state = llm_engine.resilience.breaker.state
+    metrics.llm_circuit_open.set(0 if breaker_state == "closed" else 1, provider=llm_engine.provider.name)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus metrics for every worker process"""
+    body = await run_db(metrics.render, reject_when_full=False)
+    return PlainTextResponse(body, media_type=metrics.CONTENT_TYPE)
 
 @app.get("/templates", response_model=list[Template])
-async def get_templates(db: Session = Depends(get_db)):
+@offload(DB)
+def get_templates(db: Session = Depends(get_db)):
     """Get all available templates"""
-    templates = db.query(DBTemplate).all()
+    templates = registry.templates(db)
     return [Template(name=t.name, content=t.content) for t in templates]
 
 @app.post("/templates", response_model=Template)
-async def add_template(template: Template, db: Session = Depends(get_db)):
+@offload(DB)
+def add_template(template: Template, db: Session = Depends(get_db)):
     """Add a new template"""
     existing = db.query(DBTemplate).filter(DBTemplate.name == template.name).first()
     if existing:
@@ -503,48 +677,55 @@ async def add_template(template: Template, db: Session = Depends(get_db)):
     db.add(db_template)
     db.commit()
     db.refresh(db_template)
+    registry.invalidate(db)
     return Template(name=db_template.name, content=db_template.content)
 
 @app.put("/templates/{template_name}")
-async def update_template(template_name: str, template: Template, db: Session = Depends(get_db)):
+@offload(DB)
+def update_template(template_name: str, template: Template, db: Session = Depends(get_db)):
     """Update an existing template"""
     db_template = db.query(DBTemplate).filter(DBTemplate.name == template_name).first()
     if not db_template:
         raise HTTPException(status_code=404, detail="Template not found")
     db_template.content = template.content
     db.commit()
+    registry.invalidate(db)
     return {"message": f"Template '{template_name}' updated successfully"}
 
 @app.delete("/templates/{template_name}")
-async def delete_template(template_name: str, db: Session = Depends(get_db)):
+@offload(DB)
+def delete_template(template_name: str, db: Session = Depends(get_db)):
     """Delete a template"""
     db_template = db.query(DBTemplate).filter(DBTemplate.name == template_name).first()
     if not db_template:
         raise HTTPException(status_code=404, detail="Template not found")
     db.delete(db_template)
     db.commit()
+    registry.invalidate(db)
     return {"message": f"Template '{template_name}' deleted successfully"}
 
 # Prompt management endpoints
 @app.get("/prompts", response_model=list[Prompt])
-async def get_prompts(db: Session = Depends(get_db)):
+@offload(DB)
+def get_prompts(db: Session = Depends(get_db)):
     """Get all available prompts"""
-    prompts = db.query(DBPrompt).all()
-    return prompts
+    return registry.prompts(db)
 
 @app.get("/prompts/active", response_model=Prompt)
-async def get_active_prompt(db: Session = Depends(get_db)):
+@offload(DB)
+def get_active_prompt(db: Session = Depends(get_db)):
     """Get the currently active prompt"""
-    active_prompt = db.query(DBPrompt).filter(DBPrompt.is_active == 1).first()
+    active_prompt = registry.active_prompt(db)
     if not active_prompt:
         # If no active prompt, return the default prompt
-        active_prompt = db.query(DBPrompt).filter(DBPrompt.is_default == 1).first()
+        active_prompt = registry.default_prompt(db)
         if not active_prompt:
             raise HTTPException(status_code=404, detail="No active or default prompt found")
     return active_prompt
 
 @app.post("/prompts", response_model=Prompt)
-async def create_prompt(prompt: PromptCreate, db: Session = Depends(get_db)):
+@offload(DB)
+def create_prompt(prompt: PromptCreate, db: Session = Depends(get_db)):
     """Create a new prompt"""
     existing = db.query(DBPrompt).filter(DBPrompt.name == prompt.name).first()
     if existing:
@@ -553,16 +734,20 @@ async def create_prompt(prompt: PromptCreate, db: Session = Depends(get_db)):
     db_prompt = DBPrompt(
         name=prompt.name,
         content=prompt.content,
+        model=prompt.model,
+        max_tokens=prompt.max_tokens,
         is_default=0,
         is_active=0
     )
     db.add(db_prompt)
     db.commit()
     db.refresh(db_prompt)
+    registry.invalidate(db)
     return db_prompt
 
 @app.put("/prompts/{prompt_id}", response_model=Prompt)
-async def update_prompt(prompt_id: int, prompt: PromptUpdate, db: Session = Depends(get_db)):
+@offload(DB)
+def update_prompt(prompt_id: int, prompt: PromptUpdate, db: Session = Depends(get_db)):
     """Update an existing prompt"""
     db_prompt = db.query(DBPrompt).filter(DBPrompt.id == prompt_id).first()
     if not db_prompt:
@@ -575,13 +760,17 @@ async def update_prompt(prompt_id: int, prompt: PromptUpdate, db: Session = Depe
     # Update prompt fields
     db_prompt.name = prompt.name
     db_prompt.content = prompt.content
+    db_prompt.model = prompt.model
+    db_prompt.max_tokens = prompt.max_tokens
     
     db.commit()
     db.refresh(db_prompt)
+    registry.invalidate(db)
     return db_prompt
 
 @app.post("/prompts/{prompt_id}/activate", response_model=Prompt)
-async def activate_prompt(prompt_id: int, db: Session = Depends(get_db)):
+@offload(DB)
+def activate_prompt(prompt_id: int, db: Session = Depends(get_db)):
     """Set a prompt as active"""
     # First, find the prompt to activate
     db_prompt = db.query(DBPrompt).filter(DBPrompt.id == prompt_id).first()
@@ -596,10 +785,12 @@ async def activate_prompt(prompt_id: int, db: Session = Depends(get_db)):
     
     db.commit()
     db.refresh(db_prompt)
+    registry.invalidate(db)
     return db_prompt
 
 @app.delete("/prompts/{prompt_id}")
-async def delete_prompt(prompt_id: int, db: Session = Depends(get_db)):
+@offload(DB)
+def delete_prompt(prompt_id: int, db: Session = Depends(get_db)):
     """Delete a prompt"""
     db_prompt = db.query(DBPrompt).filter(DBPrompt.id == prompt_id).first()
     if not db_prompt:
@@ -617,29 +808,29 @@ async def delete_prompt(prompt_id: int, db: Session = Depends(get_db)):
     
     db.delete(db_prompt)
     db.commit()
+    registry.invalidate(db)
     return {"message": f"Prompt '{db_prompt.name}' deleted successfully"}
 
 @app.get("/recent-reports/")
-async def get_recent_reports(limit: int = 10, db: Session = Depends(get_db)):
-    """Get the most recent reports"""
+@offload(DB)
+def get_recent_reports(limit: int = 10, cursor: Optional[str] = None, template_name: Optional[str] = None, db: Session = Depends(get_db)):
+    """Get the most recent reports, newest first"""
     try:
-        recent_reports = reports.get_reports(skip=0, limit=limit, db=db)
+        # Summary rows only: the report bodies are never loaded for listings
+        recent_reports, next_cursor = reports.query_report_summaries(
+            db, limit, cursor=cursor, template_name=template_name
+        )
         return {
-            "reports": [
-                {
-                    "id": report.id,
-                    "title": report.title,
-                    "created_at": report.created_at,
-                    "template_name": report.template_name
-                } for report in recent_reports
-            ]
+            "reports": recent_reports,
+            "next_cursor": next_cursor
         }
     except Exception as e:
-        print(f"Error fetching recent reports: {str(e)}")
+        logger.error(f"Error fetching recent reports: {str(e)}")
         return {"error": f"Error fetching recent reports: {str(e)}"}
 
 @app.get("/reports/{report_id}")
-async def get_report_by_id(report_id: int, db: Session = Depends(get_db)):
+@offload(DB)
+def get_report_by_id(report_id: int, db: Session = Depends(get_db)):
     """Get a specific report by ID"""
     try:
         report = reports.get_report(report_id, db)
@@ -655,7 +846,7 @@ async def get_report_by_id(report_id: int, db: Session = Depends(get_db)):
             }
         }
     except Exception as e:
-        print(f"Error fetching report: {str(e)}")
+        logger.error(f"Error fetching report: {str(e)}")
         return {"error": f"Error fetching report: {str(e)}"}
 
 if __name__ == "__main__":
@@ -663,4 +854,5 @@ if __name__ == "__main__":
     # Get port from environment variable (for Railway) or use default
     # Railway will automatically assign the port when deployed
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=True)
\ No newline at end of file
+    # Development server; production runs through serve.py
+    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=os.getenv("UVICORN_RELOAD", "false").lower() == "true")
\ No newline at end of file
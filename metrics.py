@@ -0,0 +1,402 @@
+"""In-process Prometheus metrics, exposed by GET /metrics.
+
+Counters, gauges and histograms live in memory. When METRICS_DIR is set,
+every worker process also writes its values to METRICS_DIR/<pid>.json
+every METRICS_FLUSH_SECONDS, and /metrics merges all the files. Each
+uvicorn or gunicorn worker can then answer a scrape for the whole server
+without any external service. Gauges only count while their process is
+alive. Counters and histograms are cumulative: when a worker exits, its
+file is folded into METRICS_DIR/aggregate.json and removed, by the
+gunicorn master's child_exit hook or by the next scrape that finds it dead.
+"""
+import os
+import json
+import time
+import fcntl
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Shared directory for per-process snapshots; unset means single-process mode
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+AGGREGATE_FILE = "aggregate.json"
+LOCK_FILE = "aggregate.lock"
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+
+class Metric:
+    """One metric family; samples are keyed by their label values"""
+
+    def __init__(self, registry: "Registry", kind: str, name: str, help_text: str,
+                 labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.registry = registry
+        self.kind = kind
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.samples: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self.samples[key] = self.samples.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self.registry.lock:
+            self.samples[self._key(labels)] = float(value)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            # Per-bucket (not cumulative) counts, then sum and count
+            state = self.samples.get(key)
+            if state is None:
+                state = self.samples[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            index = len(self.buckets)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    index = i
+                    break
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with-block, in seconds"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    @contextmanager
+    def track_in_progress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics: Dict[str, Metric] = {}
+        # Callbacks that set gauges from live objects (pools, breakers) just before export
+        self.collectors: List[Callable[[], None]] = []
+
+    def _add(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Metric:
+        return self._add(Metric(self, COUNTER, name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Metric:
+        return self._add(Metric(self, GAUGE, name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Metric:
+        return self._add(Metric(self, HISTOGRAM, name, help_text, labels, buckets))
+
+    def collector(self, func: Callable[[], None]) -> Callable[[], None]:
+        self.collectors.append(func)
+        return func
+
+    def snapshot(self) -> dict:
+        for collect in self.collectors:
+            try:
+                collect()
+            except Exception as e:
+                logger.warning(f"Metrics collector {collect.__name__} failed: {e}")
+        with self.lock:
+            return {
+                name: [[list(key), value if not isinstance(value, list) else list(value)]
+                       for key, value in metric.samples.items()]
+                for name, metric in self.metrics.items()
+            }
+
+
+registry = Registry()
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def flush():
+    """Write this process's values to METRICS_DIR"""
+    if not METRICS_DIR:
+        return
+    path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(registry.snapshot(), f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not write metrics snapshot: {e}")
+
+
+def _read_snapshot(path: str) -> Optional[dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+@contextmanager
+def _aggregate_lock():
+    """Serialises updates of the aggregate file across processes"""
+    with open(os.path.join(METRICS_DIR, LOCK_FILE), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _fold(pids: Iterable[int]):
+    """Add the counters and histograms of exited processes to the aggregate; the caller holds the lock"""
+    paths = [os.path.join(METRICS_DIR, f"{pid}.json") for pid in pids]
+    snapshots = [snapshot for snapshot in map(_read_snapshot, paths) if snapshot is not None]
+    if snapshots:
+        aggregate_path = os.path.join(METRICS_DIR, AGGREGATE_FILE)
+        aggregate = _read_snapshot(aggregate_path) or {}
+        # Dead processes contribute no gauges, so these are dropped here
+        merged = _merge((False, snapshot) for snapshot in [aggregate] + snapshots)
+        tmp_path = f"{aggregate_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({name: [[list(key), value] for key, value in samples.items()]
+                       for name, samples in merged.items()}, f)
+        os.replace(tmp_path, aggregate_path)
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def mark_process_dead(pid: int):
+    """Fold an exited worker's snapshot into the aggregate (gunicorn's child_exit hook calls this)"""
+    if not METRICS_DIR or not os.path.isdir(METRICS_DIR):
+        return
+    try:
+        with _aggregate_lock():
+            _fold([pid])
+    except OSError as e:
+        logger.warning(f"Could not fold metrics of process {pid}: {e}")
+
+
+def _snapshot_pids() -> List[int]:
+    return [int(filename[:-5]) for filename in os.listdir(METRICS_DIR)
+            if filename.endswith(".json") and filename[:-5].isdigit()]
+
+
+def _fold_dead_processes():
+    """Catch workers that exited without a child_exit hook, e.g. under uvicorn --workers"""
+    if not any(not _pid_alive(pid) for pid in _snapshot_pids()):
+        return
+    try:
+        with _aggregate_lock():
+            # Checked again under the lock: a new process may have been given a dead one's PID
+            _fold([pid for pid in _snapshot_pids() if not _pid_alive(pid)])
+    except OSError as e:
+        logger.warning(f"Could not fold metrics of exited processes: {e}")
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        flush()
+
+
+_flusher: Optional[threading.Thread] = None
+
+
+def start_flusher():
+    """Start writing snapshots in the background (once per process, after any fork)"""
+    global _flusher
+    if not METRICS_DIR or (_flusher is not None and _flusher.is_alive()):
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    # A file under our PID belongs to an earlier process; keep its counts instead of overwriting them
+    mark_process_dead(os.getpid())
+    _flusher = threading.Thread(target=_flush_periodically, name="metrics-flusher", daemon=True)
+    _flusher.start()
+    atexit.register(flush)
+
+
+def _merge(snapshots: Iterable[Tuple[bool, dict]]) -> Dict[str, Dict[tuple, object]]:
+    merged: Dict[str, Dict[tuple, object]] = {}
+    for alive, snapshot in snapshots:
+        for name, samples in snapshot.items():
+            metric = registry.metrics.get(name)
+            if metric is None or (metric.kind == GAUGE and not alive):
+                continue
+            target = merged.setdefault(name, {})
+            for key, value in samples:
+                key = tuple(key)
+                if metric.kind == HISTOGRAM:
+                    current = target.get(key)
+                    target[key] = list(value) if current is None else [a + b for a, b in zip(current, value)]
+                else:
+                    target[key] = target.get(key, 0.0) + value
+    return merged
+
+
+def _snapshots() -> Iterable[Tuple[bool, dict]]:
+    yield True, registry.snapshot()
+    if not METRICS_DIR or not os.path.isdir(METRICS_DIR):
+        return
+    _fold_dead_processes()
+    aggregate = _read_snapshot(os.path.join(METRICS_DIR, AGGREGATE_FILE))
+    if aggregate is not None:
+        yield False, aggregate
+    own = os.getpid()
+    for pid in _snapshot_pids():
+        if pid == own:
+            continue
+        snapshot = _read_snapshot(os.path.join(METRICS_DIR, f"{pid}.json"))
+        if snapshot is not None:
+            yield _pid_alive(pid), snapshot
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def render() -> str:
+    """All metrics, merged across worker processes, in the Prometheus text format"""
+    merged = _merge(_snapshots())
+    lines = []
+    for name, metric in registry.metrics.items():
+        lines.append(f"# HELP {name} {metric.help}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for key, value in sorted(merged.get(name, {}).items()):
+            if metric.kind != HISTOGRAM:
+                lines.append(f"{name}{_labels(metric.labels, key)} {_number(value)}")
+                continue
+            running = 0
+            for bound, count in zip(metric.buckets + (float("inf"),), value[:-2]):
+                running += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{name}_bucket{_labels(metric.labels, key, le)} {_number(running)}")
+            lines.append(f"{name}_sum{_labels(metric.labels, key)} {_number(value[-2])}")
+            lines.append(f"{name}_count{_labels(metric.labels, key)} {_number(value[-1])}")
+    return "\n".join(lines) + "\n"
+
+
+# Metrics recorded by the application
+http_requests_total = registry.counter(
+    "http_requests_total", "HTTP requests by method, route and status code", ("method", "route", "status"))
+http_request_duration_seconds = registry.histogram(
+    "http_request_duration_seconds", "HTTP request duration by method and route", ("method", "route"))
+http_requests_in_flight = registry.gauge(
+    "http_requests_in_flight", "HTTP requests currently being served")
+process_stage_seconds = registry.histogram(
+    "process_stage_seconds", "Time spent in each stage of the /process pipeline", ("stage",))
+llm_requests_in_flight = registry.gauge(
+    "llm_requests_in_flight", "Provider calls currently awaiting a response", ("provider",))
+coalesced_requests_total = registry.counter(
+    "coalesced_requests_total", "Requests that started (leader) or joined (follower) a shared call",
+    ("flight", "role"))
+llm_queue_wait_seconds = registry.histogram(
+    "llm_queue_wait_seconds", "Time provider calls waited for admission by the rate limiter", ("provider",),
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+llm_queued_requests = registry.gauge(
+    "llm_queued_requests", "Provider calls waiting for admission by the rate limiter", ("provider",))
+llm_tokens_total = registry.counter(
+    "llm_tokens_total", "Tokens reported by the provider, by kind", ("provider", "model", "kind"))
+db_pool_connections = registry.gauge(
+    "db_pool_connections", "Database connection pool state", ("state",))
+db_pool_checkout_seconds = registry.histogram(
+    "db_pool_checkout_seconds", "Time spent waiting for a pooled database connection",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0))
+db_pool_checkout_timeouts_total = registry.counter(
+    "db_pool_checkout_timeouts_total", "Checkouts that gave up after DB_POOL_TIMEOUT")
+executor_threads = registry.gauge(
+    "executor_threads", "Blocking-work thread pool state", ("pool", "state"))
+llm_circuit_open = registry.gauge(
+    "llm_circuit_open", "1 while the LLM circuit breaker is open or half-open", ("provider",))
+
+
+def record_tokens(provider: str, model: str, usage: Dict[str, int]):
+    for kind, count in usage.items():
+        if count:
+            llm_tokens_total.inc(count, provider=provider, model=model, kind=kind)
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting requests, in-flight requests and latency per route.
+
+    Implemented at the ASGI level so streaming responses are timed until the
+    last byte, not just until their headers are sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        http_requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_requests_in_flight.dec()
+            # Label by route template, not raw path, to keep label cardinality bounded
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope["method"]
+            http_requests_total.inc(method=method, route=route, status=status["code"])
+            http_request_duration_seconds.observe(time.perf_counter() - started, method=method, route=route)
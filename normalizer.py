@@ -0,0 +1,296 @@
+"""Conversion of spoken punctuation and measurements in dictations.
+
+All rules are compiled into one case-insensitive, trie-shaped regular
+expression, so the cost of normalizing a dictation does not grow with the
+number of rules enabled, and every dictation goes through the same single
+pass whatever its spacing or casing. The original casing of the dictation
+is preserved.
+"""
+import os
+import re
+import json
+import logging
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Comma-separated rule set names applied by normalize() when none are given
+NORMALIZER_RULE_SETS = os.getenv("NORMALIZER_RULE_SETS", "punctuation,brackets,numerals")
+# Optional JSON file of extra rule sets: {"name": [["spoken", "symbol", "kind"], ...]}
+NORMALIZER_VOCABULARY_FILE = os.getenv("NORMALIZER_VOCABULARY_FILE", "")
+
+# How a symbol joins the surrounding words
+ATTACH = "attach"    # "clear full stop" -> "clear."
+NEWLINE = "newline"  # whitespace on both sides is dropped
+OPEN = "open"        # "open bracket" -> "(" joined to the following word
+CLOSE = "close"      # "close bracket" -> ")" joined to the preceding word
+REPLACE = "replace"  # plain substitution, spacing kept as dictated
+
+RULE_KINDS = (ATTACH, NEWLINE, OPEN, CLOSE, REPLACE)
+
+# Pseudo rule set that enables "<number> <unit>" conversion
+NUMERALS = "numerals"
+
+
+@dataclass(frozen=True)
+class Rule:
+    spoken: str
+    symbol: str
+    kind: str = ATTACH
+
+
+RULE_SETS: Dict[str, List[Rule]] = {
+    "punctuation": [
+        Rule("full stop", "."),
+        Rule("period", "."),
+        Rule("comma", ","),
+        Rule("exclamation mark", "!"),
+        Rule("question mark", "?"),
+        Rule("colon", ":"),
+        Rule("semicolon", ";"),
+        Rule("new line", "\n", NEWLINE),
+        Rule("newline", "\n", NEWLINE),
+        Rule("new paragraph", "\n\n", NEWLINE),
+    ],
+    "brackets": [
+        Rule("open bracket", "(", OPEN),
+        Rule("open brackets", "(", OPEN),
+        Rule("open parenthesis", "(", OPEN),
+        Rule("close bracket", ")", CLOSE),
+        Rule("close brackets", ")", CLOSE),
+        Rule("close parenthesis", ")", CLOSE),
+    ],
+}
+
+NUMBER_WORDS = {
+    "zero": 0, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10,
+    "eleven": 11, "twelve": 12, "thirteen": 13, "fourteen": 14, "fifteen": 15,
+    "sixteen": 16, "seventeen": 17, "eighteen": 18, "nineteen": 19,
+    "twenty": 20, "thirty": 30, "forty": 40, "fifty": 50,
+    "sixty": 60, "seventy": 70, "eighty": 80, "ninety": 90,
+    "hundred": 100,
+}
+
+UNITS = {
+    "millimetre": "mm", "millimetres": "mm", "millimeter": "mm", "millimeters": "mm",
+    "centimetre": "cm", "centimetres": "cm", "centimeter": "cm", "centimeters": "cm",
+    "millilitre": "ml", "millilitres": "ml", "milliliter": "ml", "milliliters": "ml",
+    "milligram": "mg", "milligrams": "mg",
+    "hounsfield unit": "HU", "hounsfield units": "HU",
+    "percent": "%", "per cent": "%",
+    "mm": "mm", "cm": "cm", "ml": "ml", "mg": "mg",
+}
+
+
+def register_rule_set(name: str, rules: Iterable[Rule]):
+    """Add or replace a named rule set, e.g. a department vocabulary"""
+    rules = list(rules)
+    for rule in rules:
+        if rule.kind not in RULE_KINDS:
+            raise ValueError(f"Unknown rule kind '{rule.kind}' for '{rule.spoken}'")
+    RULE_SETS[name] = rules
+    _compiled_normalizer.cache_clear()
+
+
+def load_vocabulary_file(path: str):
+    """Register every rule set defined in a JSON vocabulary file"""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    for name, entries in data.items():
+        register_rule_set(name, [Rule(*entry) for entry in entries])
+        logger.info(f"Loaded normalizer rule set '{name}' with {len(entries)} rules")
+
+
+def _alternation(phrases: Iterable[str]) -> str:
+    """Build a trie-shaped regex so shared prefixes are only tested once.
+
+    A flat "a|b|c" alternation makes the regex engine retry every phrase at
+    every candidate position; factoring common prefixes keeps the per-position
+    cost close to constant as rule sets grow.
+    """
+    trie: dict = {}
+    for phrase in phrases:
+        node = trie
+        for char in " ".join(phrase.lower().split()):
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: dict) -> str:
+        branches = []
+        for char in sorted(k for k in node if k):
+            # Allow any run of spaces between the words of a multi-word phrase
+            head = r"[ \t]+" if char == " " else re.escape(char)
+            branches.append(head + build(node[char]))
+        if not branches:
+            return ""
+        if "" in node:
+            return f"(?:{'|'.join(branches)})?"
+        if len(branches) == 1:
+            return branches[0]
+        return f"(?:{'|'.join(branches)})"
+
+    return build(trie)
+
+
+def _key(phrase: str) -> str:
+    return " ".join(phrase.lower().split())
+
+
+def _below_hundred(words: Sequence[str], i: int) -> Optional[tuple]:
+    """Parse "seven", "fourteen", "forty" or "forty two" at words[i]; returns (value, next index)"""
+    value = NUMBER_WORDS.get(words[i]) if i < len(words) else None
+    if value is None or value >= 100:
+        return None
+    if value >= 20 and i + 1 < len(words) and 1 <= NUMBER_WORDS.get(words[i + 1], 0) <= 9:
+        return value + NUMBER_WORDS[words[i + 1]], i + 2
+    return value, i + 1
+
+
+def words_to_number(words: Sequence[str]) -> Optional[str]:
+    """Convert spoken number words ("two point five") to digits ("2.5").
+
+    Only well-formed numbers are converted: a number below one hundred,
+    "N hundred [and] M", each optionally followed by "point" and single
+    digits. Anything else ("ten twenty", "one two three") returns None so
+    the dictation is left as spoken rather than silently changed.
+    """
+    if len(words) >= 2 and words[1] == "hundred":
+        if not 1 <= NUMBER_WORDS.get(words[0], 0) <= 9:
+            return None
+        whole, i = NUMBER_WORDS[words[0]] * 100, 2
+        if i < len(words) and words[i] != "point":
+            if words[i] == "and":
+                i += 1
+            parsed = _below_hundred(words, i)
+            if parsed is None:
+                return None
+            whole, i = whole + parsed[0], parsed[1]
+    else:
+        parsed = _below_hundred(words, 0)
+        if parsed is None:
+            return None
+        whole, i = parsed
+    if i == len(words):
+        return str(whole)
+    digits = words[i + 1:]
+    if words[i] != "point" or not digits or any(NUMBER_WORDS.get(word, 10) > 9 for word in digits):
+        return None
+    return f"{whole}." + "".join(str(NUMBER_WORDS[word]) for word in digits)
+
+
+@lru_cache(maxsize=1024)
+def _spoken_number(phrase: str) -> Optional[str]:
+    return words_to_number(_NUMBER_SEPARATOR.split(phrase))
+
+
+def _measurement(pre: str, number: str, unit: str) -> Optional[str]:
+    """Replacement for "<number> <unit>", or None if the number is not well-formed"""
+    if not number[0].isdigit():
+        number = _spoken_number(number.lower())
+        if number is None:
+            return None
+    unit = UNITS[_key(unit)]
+    return f"{pre}{number}{unit}" if unit == "%" else f"{pre}{number} {unit}"
+
+
+def _rule_text(rule: Rule, pre: str) -> str:
+    """Replacement for a spoken rule preceded by the whitespace `pre`"""
+    symbol = rule.symbol + _JOIN_MARK if rule.kind in (NEWLINE, OPEN) else rule.symbol
+    if rule.kind in (ATTACH, CLOSE, NEWLINE):
+        return symbol
+    return pre + symbol
+
+
+_NUMBER_SEPARATOR = re.compile(r"[ \t-]+")
+
+
+class Normalizer:
+    """Compiled normalizer for a fixed list of rules"""
+
+    def __init__(self, rules: Iterable[Rule], numerals: bool = True):
+        tight = {}
+        loose = {}
+        for rule in rules:
+            # Symbols that drop the following whitespace are marked for a cleanup pass
+            target = tight if rule.kind in (NEWLINE, OPEN) else loose
+            target[_key(rule.spoken)] = rule
+        self._rules = {**loose, **tight}
+
+        alternatives = []
+        if numerals:
+            number_word = _alternation(NUMBER_WORDS)
+            number = rf"\d+(?:\.\d+)?|{number_word}(?:[ \t-]+(?:{number_word}|point|and))*"
+            alternatives.append(rf"(?P<number>{number})[ \t]+(?P<unit>{_alternation(UNITS)})\b")
+        if tight:
+            alternatives.append(rf"(?P<tight>{_alternation(tight)})\b")
+        if loose:
+            alternatives.append(rf"(?P<loose>{_alternation(loose)})\b")
+        # Every match starts with whitespace, which gives the engine a cheap
+        # literal prefix to scan for instead of attempting a match at every character
+        pattern = rf"(?P<pre>[ \t]+)(?:{'|'.join(alternatives)})" if alternatives else r"(?!)"
+        self.pattern = re.compile(pattern, re.IGNORECASE)
+
+    def _replace(self, match: "re.Match") -> str:
+        pre = match.group("pre")
+        number = _group(match, "number")
+        if number is not None:
+            replacement = _measurement(pre, number, match.group("unit"))
+            return match.group(0) if replacement is None else replacement
+
+        tight = _group(match, "tight")
+        return _rule_text(self._rules[_key(tight or match.group("loose"))], pre)
+
+    def normalize(self, text: str) -> str:
+        text = text.replace(_JOIN_MARK, "")
+        # Leading space lets a rule match at the very start of the dictation
+        text = self.pattern.sub(self._replace, " " + text)
+        if _JOIN_MARK in text:
+            text = _JOIN_PATTERN.sub("", text)
+        return text.strip()
+
+    __call__ = normalize
+
+
+# Placed after "(" and line breaks; the following whitespace is removed in one
+# extra pass so the next word or measurement can still be matched normally
+_JOIN_MARK = "\x00"
+_JOIN_PATTERN = re.compile(_JOIN_MARK + r"[ \t]*")
+
+
+def _group(match: "re.Match", name: str) -> Optional[str]:
+    # Optional alternatives are absent from the pattern when their rule set is disabled
+    try:
+        return match.group(name)
+    except IndexError:
+        return None
+
+
+@lru_cache(maxsize=32)
+def _compiled_normalizer(rule_set_names: tuple) -> Normalizer:
+    rules = []
+    for name in rule_set_names:
+        if name == NUMERALS:
+            continue
+        if name not in RULE_SETS:
+            raise KeyError(f"Unknown normalizer rule set '{name}'")
+        rules.extend(RULE_SETS[name])
+    return Normalizer(rules, numerals=NUMERALS in rule_set_names)
+
+
+def get_normalizer(rule_sets: Optional[Sequence[str]] = None) -> Normalizer:
+    """Return the compiled normalizer for the given (or configured) rule sets"""
+    if rule_sets is None:
+        rule_sets = [name.strip() for name in NORMALIZER_RULE_SETS.split(",") if name.strip()]
+    return _compiled_normalizer(tuple(rule_sets))
+
+
+def normalize(text: str, rule_sets: Optional[Sequence[str]] = None) -> str:
+    """Convert spoken punctuation and measurements in a dictation"""
+    return get_normalizer(rule_sets).normalize(text)
+
+
+if NORMALIZER_VOCABULARY_FILE:
+    load_vocabulary_file(NORMALIZER_VOCABULARY_FILE)
@@ -0,0 +1,92 @@
+import logging
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+import normalizer
+import tracing
+from database import Report
+from defaults import default_system_prompt
+from registry import PromptRecord, registry
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """Convert spoken punctuation and measurements to symbols"""
+    with tracing.span("normalize", chars=len(text)):
+        return normalizer.normalize(text)
+
+
+def resolve_template_content(db: Session, template_name: Optional[str]) -> str:
+    """Return the content of the named template, or an empty string"""
+    if template_name:
+        db_template = registry.get_template(db, template_name)
+        if db_template:
+            return db_template.content
+    return ""
+
+
+def resolve_prompt(db: Session, prompt_id: Optional[int]) -> Optional[PromptRecord]:
+    """Return the requested prompt, else the active prompt; None means use the default"""
+    # If a prompt_id is provided, use that prompt
+    if prompt_id:
+        return registry.get_prompt(db, prompt_id)
+    # Otherwise, use the active prompt if one exists
+    return registry.active_prompt(db)
+
+
+def prompt_content(prompt: Optional[PromptRecord]) -> str:
+    return prompt.content if prompt else default_system_prompt
+
+
+def resolve_prompt_content(db: Session, prompt_id: Optional[int]) -> str:
+    """Return the requested prompt, falling back to the active prompt and then the default"""
+    return prompt_content(resolve_prompt(db, prompt_id))
+
+
+def build_system_prompt(prompt_content: str, template_content: str) -> str:
+    """Add template instruction to the system prompt if a template exists"""
+    if template_content:
+        return f"{prompt_content}\n\nUse the following template structure for the report:\n{template_content}"
+    return prompt_content
+
+
+def build_user_prompt(text: str) -> str:
+    """Create the user prompt with the transcribed text"""
+    return f"""Here is the transcribed speech to convert into a professional radiology report:
+
+{text}
+
+Please write in a natural, flowing style as a radiologist would dictate. Avoid breaking the report into many sections."""
+
+
+def derive_title(processed_text: str) -> str:
+    """Generate a title from the first non-empty line of the processed text"""
+    title_lines = processed_text.strip().split('\n')
+    title = next((line for line in title_lines if line.strip()), "Radiology Report")
+    if len(title) > 50:  # Limit title length
+        title = title[:47] + "..."
+    return title
+
+
+def build_report(text: str, processed_text: str, template_name: Optional[str]) -> Report:
+    """Create an unsaved report for a processed dictation"""
+    return Report(
+        title=derive_title(processed_text),
+        raw_transcription=text,
+        processed_text=processed_text,
+        template_name=template_name
+    )
+
+
+def save_report(db: Session, text: str, processed_text: str, template_name: Optional[str]) -> Report:
+    """Persist a processed dictation as a new report"""
+    db_report = build_report(text, processed_text, template_name)
+    with tracing.span("db_insert"):
+        db.add(db_report)
+        db.flush()
+    with tracing.span("db_commit"):
+        db.commit()
+        db.refresh(db_report)
+    return db_report
@@ -0,0 +1,353 @@
+"""LLM providers behind a common interface.
+
+Every provider takes a system prompt and a user prompt and returns a
+Completion with the generated text and token usage, so the /process
+pipeline does not depend on any one vendor's SDK. LLM_PROVIDER selects
+"anthropic" (default), "gemini" or "stub"; the stub needs no network and
+is meant for load tests and offline development.
+"""
+import os
+import math
+import random
+import asyncio
+import hashlib
+import inspect
+import logging
+import functools
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional, Union
+
+import httpx
+
+import tracing
+from executor import run_llm
+
+logger = logging.getLogger(__name__)
+
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "anthropic").lower()
+
+# Shared HTTP connection pool for the Anthropic client
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "10"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "120"))
+# Rough size of a token in characters, for estimates made before (or without) a real count;
+# on the low side so rate-limit admission errs towards overestimating
+LLM_CHARS_PER_TOKEN = float(os.getenv("LLM_CHARS_PER_TOKEN", "3.5"))
+
+# Mark the system prompt (prompt + template) as a cacheable prefix. Prefixes
+# shorter than the model's minimum (about 1024 tokens for Sonnet) are simply
+# not cached, so this is safe to leave on.
+LLM_PROMPT_CACHING = os.getenv("LLM_PROMPT_CACHING", "true").lower() in ("1", "true", "yes")
+
+ANTHROPIC_MODEL = os.getenv("ANTHROPIC_MODEL", "claude-sonnet-4-20250514")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+# Cheaper, lower-latency models used for short dictations (see routing.py)
+ANTHROPIC_FAST_MODEL = os.getenv("ANTHROPIC_FAST_MODEL", "claude-haiku-4-5")
+GEMINI_FAST_MODEL = os.getenv("GEMINI_FAST_MODEL", "gemini-2.0-flash-lite")
+
+# Stub behaviour: latency per call, +/- jitter, and report length
+LLM_STUB_LATENCY_MS = float(os.getenv("LLM_STUB_LATENCY_MS", "200"))
+LLM_STUB_JITTER_MS = float(os.getenv("LLM_STUB_JITTER_MS", "50"))
+LLM_STUB_OUTPUT_WORDS = int(os.getenv("LLM_STUB_OUTPUT_WORDS", "150"))
+LLM_STUB_SEED = os.getenv("LLM_STUB_SEED", "0")
+# Share of stub calls that fail with a 529 "overloaded" error, for resilience testing
+LLM_STUB_ERROR_RATE = float(os.getenv("LLM_STUB_ERROR_RATE", "0"))
+
+USAGE_FIELDS = ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens")
+
+
+
+class ProviderError(Exception):
+    """Provider failure carrying an HTTP-style status code"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class Completion(NamedTuple):
+    text: str
+    model: str
+    usage: Dict[str, int]
+
+
+def empty_usage() -> Dict[str, int]:
+    return dict.fromkeys(USAGE_FIELDS, 0)
+
+
+def estimate_tokens(*texts: str) -> int:
+    """Rough token count of the given texts, from LLM_CHARS_PER_TOKEN"""
+    return max(1, sum(math.ceil(len(text) / LLM_CHARS_PER_TOKEN) for text in texts if text))
+
+
+class LLMProvider:
+    """Interface implemented by each provider"""
+
+    name = "base"
+    default_model = ""
+    fast_model = ""
+
+    @property
+    def configured(self) -> bool:
+        return True
+
+    async def complete(self, system: str, user_prompt: str, model: str,
+                       max_tokens: int, temperature: float) -> Completion:
+        raise NotImplementedError
+
+    async def stream(self, system: str, user_prompt: str, model: str, max_tokens: int,
+                     temperature: float, usage: Dict[str, int]) -> AsyncIterator[str]:
+        """Yield text deltas; token counts are written into `usage` once the stream ends"""
+        raise NotImplementedError
+        yield
+
+    def prepare(self):
+        """Import the SDK and build the client ahead of the first call (blocking)"""
+
+    async def aclose(self):
+        pass
+
+
+def system_blocks(system: str, cache: bool = LLM_PROMPT_CACHING) -> Union[str, List[dict]]:
+    """System prompt in the form sent to the Messages API, with a cache breakpoint when enabled"""
+    if not cache or not system:
+        return system
+    return [{"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}]
+
+
+@functools.lru_cache(maxsize=None)
+def _sdk_takes_temperature() -> bool:
+    """Newer SDK releases dropped the temperature argument; it is sent in the body there"""
+    import anthropic
+    return "temperature" in inspect.signature(anthropic.resources.messages.AsyncMessages.create).parameters
+
+
+def sampling_args(temperature: float) -> dict:
+    if _sdk_takes_temperature():
+        return {"temperature": temperature}
+    return {"extra_body": {"temperature": temperature}}
+
+
+def anthropic_usage(usage) -> Dict[str, int]:
+    return {field: getattr(usage, field, None) or 0 for field in USAGE_FIELDS}
+
+
+def response_text(response) -> str:
+    """Concatenate the text blocks of a Messages API response"""
+    processed_text = ""
+    for content_block in response.content:
+        if hasattr(content_block, 'text'):
+            processed_text += content_block.text
+    return processed_text
+
+
+class AnthropicProvider(LLMProvider):
+    """Claude through the async SDK with a pooled HTTP transport"""
+
+    name = "anthropic"
+    default_model = ANTHROPIC_MODEL
+    fast_model = ANTHROPIC_FAST_MODEL
+
+    def __init__(self, api_key: Optional[str] = None):
+        self.api_key = api_key or os.getenv("ANTHROPIC_API_KEY") or os.getenv("CLAUDE_API_KEY", "")
+        self._client: Optional["anthropic.AsyncAnthropic"] = None
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key)
+
+    @property
+    def client(self) -> "anthropic.AsyncAnthropic":
+        # Build the client (and import the SDK, which is slow) on first use
+        if self._client is None:
+            import anthropic
+            http_client = anthropic.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+                ),
+                timeout=httpx.Timeout(LLM_TIMEOUT_SECONDS, connect=10.0),
+            )
+            # Retries are handled by resilience.Resilience, so the SDK must not retry as well
+            self._client = anthropic.AsyncAnthropic(api_key=self.api_key, http_client=http_client, max_retries=0)
+        return self._client
+
+    async def complete(self, system, user_prompt, model, max_tokens, temperature):
+        response = await self.client.messages.create(
+            model=model,
+            max_tokens=max_tokens,
+            system=system_blocks(system),
+            **sampling_args(temperature),
+            messages=[{"role": "user", "content": user_prompt}],
+            # Lets provider-side logs be matched to our own
+            extra_headers=tracing.request_headers(),
+        )
+        if not response or not getattr(response, 'content', None):
+            raise ValueError(f"Unexpected Claude API response: {response}")
+        return Completion(response_text(response), model, anthropic_usage(getattr(response, "usage", None)))
+
+    async def stream(self, system, user_prompt, model, max_tokens, temperature, usage):
+        async with self.client.messages.stream(
+            model=model,
+            max_tokens=max_tokens,
+            system=system_blocks(system),
+            **sampling_args(temperature),
+            messages=[{"role": "user", "content": user_prompt}],
+            # Lets provider-side logs be matched to our own
+            extra_headers=tracing.request_headers(),
+        ) as stream:
+            async for text in stream.text_stream:
+                yield text
+            message = await stream.get_final_message()
+        usage.update(anthropic_usage(message.usage))
+
+    def prepare(self):
+        if self.configured:
+            _sdk_takes_temperature()
+            self.client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+
+class GeminiProvider(LLMProvider):
+    """Gemini through google-generativeai; its sync calls run on the llm thread pool"""
+
+    name = "gemini"
+    default_model = GEMINI_MODEL
+    fast_model = GEMINI_FAST_MODEL
+
+    def __init__(self, api_key: Optional[str] = None):
+        self.api_key = api_key or os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY", "")
+        self._genai = None
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key)
+
+    @property
+    def genai(self):
+        if self._genai is None:
+            # Optional dependency: only needed when this provider is selected
+            try:
+                import google.generativeai as genai
+            except ImportError as e:
+                raise RuntimeError("LLM_PROVIDER=gemini requires the google-generativeai package") from e
+            genai.configure(api_key=self.api_key)
+            self._genai = genai
+        return self._genai
+
+    def prepare(self):
+        if self.configured:
+            self.genai
+
+    def _model(self, system: str, model: str):
+        return self.genai.GenerativeModel(model, system_instruction=system or None)
+
+    @staticmethod
+    def _usage(response) -> Dict[str, int]:
+        metadata = getattr(response, "usage_metadata", None)
+        usage = empty_usage()
+        if metadata is not None:
+            cached = getattr(metadata, "cached_content_token_count", 0) or 0
+            usage["input_tokens"] = (getattr(metadata, "prompt_token_count", 0) or 0) - cached
+            usage["output_tokens"] = getattr(metadata, "candidates_token_count", 0) or 0
+            usage["cache_read_input_tokens"] = cached
+        return usage
+
+    async def complete(self, system, user_prompt, model, max_tokens, temperature):
+        config = {"max_output_tokens": max_tokens, "temperature": temperature}
+        response = await run_llm(
+            lambda: self._model(system, model).generate_content(user_prompt, generation_config=config)
+        )
+        if not response or not hasattr(response, 'text'):
+            raise ValueError(f"Unexpected Gemini API response: {response}")
+        return Completion(response.text, model, self._usage(response))
+
+    async def stream(self, system, user_prompt, model, max_tokens, temperature, usage):
+        config = {"max_output_tokens": max_tokens, "temperature": temperature}
+        response = await run_llm(
+            lambda: self._model(system, model).generate_content(user_prompt, generation_config=config, stream=True)
+        )
+        chunks = iter(response)
+        # Each chunk is fetched on the pool so the event loop never blocks on the network
+        while True:
+            chunk = await run_llm(next, chunks, None, reject_when_full=False)
+            if chunk is None:
+                break
+            if chunk.text:
+                yield chunk.text
+        usage.update(self._usage(response))
+
+
+class StubProvider(LLMProvider):
+    """Deterministic offline provider for load tests.
+
+    The same prompts always produce the same report, and the simulated latency
+    (LLM_STUB_LATENCY_MS +/- LLM_STUB_JITTER_MS) is drawn from a generator
+    seeded by the prompt, so runs are repeatable.
+    """
+
+    name = "stub"
+    default_model = "stub"
+    fast_model = "stub-fast"
+
+    _VOCABULARY = (
+        "normal", "unremarkable", "no", "acute", "abnormality", "lungs", "are", "clear",
+        "heart", "size", "within", "limits", "there", "is", "mild", "degenerative",
+        "change", "without", "focal", "lesion", "effusion", "consolidation", "identified",
+    )
+
+    def __init__(self, latency_ms: float = LLM_STUB_LATENCY_MS, jitter_ms: float = LLM_STUB_JITTER_MS,
+                 output_words: int = LLM_STUB_OUTPUT_WORDS, seed: str = LLM_STUB_SEED,
+                 error_rate: float = LLM_STUB_ERROR_RATE):
+        self.error_rate = error_rate
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.output_words = output_words
+        self.seed = seed
+
+    def _generate(self, system: str, user_prompt: str, max_tokens: int):
+        digest = hashlib.sha256(f"{self.seed}\0{system}\0{user_prompt}".encode()).hexdigest()
+        rng = random.Random(digest)
+        latency = max(0.0, self.latency_ms + rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+        words = [rng.choice(self._VOCABULARY) for _ in range(min(self.output_words, max_tokens))]
+        text = f"Stub report {digest[:12]}\n\nFindings: {' '.join(words)}.\n\nImpression: No acute abnormality."
+        usage = empty_usage()
+        usage["input_tokens"] = estimate_tokens(system, user_prompt)
+        usage["output_tokens"] = len(words) + 8
+        return text, latency, usage
+
+    def _maybe_fail(self):
+        # Failures are random rather than seeded, so a retry of the same prompt can succeed
+        if self.error_rate and random.random() < self.error_rate:
+            raise ProviderError("Stub provider overloaded", status_code=529)
+
+    async def complete(self, system, user_prompt, model, max_tokens, temperature):
+        text, latency, usage = self._generate(system, user_prompt, max_tokens)
+        await asyncio.sleep(latency)
+        self._maybe_fail()
+        return Completion(text, model, usage)
+
+    async def stream(self, system, user_prompt, model, max_tokens, temperature, usage):
+        text, latency, stub_usage = self._generate(system, user_prompt, max_tokens)
+        self._maybe_fail()
+        chunks = text.split(" ")
+        for i, chunk in enumerate(chunks):
+            await asyncio.sleep(latency / len(chunks))
+            yield chunk if i == len(chunks) - 1 else chunk + " "
+        usage.update(stub_usage)
+
+
+PROVIDERS = {
+    AnthropicProvider.name: AnthropicProvider,
+    GeminiProvider.name: GeminiProvider,
+    StubProvider.name: StubProvider,
+}
+
+
+def create_provider(name: str = LLM_PROVIDER, **kwargs) -> LLMProvider:
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown LLM provider '{name}'; expected one of {', '.join(PROVIDERS)}")
+    return PROVIDERS[name](**kwargs)
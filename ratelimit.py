@@ -0,0 +1,236 @@
+"""Admission control for provider calls: token buckets and a per-client fair queue.
+
+Every provider attempt (retries and hedges included) asks the scheduler
+for admission. It is admitted when:
+
+  - fewer than max_concurrency attempts are in flight,
+  - the requests bucket (RPM) has a token,
+  - the input-tokens bucket (ITPM) covers the estimated prompt size, and
+  - the output-tokens bucket (OTPM) covers max_tokens.
+
+Buckets hold one minute's worth and refill continuously, like the
+provider's own limits. When the call finishes, the estimates are corrected
+with the real usage, so unused output tokens and cached prompt tokens go
+back into the buckets.
+
+Waiting attempts queue per client: the X-Client-ID header if the caller
+sends one, otherwise the client address. Clients are served round-robin,
+so one radiologist's batch cannot starve everyone else.
+
+Limits are per worker process. serve.py treats them as the account's
+limits and gives each worker its share. 0 disables a limit.
+"""
+import re
+import time
+import asyncio
+import logging
+import contextvars
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CLIENT_ID_HEADER = "X-Client-ID"
+ANONYMOUS = "anonymous"
+
+_VALID_CLIENT_ID = re.compile(r"^[A-Za-z0-9._:@-]{1,128}$")
+
+client_var: contextvars.ContextVar[str] = contextvars.ContextVar("client_id", default=ANONYMOUS)
+
+
+def current_client() -> str:
+    return client_var.get()
+
+
+def bind_client(client_id: Optional[str]):
+    """Attribute provider calls in the current context to a client, e.g. for a background job"""
+    client_var.set(client_id or ANONYMOUS)
+
+
+class TokenBucket:
+    """Holds up to `per_minute` tokens and refills at per_minute / 60 per second"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` tokens are available (0 if they are now)"""
+        if not self.enabled:
+            return 0.0
+        self._refill(now)
+        # A request bigger than the whole bucket would wait forever; let it through when full
+        deficit = min(amount, self.capacity) - self.tokens
+        return deficit / self.rate if deficit > 0 else 0.0
+
+    def take(self, amount: float):
+        if self.enabled:
+            self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, amount: float):
+        """Return unused tokens (positive) or charge for an underestimate (negative)"""
+        if self.enabled:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class Ticket:
+    """One admitted attempt and what was reserved for it"""
+
+    __slots__ = ("client", "input_tokens", "output_tokens")
+
+    def __init__(self, client: str, input_tokens: int, output_tokens: int):
+        self.client = client
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+
+
+class FairScheduler:
+    """Admits provider attempts within concurrency and rate limits, round-robin across clients"""
+
+    def __init__(self, name: str, max_concurrency: int, requests_per_minute: float,
+                 input_tokens_per_minute: float, output_tokens_per_minute: float):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.requests = TokenBucket(requests_per_minute)
+        self.input_tokens = TokenBucket(input_tokens_per_minute)
+        self.output_tokens = TokenBucket(output_tokens_per_minute)
+        self._queues: Dict[str, Deque[Tuple[Ticket, asyncio.Future]]] = {}
+        # Clients with waiting attempts, in the order they will be served
+        self._clients: Deque[str] = deque()
+        self._in_flight = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def queued(self) -> int:
+        return sum(1 for queue in self._queues.values() for _, waiter in queue if not waiter.done())
+
+    async def acquire(self, input_tokens: int, output_tokens: int, client: Optional[str] = None) -> Ticket:
+        """Wait for admission; the caller must release() the ticket when the attempt ends"""
+        ticket = Ticket(client or current_client(), input_tokens, output_tokens)
+        waiter = asyncio.get_running_loop().create_future()
+        queue = self._queues.get(ticket.client)
+        if queue is None:
+            queue = self._queues[ticket.client] = deque()
+            self._clients.append(ticket.client)
+        queue.append((ticket, waiter))
+        started = time.perf_counter()
+        self._dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Admitted in the same instant the caller gave up
+                self.release(ticket)
+            else:
+                self._dispatch()
+            raise
+        finally:
+            metrics.llm_queue_wait_seconds.observe(time.perf_counter() - started, provider=self.name)
+            metrics.llm_queued_requests.set(self.queued(), provider=self.name)
+        return ticket
+
+    def release(self, ticket: Ticket, usage: Optional[Dict[str, int]] = None):
+        """Free the slot and settle the token reservation against real usage (None if the call failed)"""
+        self._in_flight -= 1
+        if usage is None:
+            # A failed call generated nothing
+            self.output_tokens.adjust(ticket.output_tokens)
+        else:
+            # Prompt-cache reads do not count towards the input-token limit
+            used_input = usage.get("input_tokens", 0) + usage.get("cache_creation_input_tokens", 0)
+            self.input_tokens.adjust(ticket.input_tokens - used_input)
+            self.output_tokens.adjust(ticket.output_tokens - usage.get("output_tokens", 0))
+        self._dispatch()
+
+    def _dispatch(self):
+        """Admit waiting attempts, one per client in turn, while limits allow"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._clients:
+            client = self._clients[0]
+            queue = self._queues[client]
+            while queue and queue[0][1].done():
+                # Cancelled while waiting
+                queue.popleft()
+            if not queue:
+                self._clients.popleft()
+                del self._queues[client]
+                continue
+            if self._in_flight >= self.max_concurrency:
+                return
+            ticket, waiter = queue[0]
+            now = time.monotonic()
+            delay = max(
+                self.requests.wait_time(1, now),
+                self.input_tokens.wait_time(ticket.input_tokens, now),
+                self.output_tokens.wait_time(ticket.output_tokens, now),
+            )
+            if delay > 0:
+                # Keep this client's turn so large requests are not starved by small ones
+                self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                return
+            queue.popleft()
+            self.requests.take(1)
+            self.input_tokens.take(ticket.input_tokens)
+            self.output_tokens.take(ticket.output_tokens)
+            self._in_flight += 1
+            waiter.set_result(None)
+            # The next client goes first; this one rejoins at the back if it has more waiting
+            self._clients.rotate(-1)
+            if not queue:
+                self._clients.pop()
+                del self._queues[client]
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        for bucket in (self.requests, self.input_tokens, self.output_tokens):
+            bucket.wait_time(0, now)
+        return {
+            "in_flight": self._in_flight,
+            "max_concurrency": self.max_concurrency,
+            "queued": self.queued(),
+            "queued_clients": len(self._clients),
+            "available": {
+                name: round(bucket.tokens, 1) if bucket.enabled else None
+                for name, bucket in (("requests", self.requests), ("input_tokens", self.input_tokens),
+                                     ("output_tokens", self.output_tokens))
+            },
+        }
+
+
+def client_id_from_scope(scope) -> str:
+    """X-Client-ID if it looks sane, else the first forwarded address, else the peer address"""
+    headers = dict(scope.get("headers", []))
+    client_id = headers.get(b"x-client-id", b"").decode("latin-1")
+    if _VALID_CLIENT_ID.match(client_id):
+        return client_id
+    forwarded = headers.get(b"x-forwarded-for", b"").decode("latin-1").split(",")[0].strip()
+    if forwarded:
+        return forwarded
+    client = scope.get("client")
+    return client[0] if client else ANONYMOUS
+
+
+class ClientMiddleware:
+    """ASGI middleware that attributes the request's provider calls to its client"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            bind_client(client_id_from_scope(scope))
+        await self.app(scope, receive, send)
@@ -0,0 +1,178 @@
+import os
+import time
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from database import Template as DBTemplate, Prompt as DBPrompt, RegistryVersion
+
+logger = logging.getLogger(__name__)
+
+# How often to compare the local snapshot against the shared version counter
+REGISTRY_VERSION_CHECK_SECONDS = float(os.getenv("REGISTRY_VERSION_CHECK_SECONDS", "5"))
+# Reload unconditionally after this long, to pick up writes made outside the API
+REGISTRY_MAX_AGE_SECONDS = float(os.getenv("REGISTRY_MAX_AGE_SECONDS", "300"))
+
+
+class RegistryError(ValueError):
+    """A registry version that cannot be served, e.g. a prompt with an invalid routing override"""
+
+
+@dataclass(frozen=True)
+class TemplateRecord:
+    id: int
+    name: str
+    content: str
+    created_at: Optional[datetime]
+    updated_at: Optional[datetime]
+
+
+@dataclass(frozen=True)
+class PromptRecord:
+    id: int
+    name: str
+    content: str
+    is_default: int
+    is_active: int
+    created_at: Optional[datetime]
+    updated_at: Optional[datetime]
+    model: Optional[str] = None
+    max_tokens: Optional[int] = None
+
+
+class Registry:
+    """Read-through, in-memory snapshot of the templates and prompts tables.
+
+    Writers call invalidate() after committing, which marks the local snapshot
+    stale and bumps the shared registry_version row. Other workers compare that
+    counter at most every REGISTRY_VERSION_CHECK_SECONDS and reload on change.
+    A version that fails validation is rejected and the previous snapshot is
+    kept; with no previous snapshot, reads raise RegistryError.
+    """
+
+    def __init__(
+        self,
+        check_interval: float = REGISTRY_VERSION_CHECK_SECONDS,
+        max_age: float = REGISTRY_MAX_AGE_SECONDS,
+    ):
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._templates: Optional[Dict[str, TemplateRecord]] = None
+        self._prompts: Optional[Dict[int, PromptRecord]] = None
+        self._version: Optional[int] = None
+        self._rejected_version: Optional[int] = None
+        self._stale = False
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+
+    @property
+    def version(self) -> Optional[int]:
+        return self._version
+
+    def _read_version(self, db: Session) -> int:
+        row = db.get(RegistryVersion, 1)
+        return row.version if row else 0
+
+    def _load(self, db: Session, version: int):
+        templates = db.query(DBTemplate).order_by(DBTemplate.id).all()
+        prompts = db.query(DBPrompt).order_by(DBPrompt.id).all()
+        for p in prompts:
+            _validate_prompt(p)
+        self._templates = {
+            t.name: TemplateRecord(t.id, t.name, t.content, t.created_at, t.updated_at)
+            for t in templates
+        }
+        self._prompts = {
+            p.id: PromptRecord(p.id, p.name, p.content, p.is_default, p.is_active, p.created_at, p.updated_at,
+                               p.model, p.max_tokens)
+            for p in prompts
+        }
+        self._version = version
+        self._stale = False
+        self._loaded_at = time.monotonic()
+        logger.info(f"Loaded registry version {version}: {len(templates)} templates, {len(prompts)} prompts")
+
+    def _ensure_fresh(self, db: Session) -> Tuple[Dict[str, TemplateRecord], Dict[int, PromptRecord]]:
+        """Reload if stale and return the current snapshot.
+
+        Callers must use the returned dicts rather than re-reading the
+        attributes, which invalidate() may reset at any moment.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._templates is not None and not self._stale:
+                if now - self._loaded_at < self.max_age and now - self._checked_at < self.check_interval:
+                    return self._templates, self._prompts
+            version = self._read_version(db)
+            self._checked_at = now
+            changed = version != self._version and version != self._rejected_version
+            if self._templates is None or self._stale or changed or now - self._loaded_at >= self.max_age:
+                try:
+                    self._load(db, version)
+                except RegistryError as e:
+                    if self._templates is None:
+                        raise
+                    # Retried when the version changes again or the snapshot reaches max_age
+                    self._rejected_version = version
+                    self._stale = False
+                    logger.error(f"Rejected registry version {version}, still serving version {self._version}: {e}")
+            return self._templates, self._prompts
+
+    def templates(self, db: Session) -> List[TemplateRecord]:
+        templates, _ = self._ensure_fresh(db)
+        return list(templates.values())
+
+    def get_template(self, db: Session, name: str) -> Optional[TemplateRecord]:
+        templates, _ = self._ensure_fresh(db)
+        return templates.get(name)
+
+    def prompts(self, db: Session) -> List[PromptRecord]:
+        _, prompts = self._ensure_fresh(db)
+        return list(prompts.values())
+
+    def get_prompt(self, db: Session, prompt_id: int) -> Optional[PromptRecord]:
+        _, prompts = self._ensure_fresh(db)
+        return prompts.get(prompt_id)
+
+    def active_prompt(self, db: Session) -> Optional[PromptRecord]:
+        _, prompts = self._ensure_fresh(db)
+        return next((p for p in prompts.values() if p.is_active == 1), None)
+
+    def default_prompt(self, db: Session) -> Optional[PromptRecord]:
+        _, prompts = self._ensure_fresh(db)
+        return next((p for p in prompts.values() if p.is_default == 1), None)
+
+    def invalidate(self, db: Session):
+        """Reload the local snapshot on next use and signal other workers to do the same"""
+        with self._lock:
+            self._stale = True
+        try:
+            result = db.execute(update(RegistryVersion).where(RegistryVersion.id == 1).values(
+                version=RegistryVersion.version + 1,
+                updated_at=datetime.utcnow(),
+            ))
+            if result.rowcount == 0:
+                db.add(RegistryVersion(id=1, version=1))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"Failed to bump registry version: {e}")
+
+
+def _validate_prompt(prompt: DBPrompt):
+    """Routing overrides go straight to the provider, so bad values must not get that far"""
+    max_tokens = prompt.max_tokens
+    if max_tokens is not None and (not isinstance(max_tokens, int) or isinstance(max_tokens, bool) or max_tokens <= 0):
+        raise RegistryError(f"Prompt {prompt.id} ({prompt.name!r}) has invalid max_tokens {max_tokens!r}; "
+                            f"expected a positive integer")
+    if prompt.model is not None and not isinstance(prompt.model, str):
+        raise RegistryError(f"Prompt {prompt.id} ({prompt.name!r}) has invalid model {prompt.model!r}")
+
+
+registry = Registry()
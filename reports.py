@@ -1,10 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import base64
+import binascii
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from sqlalchemy import event, select, tuple_
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from pydantic import BaseModel
 from datetime import datetime
 
 from database import get_db, Report
+from cache import response_cache
+from executor import run_db
+import archive
+import idempotency
+import search
 
 router = APIRouter()
 
@@ -26,34 +34,187 @@ class ReportResponse(ReportBase):
     class Config:
         orm_mode = True
 
+class ReportPage(BaseModel):
+    reports: List[ReportResponse]
+    next_cursor: Optional[str] = None
+
+class ReportSummary(BaseModel):
+    id: int
+    title: Optional[str] = None
+    created_at: Optional[datetime] = None
+    template_name: Optional[str] = None
+
+class ReportSummaryPage(BaseModel):
+    reports: List[ReportSummary]
+    next_cursor: Optional[str] = None
+
+# Columns needed to list reports without their bodies
+SUMMARY_COLUMNS = (Report.id, Report.title, Report.created_at, Report.template_name)
+
+# Keyset pagination helpers
+def encode_cursor(created_at: datetime, report_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{report_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, report_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(created_at), int(report_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def report_filters(template_name: Optional[str] = None,
+                   created_after: Optional[datetime] = None,
+                   created_before: Optional[datetime] = None) -> list:
+    conditions = []
+    if template_name:
+        conditions.append(Report.template_name == template_name)
+    if created_after:
+        conditions.append(Report.created_at >= created_after)
+    if created_before:
+        conditions.append(Report.created_at < created_before)
+    return conditions
+
+def page_statement(columns, limit: int, cursor: Optional[str] = None, **filters):
+    """Newest-first select of the given columns after the cursor, fetching one extra row"""
+    stmt = select(*columns).where(*report_filters(**filters))
+    if cursor:
+        created_at, report_id = decode_cursor(cursor)
+        # Row-value comparison lets the (created_at, id) index seek straight to the page
+        stmt = stmt.where(tuple_(Report.created_at, Report.id) < tuple_(created_at, report_id))
+    return stmt.order_by(Report.created_at.desc(), Report.id.desc()).limit(limit + 1)
+
+def split_page(rows: list, limit: int):
+    """Trim the extra row fetched by page_statement and derive the next cursor from the last row kept"""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].created_at, rows[-1].id)
+
+def query_reports_page(db: Session, limit: int, cursor: Optional[str] = None, **filters):
+    """Return newest-first reports after the cursor, and the cursor for the next page"""
+    rows = db.scalars(page_statement([Report], limit, cursor, **filters)).all()
+    rows, next_cursor = split_page(rows, limit)
+    return archive.rehydrate(db, rows), next_cursor
+
+def query_report_summaries(db: Session, limit: int, cursor: Optional[str] = None, **filters):
+    """Like query_reports_page, but selects only the listing columns.
+
+    The report bodies are never loaded and no ORM instances are built, so
+    listing cost does not depend on how long the reports are.
+    """
+    rows = db.execute(page_statement(SUMMARY_COLUMNS, limit, cursor, **filters)).all()
+    rows, next_cursor = split_page(rows, limit)
+    return [dict(row._mapping) for row in rows], next_cursor
+
+class SearchResult(BaseModel):
+    id: int
+    title: Optional[str] = None
+    created_at: Optional[datetime] = None
+    template_name: Optional[str] = None
+    highlight: Optional[str] = None
+    score: float
+
+class SearchResponse(BaseModel):
+    query: str
+    results: List[SearchResult]
+
+# Keep the full-text index in step with every report write, in the same transaction
+@event.listens_for(Report, "after_insert")
+@event.listens_for(Report, "after_update")
+def index_report(mapper, connection, target):
+    search.index_report(connection, target.id, target.title, target.raw_transcription, target.processed_text)
+
+@event.listens_for(Report, "after_delete")
+def unindex_report(mapper, connection, target):
+    search.remove_report(connection, target.id)
+
 # CRUD operations
 @router.post("/reports/", response_model=ReportResponse)
-def create_report(report: ReportCreate, db: Session = Depends(get_db)):
-    db_report = Report(
-        title=report.title,
-        raw_transcription=report.raw_transcription,
-        processed_text=report.processed_text,
-        template_name=report.template_name
-    )
+async def create_report(
+    report: ReportCreate,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    db: Session = Depends(get_db)
+):
+    def insert() -> ReportResponse:
+        db_report = Report(
+            title=report.title,
+            raw_transcription=report.raw_transcription,
+            processed_text=report.processed_text,
+            template_name=report.template_name
+        )
+        
+        db.add(db_report)
+        db.commit()
+        db.refresh(db_report)
+        
+        return ReportResponse.model_validate(db_report, from_attributes=True)
     
-    db.add(db_report)
-    db.commit()
-    db.refresh(db_report)
-    
-    return db_report
+    # A repeated Idempotency-Key returns the report created the first time
+    return await idempotency.run("reports", idempotency_key, idempotency.fingerprint(report),
+                                 lambda: run_db(insert))
 
 @router.get("/reports/", response_model=List[ReportResponse])
 def get_reports(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     # For now, we're not handling authentication, so we'll return all reports
     # In a real application, you would filter by the authenticated user's ID
-    reports = db.query(Report).offset(skip).limit(limit).all()
-    return reports
+    reports = db.query(Report).order_by(Report.id).offset(skip).limit(limit).all()
+    return archive.rehydrate(db, reports)
+
+@router.get("/reports/page", response_model=ReportPage)
+def get_reports_page(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    template_name: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    db: Session = Depends(get_db)
+):
+    """Newest-first reports with cursor pagination; pass next_cursor back to get the following page"""
+    reports, next_cursor = query_reports_page(
+        db, limit, cursor, template_name=template_name,
+        created_after=created_after, created_before=created_before
+    )
+    return {"reports": reports, "next_cursor": next_cursor}
+
+@router.get("/reports/summaries", response_model=ReportSummaryPage)
+def get_report_summaries(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    template_name: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    db: Session = Depends(get_db)
+):
+    """Same paging as /reports/page, returning only id, title, created_at and template_name"""
+    reports, next_cursor = query_report_summaries(
+        db, limit, cursor, template_name=template_name,
+        created_after=created_after, created_before=created_before
+    )
+    return {"reports": reports, "next_cursor": next_cursor}
+
+@router.get("/reports/search", response_model=SearchResponse)
+def search_reports(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    template_name: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Ranked full-text search over report titles, bodies and dictations"""
+    if not search.is_enabled():
+        raise HTTPException(status_code=501, detail="Full-text search is not available for this database")
+    results = search.search_reports(db.connection(), q, limit, offset, template_name)
+    return {"query": q, "results": results}
 
 @router.get("/reports/{report_id}", response_model=ReportResponse)
 def get_report(report_id: int, db: Session = Depends(get_db)):
     report = db.query(Report).filter(Report.id == report_id).first()
     if report is None:
         raise HTTPException(status_code=404, detail="Report not found")
+    # Bodies of old reports live in cold storage
+    archive.rehydrate(db, [report])
     return report
 
 @router.put("/reports/{report_id}", response_model=ReportResponse)
@@ -65,9 +226,12 @@ def update_report(report_id: int, report: ReportCreate, db: Session = Depends(ge
     # Update report fields
     for key, value in report.dict().items():
         setattr(db_report, key, value)
+    # An edited report is hot again; its old archived body is left for garbage collection
+    db_report.archive_digest = None
     
     db.commit()
     db.refresh(db_report)
+    response_cache.invalidate_report(report_id)
     
     return db_report
 
@@ -79,5 +243,6 @@ def delete_report(report_id: int, db: Session = Depends(get_db)):
     
     db.delete(db_report)
     db.commit()
+    response_cache.invalidate_report(report_id)
     
     return None
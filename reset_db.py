@@ -2,7 +2,7 @@ import os
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from database import Base, Template as DBTemplate
-from main import default_templates
+from defaults import default_templates
 
 # Get DATABASE_URL from environment
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -0,0 +1,235 @@
+"""Retries, hedged requests and a circuit breaker for LLM provider calls.
+
+Transient failures (429, 5xx, 529 overloaded, connection errors) are retried
+with exponential backoff and full jitter. When hedging is enabled, a second
+identical request is started if the first has not answered within the
+recent p95 latency, and whichever finishes first wins. Repeated transient
+failures open the circuit breaker, after which calls fail immediately with
+CircuitOpenError until a probe call succeeds.
+"""
+import os
+import math
+import time
+import sys
+import random
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+# Total attempts per call, including the first
+LLM_RETRY_ATTEMPTS = int(os.getenv("LLM_RETRY_ATTEMPTS", "3"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "0.5"))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "10"))
+
+# Hedging doubles the cost of slow calls, so it is off unless asked for
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+# Latency samples needed before the hedge threshold is trusted
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+# Consecutive transient failures that open the breaker, and how long it stays open
+LLM_BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", "5"))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+# Transient errors raised by providers whose exceptions carry no HTTP status (e.g. google.api_core)
+RETRYABLE_ERROR_NAMES = {
+    "ResourceExhausted", "ServiceUnavailable", "InternalServerError",
+    "DeadlineExceeded", "TooManyRequests", "OverloadedError",
+}
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the provider while the breaker is open"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("LLM provider is unavailable; failing fast while the circuit breaker is open")
+        self.retry_after = retry_after
+
+
+def status_code(exc: Exception) -> Optional[int]:
+    code = getattr(exc, "status_code", None) or getattr(exc, "code", None)
+    return code if isinstance(code, int) else None
+
+
+def is_retryable(exc: Exception) -> bool:
+    """Whether an error is transient, i.e. worth retrying and a sign of provider trouble"""
+    if isinstance(exc, asyncio.TimeoutError):
+        return True
+    # The SDK is imported lazily; if it was never loaded, this cannot be one of its errors
+    anthropic = sys.modules.get("anthropic")
+    if anthropic is not None and isinstance(exc, anthropic.APIConnectionError):
+        return True
+    if status_code(exc) in RETRYABLE_STATUS_CODES:
+        return True
+    return type(exc).__name__ in RETRYABLE_ERROR_NAMES
+
+
+def retry_after_hint(exc: Exception) -> Optional[float]:
+    """Seconds the provider asked us to wait, from a Retry-After header"""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """Opens after consecutive transient failures; lets one probe through after a cool-down"""
+
+    def __init__(self, failure_threshold: int = LLM_BREAKER_FAILURE_THRESHOLD,
+                 reset_seconds: float = LLM_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.times_opened = 0
+        self._opened_at = 0.0
+        self._probe_started: Optional[float] = None
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go to the provider now"""
+        now = time.monotonic()
+        if self.state == OPEN:
+            remaining = self.reset_seconds - (now - self._opened_at)
+            if remaining > 0:
+                raise CircuitOpenError(retry_after=math.ceil(remaining))
+            self.state = HALF_OPEN
+            self._probe_started = None
+            logger.info("Circuit breaker half-open; probing the provider")
+        if self.state == HALF_OPEN:
+            # One probe at a time; a probe that never reported back is replaced after the cool-down
+            if self._probe_started is not None and now - self._probe_started < self.reset_seconds:
+                raise CircuitOpenError(retry_after=math.ceil(self.reset_seconds - (now - self._probe_started)))
+            self._probe_started = now
+
+    def record_success(self):
+        if self.state != CLOSED:
+            logger.info("Circuit breaker closed; provider recovered")
+        self.state = CLOSED
+        self.failures = 0
+        self._probe_started = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+            self.state = OPEN
+            self.times_opened += 1
+            self._opened_at = time.monotonic()
+            self._probe_started = None
+            logger.error(f"Circuit breaker opened after {self.failures} consecutive provider failures")
+
+    def abandon(self):
+        """The call was cancelled before the provider answered"""
+        if self.state == HALF_OPEN:
+            self._probe_started = None
+
+    def snapshot(self) -> dict:
+        retry_after = 0
+        if self.state == OPEN:
+            retry_after = max(0, math.ceil(self.reset_seconds - (time.monotonic() - self._opened_at)))
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "failure_threshold": self.failure_threshold,
+            "times_opened": self.times_opened,
+            "retry_after_seconds": retry_after,
+        }
+
+
+class Resilience:
+    """Retry, hedging and circuit-breaker policy shared by every call of one engine"""
+
+    def __init__(self, attempts: int = LLM_RETRY_ATTEMPTS, base_delay: float = LLM_RETRY_BASE_SECONDS,
+                 max_delay: float = LLM_RETRY_MAX_SECONDS, hedge: bool = LLM_HEDGE_ENABLED,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge = hedge
+        self.breaker = breaker or CircuitBreaker()
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def backoff(self, attempt: int, exc: Exception) -> float:
+        """Full-jitter exponential backoff, never shorter than the provider's Retry-After"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        hint = retry_after_hint(exc)
+        return min(self.max_delay, max(delay, hint)) if hint else delay
+
+    async def after_failure(self, exc: Exception, attempt: int):
+        """Record a failed attempt; re-raise it unless another attempt should be made"""
+        if not is_retryable(exc):
+            # The provider answered, it just rejected this request
+            self.breaker.record_success()
+            raise exc
+        self.breaker.record_failure()
+        if attempt >= self.attempts:
+            raise exc
+        delay = self.backoff(attempt, exc)
+        self.retries += 1
+        logger.warning(f"Transient provider error ({exc}); retry {attempt}/{self.attempts - 1} in {delay:.2f}s")
+        await asyncio.sleep(delay)
+
+    async def call(self, attempt: Callable[[], Awaitable[T]], hedge_delay: Optional[float] = None) -> T:
+        """Run attempt() under the retry, hedging and breaker policy"""
+        for n in range(1, self.attempts + 1):
+            self.breaker.before_call()
+            try:
+                if self.hedge and hedge_delay is not None:
+                    result = await self._hedged(attempt, hedge_delay)
+                else:
+                    result = await attempt()
+            except Exception as e:
+                await self.after_failure(e, n)
+                continue
+            except BaseException:
+                self.breaker.abandon()
+                raise
+            self.breaker.record_success()
+            return result
+
+    async def _hedged(self, attempt: Callable[[], Awaitable[T]], delay: float) -> T:
+        """Start a backup request if the first is slower than `delay`; return the first success"""
+        first = asyncio.ensure_future(attempt())
+        pending = {first}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                self.hedges += 1
+                pending.add(asyncio.ensure_future(attempt()))
+            error: Optional[BaseException] = None
+            while True:
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+                if not pending:
+                    raise error
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # The losing request is abandoned
+            for task in pending:
+                task.cancel()
+
+    def snapshot(self) -> dict:
+        return {
+            "breaker": self.breaker.snapshot(),
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+        }
@@ -0,0 +1,125 @@
+"""Pick the model and max_tokens for each dictation.
+
+Short dictations go to the provider's fast model with a smaller output
+budget, long ones get a larger budget, and everything else uses the
+default model. Templates can require at least a given route (a full
+abdominal CT report is never "short"), and a Prompt row can pin its own
+model and/or max_tokens, which always wins.
+"""
+import os
+import logging
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from llm import LLM_MAX_TOKENS, LatencyStats, UsageStats
+from registry import PromptRecord
+
+logger = logging.getLogger(__name__)
+
+ROUTING_ENABLED = os.getenv("ROUTING_ENABLED", "true").lower() in ("1", "true", "yes")
+# Normalized dictation length (characters) at or below which the short route is used
+ROUTING_SHORT_MAX_CHARS = int(os.getenv("ROUTING_SHORT_MAX_CHARS", "600"))
+# Length at or above which the long route is used
+ROUTING_LONG_MIN_CHARS = int(os.getenv("ROUTING_LONG_MIN_CHARS", "3000"))
+ROUTING_SHORT_MAX_TOKENS = int(os.getenv("ROUTING_SHORT_MAX_TOKENS", "512"))
+ROUTING_LONG_MAX_TOKENS = int(os.getenv("ROUTING_LONG_MAX_TOKENS", "2048"))
+# Empty means the provider's fast model / the engine's default model
+ROUTING_FAST_MODEL = os.getenv("ROUTING_FAST_MODEL", "")
+ROUTING_LONG_MODEL = os.getenv("ROUTING_LONG_MODEL", "")
+# Minimum route per template, e.g. "abdominal_ct:standard,mri_brain:long"
+ROUTING_TEMPLATE_MIN_ROUTES = os.getenv("ROUTING_TEMPLATE_MIN_ROUTES", "abdominal_ct:standard")
+
+SHORT = "short"
+STANDARD = "standard"
+LONG = "long"
+ROUTES = (SHORT, STANDARD, LONG)
+
+
+@dataclass(frozen=True)
+class Route:
+    name: str
+    model: str
+    max_tokens: int
+
+
+def parse_template_routes(spec: str) -> Dict[str, str]:
+    routes = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        template_name, _, route = item.partition(":")
+        route = route.strip()
+        if route not in ROUTES:
+            raise ValueError(f"Unknown route '{route}' for template '{template_name.strip()}'")
+        routes[template_name.strip()] = route
+    return routes
+
+
+class RouteStats:
+    """Latency and token usage per route, for tuning the thresholds"""
+
+    def __init__(self):
+        self.latency = LatencyStats()
+        self.usage: Dict[str, UsageStats] = {}
+
+    def record(self, route: Route, seconds: float, usage: Optional[Dict[str, int]] = None, ok: bool = True):
+        self.latency.record(route.name, seconds, ok=ok)
+        if ok and usage is not None:
+            self.usage.setdefault(route.name, UsageStats()).record(usage)
+
+    def snapshot(self) -> dict:
+        report = {}
+        for name, latency in self.latency.snapshot().items():
+            usage = self.usage.get(name)
+            report[name] = {"latency": latency, "usage": usage.snapshot() if usage else None}
+        return report
+
+
+class Router:
+    """Routing policy for one engine"""
+
+    def __init__(
+        self,
+        default_model: str,
+        fast_model: str = "",
+        long_model: str = "",
+        default_max_tokens: int = LLM_MAX_TOKENS,
+        enabled: bool = ROUTING_ENABLED,
+        template_routes: Optional[Dict[str, str]] = None,
+    ):
+        self.enabled = enabled
+        self.routes = {
+            SHORT: Route(SHORT, fast_model or default_model, min(ROUTING_SHORT_MAX_TOKENS, default_max_tokens)),
+            STANDARD: Route(STANDARD, default_model, default_max_tokens),
+            LONG: Route(LONG, long_model or default_model, max(ROUTING_LONG_MAX_TOKENS, default_max_tokens)),
+        }
+        self.template_routes = template_routes if template_routes is not None else parse_template_routes(ROUTING_TEMPLATE_MIN_ROUTES)
+        self.stats = RouteStats()
+
+    def choose(self, text: str, template_name: Optional[str] = None,
+               prompt: Optional[PromptRecord] = None) -> Route:
+        if not self.enabled:
+            route = self.routes[STANDARD]
+        else:
+            if len(text) <= ROUTING_SHORT_MAX_CHARS:
+                name = SHORT
+            elif len(text) >= ROUTING_LONG_MIN_CHARS:
+                name = LONG
+            else:
+                name = STANDARD
+            minimum = self.template_routes.get(template_name or "")
+            if minimum and ROUTES.index(minimum) > ROUTES.index(name):
+                name = minimum
+            route = self.routes[name]
+        # Per-prompt overrides always win
+        if prompt is not None and (prompt.model or prompt.max_tokens):
+            route = Route(
+                f"{route.name}+prompt{prompt.id}",
+                prompt.model or route.model,
+                prompt.max_tokens or route.max_tokens,
+            )
+        return route
+
+
+def create_router(default_model: str, fast_model: str = "") -> Router:
+    return Router(default_model, fast_model=ROUTING_FAST_MODEL or fast_model, long_model=ROUTING_LONG_MODEL)
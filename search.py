@@ -0,0 +1,198 @@
+import re
+import html
+import logging
+from typing import List, Optional
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.engine import Connection
+
+from database import engine
+
+logger = logging.getLogger(__name__)
+
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_END = "</mark>"
+# Emitted by the database around matches, then swapped for the tags once the report text is escaped
+_MATCH_START = "\x02"
+_MATCH_END = "\x03"
+
+# Set once the index structures exist, so inserts never fail on a missing table
+_enabled = False
+
+
+def backend() -> Optional[str]:
+    """Name of the full-text backend for the configured database, if any"""
+    if engine.dialect.name == "sqlite":
+        return "fts5"
+    if engine.dialect.name == "postgresql":
+        return "tsvector"
+    return None
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def ensure_search_index():
+    """Create the search index if needed and bring it in line with the reports table"""
+    global _enabled
+    kind = backend()
+    if kind is None:
+        logger.warning(f"Full-text search is not supported on {engine.dialect.name}")
+        return
+    try:
+        with engine.begin() as conn:
+            if kind == "fts5":
+                conn.execute(text(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS reports_fts USING fts5("
+                    "title, raw_transcription, processed_text, tokenize='porter unicode61')"
+                ))
+                # Catch up on rows written while indexing was unavailable
+                conn.execute(text("DELETE FROM reports_fts WHERE rowid NOT IN (SELECT id FROM reports)"))
+                added = conn.execute(text(
+                    "INSERT INTO reports_fts (rowid, title, raw_transcription, processed_text) "
+                    "SELECT id, title, raw_transcription, processed_text FROM reports "
+                    "WHERE id NOT IN (SELECT rowid FROM reports_fts)"
+                )).rowcount
+                # Reports archived before their bodies were dropped from the index
+                conn.execute(text(
+                    "UPDATE reports_fts SET raw_transcription = NULL, processed_text = NULL "
+                    "WHERE rowid IN (SELECT id FROM reports WHERE archive_digest IS NOT NULL) "
+                    "AND (raw_transcription IS NOT NULL OR processed_text IS NOT NULL)"
+                ))
+            else:
+                conn.execute(text(
+                    "CREATE TABLE IF NOT EXISTS reports_search ("
+                    "report_id INTEGER PRIMARY KEY, document TSVECTOR NOT NULL)"
+                ))
+                conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_reports_search_document "
+                    "ON reports_search USING GIN (document)"
+                ))
+                conn.execute(text(
+                    "DELETE FROM reports_search WHERE report_id NOT IN (SELECT id FROM reports)"
+                ))
+                added = conn.execute(text(
+                    f"INSERT INTO reports_search (report_id, document) "
+                    f"SELECT id, {_TSVECTOR.format(title='title', processed='processed_text', raw='raw_transcription')} "
+                    f"FROM reports WHERE id NOT IN (SELECT report_id FROM reports_search)"
+                )).rowcount
+        _enabled = True
+        logger.info(f"Full-text search ready ({kind}); indexed {added} new reports")
+    except Exception as e:
+        logger.error(f"Failed to initialize full-text search: {e}")
+
+
+# Title matches rank above the report body, which ranks above the raw dictation
+_TSVECTOR = (
+    "setweight(to_tsvector('english', coalesce({title}, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce({processed}, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce({raw}, '')), 'C')"
+)
+
+
+def index_report(conn: Connection, report_id: int, title: Optional[str],
+                 raw_transcription: Optional[str], processed_text: Optional[str]):
+    """Add or replace a report in the index, inside the caller's transaction"""
+    if not _enabled:
+        return
+    params = {"id": report_id, "title": title, "raw": raw_transcription, "processed": processed_text}
+    if backend() == "fts5":
+        conn.execute(text("DELETE FROM reports_fts WHERE rowid = :id"), {"id": report_id})
+        conn.execute(text(
+            "INSERT INTO reports_fts (rowid, title, raw_transcription, processed_text) "
+            "VALUES (:id, :title, :raw, :processed)"
+        ), params)
+    else:
+        conn.execute(text(
+            f"INSERT INTO reports_search (report_id, document) "
+            f"VALUES (:id, {_TSVECTOR.format(title=':title', processed=':processed', raw=':raw')}) "
+            f"ON CONFLICT (report_id) DO UPDATE SET document = EXCLUDED.document"
+        ), params)
+
+
+def drop_archived_bodies(conn: Connection, report_ids: List[int]):
+    """Stop indexing the bodies of archived reports; their titles stay searchable.
+
+    FTS5 keeps its own copy of every indexed column, so leaving the bodies in
+    would keep the archived text in the database. The tsvector index stores
+    only lexemes, so on PostgreSQL archived bodies stay searchable.
+    """
+    if not _enabled or not report_ids or backend() != "fts5":
+        return
+    conn.execute(
+        text("UPDATE reports_fts SET raw_transcription = NULL, processed_text = NULL WHERE rowid IN :ids")
+        .bindparams(bindparam("ids", expanding=True)),
+        {"ids": report_ids},
+    )
+
+
+def remove_report(conn: Connection, report_id: int):
+    if not _enabled:
+        return
+    if backend() == "fts5":
+        conn.execute(text("DELETE FROM reports_fts WHERE rowid = :id"), {"id": report_id})
+    else:
+        conn.execute(text("DELETE FROM reports_search WHERE report_id = :id"), {"id": report_id})
+
+
+def fts5_query(query: str) -> str:
+    """Turn user input into a safe FTS5 expression.
+
+    Quoted text is kept as a phrase and every other word becomes a quoted term,
+    so punctuation in the input can never produce an FTS5 syntax error.
+    """
+    parts = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\w+)', query):
+        tokens = re.findall(r"\w+", phrase or word)
+        if tokens:
+            parts.append('"' + " ".join(tokens) + '"')
+    return " ".join(parts)
+
+
+def search_reports(conn: Connection, query: str, limit: int = 20, offset: int = 0,
+                   template_name: Optional[str] = None) -> List[dict]:
+    """Ranked matches for the query, best first, with highlighted snippets"""
+    params = {"limit": limit, "offset": offset, "template_name": template_name}
+    template_filter = "AND r.template_name = :template_name" if template_name else ""
+    if backend() == "fts5":
+        params["q"] = fts5_query(query)
+        if not params["q"]:
+            return []
+        sql = text(
+            f"SELECT r.id, r.title, r.created_at, r.template_name, "
+            f"snippet(reports_fts, -1, char(2), char(3), '...', 24) AS highlight, "
+            f"-bm25(reports_fts, 10.0, 1.0, 5.0) AS score "
+            f"FROM reports_fts JOIN reports r ON r.id = reports_fts.rowid "
+            f"WHERE reports_fts MATCH :q {template_filter} "
+            f"ORDER BY score DESC LIMIT :limit OFFSET :offset"
+        )
+    else:
+        params["q"] = query
+        params["headline_options"] = (
+            f"StartSel={_MATCH_START}, StopSel={_MATCH_END}, MaxFragments=2, MaxWords=24, MinWords=8"
+        )
+        sql = text(
+            f"SELECT r.id, r.title, r.created_at, r.template_name, "
+            # Archived reports have no body in the reports table, so their title is highlighted instead
+            f"ts_headline('english', CASE WHEN r.archive_digest IS NULL "
+            f"THEN coalesce(r.processed_text, '') || ' ' || coalesce(r.raw_transcription, '') "
+            f"ELSE coalesce(r.title, '') END, q, :headline_options) AS highlight, "
+            f"ts_rank(s.document, q) AS score "
+            f"FROM reports_search s JOIN reports r ON r.id = s.report_id, "
+            f"websearch_to_tsquery('english', :q) AS q "
+            f"WHERE s.document @@ q {template_filter} "
+            f"ORDER BY score DESC LIMIT :limit OFFSET :offset"
+        )
+    results = [dict(row._mapping) for row in conn.execute(sql, params)]
+    for result in results:
+        result["highlight"] = render_highlight(result["highlight"])
+    return results
+
+
+def render_highlight(fragment: Optional[str]) -> Optional[str]:
+    """HTML for a highlighted fragment: the report text escaped, the matches in <mark> tags"""
+    if fragment is None:
+        return None
+    escaped = html.escape(fragment)
+    return escaped.replace(_MATCH_START, HIGHLIGHT_START).replace(_MATCH_END, HIGHLIGHT_END)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""Production server: gunicorn managing uvicorn workers.
+
+The app is imported and the database bootstrapped once in the master
+process before forking, so workers start quickly and skip the bootstrap
+(with SERVER_PRELOAD=false each worker bootstraps on its own, which
+create_tables tolerates). Workers are recycled after SERVER_MAX_REQUESTS requests
+(with jitter so they do not all restart together). Timeouts are sized for
+long LLM calls. On SIGTERM each worker stops accepting connections, lets
+in-flight requests (including /process) finish for up to
+SERVER_GRACEFUL_TIMEOUT minus SHUTDOWN_DRAIN_SECONDS, then gives running
+background jobs SHUTDOWN_DRAIN_SECONDS before exiting.
+
+Connection pools, thread pools and LLM limits are per process in the app.
+Here they are read as totals for the server and divided among the
+workers. With more than one worker, jobs go through the database queue so
+that any worker can report on them.
+
+The platform's stop timeout (e.g. Railway's draining seconds) should be at
+least SERVER_GRACEFUL_TIMEOUT, or the container is killed mid-drain.
+
+Usage:
+    python serve.py
+"""
+import os
+import sys
+import glob
+import logging
+import tempfile
+
+from gunicorn.app.base import BaseApplication
+
+try:
+    from uvicorn_worker import UvicornWorker
+except ImportError:
+    # Older uvicorn releases ship the worker themselves
+    from uvicorn.workers import UvicornWorker
+
+logger = logging.getLogger("serve")
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+# Each worker is a single-threaded event loop. Not the host's cpu_count(): containers usually get a
+# fraction of it, and every worker holds its own share of the connection and rate limits below.
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "2")))
+SERVER_PRELOAD = os.getenv("SERVER_PRELOAD", "true").lower() in ("1", "true", "yes")
+# Restart each worker after this many requests to contain memory growth; 0 disables
+SERVER_MAX_REQUESTS = int(os.getenv("SERVER_MAX_REQUESTS", "2000"))
+SERVER_MAX_REQUESTS_JITTER = int(os.getenv("SERVER_MAX_REQUESTS_JITTER", "200"))
+# Longer than typical load-balancer idle timeouts (60s), so the proxy closes idle connections first
+SERVER_KEEPALIVE = int(os.getenv("SERVER_KEEPALIVE", "75"))
+# A worker that has not reported in this long is considered hung and restarted.
+# Must exceed the longest LLM call (LLM_TIMEOUT_SECONDS, 120 by default).
+SERVER_TIMEOUT = int(os.getenv("SERVER_TIMEOUT", "180"))
+# Total time a worker gets to shut down after SIGTERM before it is killed
+SERVER_GRACEFUL_TIMEOUT = int(os.getenv("SERVER_GRACEFUL_TIMEOUT", "180"))
+SERVER_LOG_LEVEL = os.getenv("SERVER_LOG_LEVEL", "info")
+
+# Read here only to split the graceful timeout; main.py uses the same variable
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "30"))
+
+# Server-wide totals split evenly among the workers, with the app's own (per-process) defaults.
+# Integer limits keep at least one per worker; 0 still means unlimited for the LLM rates.
+SERVER_WIDE_LIMITS = {
+    "DB_POOL_SIZE": "10",
+    "DB_MAX_OVERFLOW": "10",
+    "EXECUTOR_DB_WORKERS": "16",
+    "EXECUTOR_LLM_WORKERS": "8",
+    "LLM_MAX_CONCURRENCY": "8",
+    "LLM_REQUESTS_PER_MINUTE": "300",
+    "LLM_INPUT_TOKENS_PER_MINUTE": "200000",
+    "LLM_OUTPUT_TOKENS_PER_MINUTE": "40000",
+}
+
+# Workers share their metrics through this directory, so any of them can answer /metrics for all.
+# Set before the app (and metrics.py) is imported.
+os.environ.setdefault("METRICS_DIR", os.path.join(tempfile.gettempdir(), f"radiology-metrics-{PORT}"))
+
+
+class DrainingUvicornWorker(UvicornWorker):
+    """Uvicorn worker that bounds the wait for in-flight requests on shutdown.
+
+    Whatever is left of the graceful timeout is used by the app's lifespan
+    hook to drain background jobs.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.config.timeout_graceful_shutdown = max(1, int(self.cfg.graceful_timeout - SHUTDOWN_DRAIN_SECONDS - 5))
+
+
+def post_fork(server, worker):
+    # Connections opened by the master during bootstrap must not be shared with workers
+    import database
+    database.engine.dispose(close=False)
+
+
+def child_exit(server, worker):
+    # Keep the exited worker's counters, and stop its file from piling up or being overwritten on PID reuse
+    import metrics
+    metrics.mark_process_dead(worker.pid)
+
+
+def split_limits(workers: int):
+    """Replace each server-wide limit with one worker's share, before the app reads it"""
+    for name, default in SERVER_WIDE_LIMITS.items():
+        total = os.getenv(name, default)
+        if name.endswith("_PER_MINUTE"):
+            share = float(total) / workers
+        else:
+            share = max(1 if int(total) > 0 else 0, int(total) // workers)
+        os.environ[name] = str(share)
+
+
+def choose_job_queue(workers: int):
+    """Jobs kept in one worker's memory are invisible to the others, so GET /jobs/{id} would 404"""
+    if workers == 1:
+        return
+    backend = os.getenv("JOB_QUEUE_BACKEND")
+    if backend is None:
+        os.environ["JOB_QUEUE_BACKEND"] = "database"
+    elif backend.lower() == "local":
+        sys.exit(f"JOB_QUEUE_BACKEND=local does not work with {workers} workers; "
+                 f"use JOB_QUEUE_BACKEND=database or WEB_CONCURRENCY=1")
+
+
+def clear_metrics_dir():
+    """Counters start from zero with the server, as Prometheus expects after a restart"""
+    directory = os.environ["METRICS_DIR"]
+    os.makedirs(directory, exist_ok=True)
+    for pattern in ("*.json", "*.tmp"):
+        for path in glob.glob(os.path.join(directory, pattern)):
+            os.remove(path)
+
+
+class Server(BaseApplication):
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        import main
+        if self.cfg.preload_app:
+            # Once, in the master; each worker's lifespan hook then finds everything in place
+            main.bootstrap_database()
+        return main.app
+
+
+def options() -> dict:
+    return {
+        "bind": f"{HOST}:{PORT}",
+        "workers": WEB_CONCURRENCY,
+        "worker_class": "serve.DrainingUvicornWorker",
+        "preload_app": SERVER_PRELOAD,
+        "max_requests": SERVER_MAX_REQUESTS,
+        "max_requests_jitter": SERVER_MAX_REQUESTS_JITTER,
+        "keepalive": SERVER_KEEPALIVE,
+        "timeout": SERVER_TIMEOUT,
+        "graceful_timeout": SERVER_GRACEFUL_TIMEOUT,
+        "loglevel": SERVER_LOG_LEVEL,
+        "post_fork": post_fork,
+        "child_exit": child_exit,
+    }
+
+
+def main():
+    split_limits(WEB_CONCURRENCY)
+    choose_job_queue(WEB_CONCURRENCY)
+    clear_metrics_dir()
+    logger.info(f"Starting {WEB_CONCURRENCY} workers on {HOST}:{PORT}")
+    Server(options()).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -12,5 +12,6 @@ if ! [[ "$PORT" =~ ^[0-9]+$ ]]; then
   PORT=8000
 fi
 
-echo "Starting uvicorn on port $PORT"
-exec uvicorn main:app --host 0.0.0.0 --port $PORT
+export PORT
+echo "Starting server on port $PORT"
+exec python serve.py
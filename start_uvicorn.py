@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 import os
 import sys
-import subprocess
 import logging
 
 # Configure logging
@@ -14,7 +13,7 @@ logger = logging.getLogger("start_uvicorn")
 
 def main():
     """
-    Start the FastAPI application using uvicorn.
+    Start the FastAPI application with the production runner (serve.py).
     Uses PORT environment variable if available, otherwise defaults to 8000.
     """
     try:
@@ -28,19 +27,12 @@ def main():
             logger.warning(f"Invalid PORT value: {port}, using default 8000")
             port = "8000"
             
-        logger.info(f"Starting uvicorn on port {port}")
+        logger.info(f"Starting server on port {port}")
         
-        # Start uvicorn with the FastAPI app
-        cmd = [
-            "uvicorn", 
-            "main:app", 
-            "--host", "0.0.0.0",
-            "--port", port
-        ]
-        logger.info(f"Running command: {' '.join(cmd)}")
-        
-        # Execute uvicorn with the specified parameters
-        subprocess.run(cmd, check=True)
+        # Replace this process so SIGTERM goes straight to gunicorn for a graceful drain
+        os.environ["PORT"] = port
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "serve.py")
+        os.execv(sys.executable, [sys.executable, script])
         
     except Exception as e:
         logger.error(f"Error starting uvicorn: {e}")
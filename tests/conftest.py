@@ -0,0 +1,33 @@
+"""Test setup: a throwaway SQLite database and the stub LLM provider.
+
+The environment is set here, before any application module is imported,
+because configuration is read at import time.
+
+Run from the repository root with: python -m pytest
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+_TMP = tempfile.mkdtemp(prefix="radiology-tests-")
+
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_TMP, 'test.db')}"
+os.environ["LLM_PROVIDER"] = "stub"
+os.environ["LLM_STUB_LATENCY_MS"] = "0"
+os.environ["LLM_STUB_JITTER_MS"] = "0"
+os.environ["ARCHIVE_DIR"] = os.path.join(_TMP, "archive")
+os.environ.pop("METRICS_DIR", None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def client():
+    """The app with its startup and shutdown hooks run, shared by the whole session"""
+    from fastapi.testclient import TestClient
+    import main
+
+    with TestClient(main.app) as test_client:
+        yield test_client
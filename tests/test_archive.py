@@ -0,0 +1,26 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import text, update
+
+import archive
+from database import Report, SessionLocal
+
+
+def test_archiving_drops_bodies_from_fts_index(client):
+    response = client.post("/reports/", json={"title": "Archived knee MRI", "raw_transcription": "meniscal tear",
+                                               "processed_text": "Complex tear of the medial meniscus."})
+    report_id = response.json()["id"]
+
+    with SessionLocal() as db:
+        # Old enough to archive, unlike every other report in the test database
+        db.execute(update(Report.__table__).where(Report.__table__.c.id == report_id)
+                   .values(created_at=datetime.utcnow() - timedelta(days=365)))
+        db.commit()
+        assert archive.archive_batch(db, datetime.utcnow() - timedelta(days=30)) == 1
+        indexed = db.execute(text("SELECT title, raw_transcription, processed_text FROM reports_fts "
+                                  "WHERE rowid = :id"), {"id": report_id}).one()
+    assert tuple(indexed) == ("Archived knee MRI", None, None)
+
+    found = client.get("/reports/search", params={"q": "knee"}).json()["results"]
+    assert [result["id"] for result in found] == [report_id]
+    assert "meniscus" in client.get(f"/reports/{report_id}").json()["processed_text"]
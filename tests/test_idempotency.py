@@ -0,0 +1,36 @@
+import asyncio
+
+import idempotency
+
+
+def test_overlong_key_is_rejected(client):
+    response = client.post(
+        "/process",
+        json={"text": "no acute findings"},
+        headers={"Idempotency-Key": "k" * (idempotency.MAX_KEY_LENGTH + 1)},
+    )
+    assert response.status_code == 400
+    assert "Idempotency-Key" in response.json()["detail"]
+
+
+def test_slow_request_keeps_its_key(client, monkeypatch):
+    # The first request outlives the lock timeout several times over
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_LOCK_SECONDS", 0.3)
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_POLL_SECONDS", 0.02)
+    calls = []
+
+    async def slow():
+        calls.append(1)
+        await asyncio.sleep(1.2)
+        return {"n": len(calls)}
+
+    async def scenario():
+        first = asyncio.create_task(idempotency.run("test", "slow-key", "hash", slow))
+        await asyncio.sleep(0.6)
+        second = await idempotency.run("test", "slow-key", "hash", slow)
+        return await first, second
+
+    first, second = asyncio.run(scenario())
+    assert calls == [1]
+    assert first == {"n": 1}
+    assert second.headers["Idempotent-Replayed"] == "true"
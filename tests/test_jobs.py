@@ -0,0 +1,48 @@
+import asyncio
+
+import jobs
+from executor import run_db
+
+
+def test_workers_survive_claim_and_finish_errors(client, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_ERROR_BACKOFF_SECONDS", 0.01)
+    queue = jobs.DatabaseJobQueue(workers=2, poll_interval=0.01)
+    claim, store_result = queue._claim, queue._store_result
+    failures = {"claim": 4, "store": 1}
+
+    def flaky_claim():
+        # Enough failures to have killed both workers before the fix
+        if failures["claim"]:
+            failures["claim"] -= 1
+            raise RuntimeError("database is locked")
+        return claim()
+
+    def flaky_store_result(*args):
+        if failures["store"]:
+            failures["store"] -= 1
+            raise RuntimeError("server closed the connection unexpectedly")
+        return store_result(*args)
+
+    monkeypatch.setattr(queue, "_claim", flaky_claim)
+    monkeypatch.setattr(queue, "_store_result", flaky_store_result)
+
+    async def handler(payload):
+        return {"n": payload["n"]}
+
+    async def scenario():
+        await queue.start(handler)
+        try:
+            await asyncio.sleep(0.1)
+            submitted = [await queue.submit({"n": n}) for n in range(3)]
+            for _ in range(500):
+                views = [await run_db(queue.get, job["job_id"]) for job in submitted]
+                if all(view["status"] == jobs.SUCCEEDED for view in views):
+                    return views
+                await asyncio.sleep(0.01)
+            raise AssertionError(f"Jobs did not finish: {views}")
+        finally:
+            await queue.stop()
+
+    views = asyncio.run(scenario())
+    assert [view["result"] for view in views] == [{"n": 0}, {"n": 1}, {"n": 2}]
+    assert failures == {"claim": 0, "store": 0}
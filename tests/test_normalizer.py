@@ -0,0 +1,60 @@
+import re
+import random
+
+import pytest
+
+import normalizer
+
+CASES = [
+    ("Lesion five millimetres full stop", "Lesion 5 mm."),
+    ("forty two mm", "42 mm"),
+    ("one hundred and fifty millimetres", "150 mm"),
+    ("one hundred fifty millimetres", "150 mm"),
+    ("seven point two five cm", "7.25 cm"),
+    ("twenty-one percent", "21%"),
+    ("twenty - one percent", "21%"),
+    ("3.5 centimetres", "3.5 cm"),
+    # Runs of number words that are not one spoken number stay as dictated
+    ("ten twenty millimetres", "ten twenty millimetres"),
+    ("one two three mm", "one two three mm"),
+    ("twenty zero mm", "twenty zero mm"),
+    ("fourteen hundred mm", "fourteen hundred mm"),
+    ("two and three mm", "two and three mm"),
+    ("ranging ten - twenty millimetres", "ranging ten - twenty millimetres"),
+    ("The lungs are clear full stop new paragraph No effusion full stop", "The lungs are clear.\n\nNo effusion."),
+    ("normal open bracket stable close bracket full stop", "normal (stable)."),
+    ("Impression Colon Normal Full Stop", "Impression: Normal."),
+]
+
+
+@pytest.mark.parametrize("text, expected", CASES)
+def test_builtin_rules(text, expected):
+    assert normalizer.normalize(text, ["punctuation", "brackets", "numerals"]) == expected
+
+
+def test_numerals_disabled():
+    assert normalizer.normalize("five millimetres full stop", ["punctuation"]) == "five millimetres."
+
+
+WORDS = (
+    list(normalizer.NUMBER_WORDS) + ["point", "and", "-", "twenty-two"] + list(normalizer.UNITS)
+    + ["full stop", "comma", "new line", "new paragraph", "open bracket", "close bracket", "colon"]
+    + ["lesion", "ranging", "the", "liver", "stable", "12", "3.5"]
+)
+
+
+def _collapse(text):
+    return re.sub(r"[ \t]+", " ", text)
+
+
+def test_spacing_and_case_do_not_change_the_result():
+    """The same dictation gives the same report however it was spaced or capitalised"""
+    rng = random.Random(0)
+    normalize = normalizer.get_normalizer(["punctuation", "brackets", "numerals"])
+    for _ in range(5000):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(1, 12))]
+        text = " ".join(words)
+        spaced = "".join(word + rng.choice([" ", "  ", "\t", " \t "]) for word in words)
+        expected = _collapse(normalize(text))
+        assert _collapse(normalize(spaced)) == expected, (text, spaced)
+        assert normalize(text.upper()).lower() == expected.lower(), text
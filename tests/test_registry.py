@@ -0,0 +1,40 @@
+import pytest
+from sqlalchemy import update
+
+from database import SessionLocal, Prompt as DBPrompt
+from registry import Registry, RegistryError
+
+
+def test_prompt_api_rejects_non_positive_max_tokens(client):
+    for max_tokens in (0, -5, "lots"):
+        response = client.post("/prompts", json={"name": f"bad {max_tokens}", "content": "x",
+                                                 "max_tokens": max_tokens})
+        assert response.status_code == 422
+
+
+@pytest.mark.parametrize("max_tokens", [0, -1, "lots", 1.5])
+def test_invalid_max_tokens_rejects_the_registry_version(client, max_tokens):
+    response = client.post("/prompts", json={"name": f"routing {max_tokens!r}", "content": "x", "max_tokens": 512})
+    assert response.status_code == 200
+    prompt_id = response.json()["id"]
+    registry = Registry(check_interval=0)
+    with SessionLocal() as db:
+        assert registry.get_prompt(db, prompt_id).max_tokens == 512
+        loaded_version = registry.version
+
+        # Written behind the API's back, as a migration or manual fix might
+        db.execute(update(DBPrompt).where(DBPrompt.id == prompt_id).values(max_tokens=max_tokens))
+        db.commit()
+        registry.invalidate(db)
+        # The last valid snapshot keeps being served
+        assert registry.get_prompt(db, prompt_id).max_tokens == 512
+        assert registry.version == loaded_version
+
+        # Without a valid snapshot there is nothing safe to serve
+        with pytest.raises(RegistryError):
+            Registry().get_prompt(db, prompt_id)
+
+        db.execute(update(DBPrompt).where(DBPrompt.id == prompt_id).values(max_tokens=None))
+        db.commit()
+        registry.invalidate(db)
+        assert registry.get_prompt(db, prompt_id).max_tokens is None
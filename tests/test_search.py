@@ -0,0 +1,20 @@
+import search
+
+
+def test_highlight_escapes_report_html(client):
+    payload = '<script>alert(1)</script> <img src=x onerror=alert(2)> calcified granuloma'
+    response = client.post("/reports/", json={"title": "XSS check", "raw_transcription": payload,
+                                               "processed_text": payload})
+    assert response.status_code == 200
+
+    response = client.get("/reports/search", params={"q": "granuloma"})
+    assert response.status_code == 200
+    highlight = response.json()["results"][0]["highlight"]
+    assert "<script>" not in highlight and "<img" not in highlight
+    assert "&lt;script&gt;" in highlight
+    assert "<mark>granuloma</mark>" in highlight
+
+
+def test_render_highlight():
+    assert search.render_highlight("a < b \x02c\x03") == "a &lt; b <mark>c</mark>"
+    assert search.render_highlight(None) is None
@@ -0,0 +1,87 @@
+import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import main
+
+
+def events(response):
+    parsed = []
+    for frame in response.text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in frame.split("\n"))
+        parsed.append((lines["event"], json.loads(lines["data"])))
+    return parsed
+
+
+def report_of(parsed):
+    """The report a client would render: the streamed tokens and the final event"""
+    names = [name for name, _ in parsed]
+    assert names[-1] == "done", parsed
+    tokens = "".join(data["text"] for name, data in parsed if name == "token")
+    done = parsed[-1][1]
+    assert tokens == done["processed_text"]
+    return done
+
+
+@pytest.fixture
+def provider_calls(monkeypatch):
+    """Slow the stub provider down enough for requests to overlap, and count its calls"""
+    provider = main.llm_engine.provider
+    monkeypatch.setattr(provider, "latency_ms", 400)
+    calls = []
+    complete, stream = provider.complete, provider.stream
+
+    async def counted_complete(*args, **kwargs):
+        calls.append("complete")
+        return await complete(*args, **kwargs)
+
+    def counted_stream(*args, **kwargs):
+        calls.append("stream")
+        return stream(*args, **kwargs)
+
+    monkeypatch.setattr(provider, "complete", counted_complete)
+    monkeypatch.setattr(provider, "stream", counted_stream)
+    return calls
+
+
+def dictation():
+    return {"text": f"chest x ray {uuid.uuid4().hex} no acute findings"}
+
+
+def test_concurrent_streams_share_one_call(client, provider_calls):
+    body = dictation()
+    with ThreadPoolExecutor(3) as pool:
+        responses = list(pool.map(lambda _: client.post("/process/stream", json=body), range(3)))
+
+    reports = [report_of(events(response)) for response in responses]
+    assert provider_calls == ["stream"]
+    assert len({report["report_id"] for report in reports}) == 1
+
+
+def test_process_joins_a_running_stream(client, provider_calls):
+    body = dictation()
+    with ThreadPoolExecutor(2) as pool:
+        streamed = pool.submit(client.post, "/process/stream", json=body)
+        time.sleep(0.1)
+        processed = pool.submit(client.post, "/process", json=body)
+        streamed, processed = streamed.result(), processed.result()
+
+    assert provider_calls == ["stream"]
+    assert processed.json()["report_id"] == report_of(events(streamed))["report_id"]
+
+
+def test_stream_retry_with_same_key_is_replayed(client, provider_calls):
+    body = dictation()
+    headers = {"Idempotency-Key": uuid.uuid4().hex}
+    first = client.post("/process/stream", json=body, headers=headers)
+    second = client.post("/process/stream", json=body, headers=headers)
+
+    assert provider_calls == ["stream"]
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert report_of(events(second)) == report_of(events(first))
+
+    reused = client.post("/process/stream", json=dictation(), headers=headers)
+    assert reused.status_code == 422
@@ -0,0 +1,161 @@
+"""Request ids, structured logging and per-stage spans.
+
+TracingMiddleware gives every HTTP request an id (the caller's X-Request-ID
+when it looks sane, otherwise a new one) and echoes it in the response.
+The id is held in a context variable, so it follows the request into
+thread-pool work and provider calls. Every log record carries it as
+`request_id`. With LOG_FORMAT=json each record is written as one JSON
+object per line.
+
+span() times one stage of the pipeline, feeds process_stage_seconds and,
+for a sampled share of requests (TRACE_SAMPLE_RATE), logs a "span" event
+with the duration. Failed stages are always logged.
+"""
+import os
+import re
+import json
+import time
+import uuid
+import random
+import logging
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "text" (default) or "json"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+# Share of requests whose successful stages are logged as span events
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+
+REQUEST_ID_HEADER = "X-Request-ID"
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'
+
+# Caller-supplied ids are only trusted if they are short and log-safe
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
+# Record attributes that belong to the logging machinery, not to the event
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+request_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+sampled_var: contextvars.ContextVar[bool] = contextvars.ContextVar("trace_sampled", default=False)
+
+
+def current_request_id() -> str:
+    return request_id_var.get()
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+def bind(request_id: Optional[str] = None):
+    """Start a trace in the current context, e.g. for a background job"""
+    request_id_var.set(request_id or new_request_id())
+    sampled_var.set(random.random() < TRACE_SAMPLE_RATE)
+
+
+def request_headers() -> Dict[str, str]:
+    """Headers that carry the request id to the LLM provider"""
+    request_id = request_id_var.get()
+    return {REQUEST_ID_HEADER: request_id} if request_id != "-" else {}
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record; fields passed via `extra` become keys"""
+
+    def format(self, record):
+        event = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS:
+                event[key] = value
+        if record.exc_info:
+            event["exception"] = self.formatException(record.exc_info)
+        return json.dumps(event, default=str)
+
+
+def configure_logging():
+    """Set the root log level and format and attach the request id to every record"""
+    logging.basicConfig(level=LOG_LEVEL, format=TEXT_FORMAT)
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    for handler in root.handlers:
+        if not any(isinstance(f, RequestIdFilter) for f in handler.filters):
+            handler.addFilter(RequestIdFilter())
+        handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+
+
+def event(name: str, level: int = logging.INFO, **fields):
+    """Log a structured event if the level is enabled (and, below WARNING, if the request is sampled)"""
+    if not logger.isEnabledFor(level):
+        return
+    if level < logging.WARNING and not sampled_var.get():
+        return
+    logger.log(level, name, extra={"event": name, **fields})
+
+
+@contextmanager
+def span(stage: str, **fields):
+    """Time one pipeline stage into metrics and the trace log"""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        duration = time.perf_counter() - started
+        metrics.process_stage_seconds.observe(duration, stage=stage)
+        event("span", logging.WARNING, stage=stage, duration_ms=round(duration * 1000, 3),
+              error=type(e).__name__, **fields)
+        raise
+    duration = time.perf_counter() - started
+    metrics.process_stage_seconds.observe(duration, stage=stage)
+    event("span", stage=stage, duration_ms=round(duration * 1000, 3), **fields)
+
+
+class TracingMiddleware:
+    """ASGI middleware that binds a request id and logs one summary event per request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        incoming = ""
+        for name, value in scope.get("headers", []):
+            if name == b"x-request-id":
+                incoming = value.decode("latin-1")
+                break
+        bind(incoming if _VALID_REQUEST_ID.match(incoming) else None)
+        request_id = request_id_var.get().encode("latin-1")
+        status = {"code": 500}
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id)]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or scope["path"]
+            level = logging.WARNING if status["code"] >= 500 else logging.INFO
+            event("request", level, method=scope["method"], route=route, status=status["code"],
+                  duration_ms=round((time.perf_counter() - started) * 1000, 3))